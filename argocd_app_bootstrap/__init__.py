@@ -1,18 +1,75 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import importlib
 
 # Invoke magic
 from invoke import Collection, task
 
-import argocd_app_bootstrap.tasks.common.actions as common_actions
-import argocd_app_bootstrap.tasks.argocd.setup.actions as argo_setup_actions
-import argocd_app_bootstrap.tasks.argocd.run.actions as argo_un_actions
-import argocd_app_bootstrap.tasks.deploy.setup.actions as scaffold_actions
-
-ns = Collection(
-    common=common_actions,
-    argo_setup=argo_setup_actions,
-    argo_run=argo_un_actions,
-    deploy_setup=scaffold_actions,
-)
+# Task modules, by collection name. A module is only imported when one of its tasks is
+# needed, so that e.g. --version or a single task doesn't import every task (and its
+# dependencies).
+TASK_MODULES = {
+    "common": "argocd_app_bootstrap.tasks.common.actions",
+    "argo_setup": "argocd_app_bootstrap.tasks.argocd.setup.actions",
+    "argo_run": "argocd_app_bootstrap.tasks.argocd.run.actions",
+    "deploy_setup": "argocd_app_bootstrap.tasks.deploy.setup.actions",
+    "daemon": "argocd_app_bootstrap.tasks.daemon.actions",
+    "batch": "argocd_app_bootstrap.tasks.batch.actions",
+}
+
+_collections = {}
+
+## ------------------
+
+
+def get_collection(name: str):
+    """
+    Get the task collection with the given name, importing its module on first use.
+
+    Args:
+        name (str): Collection name, as in TASK_MODULES (dashes or underscores)
+
+    Returns:
+        Collection: The module's tasks
+    """
+
+    name = name.replace("-", "_")
+    if name not in _collections:
+        module = importlib.import_module(TASK_MODULES[name])
+        _collections[name] = Collection.from_module(module, name=name)
+
+    return _collections[name]
+
+
+## ------------------
+
+
+def get_namespace(names=None):
+    """
+    Build the root task namespace out of the given collections.
+
+    Args:
+        names (list, optional): Collection names. Defaults to all of them.
+
+    Returns:
+        Collection: The root namespace
+    """
+
+    ns = Collection()
+    for name in TASK_MODULES:
+        if (names is None) or (name in names):
+            ns.add_collection(get_collection(name))
+
+    return ns
+
+
+## ------------------
+
+
+def __getattr__(name):
+    # `invoke --collection=argocd_app_bootstrap` looks up ns, which loads every collection
+    if name == "ns":
+        return get_namespace()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
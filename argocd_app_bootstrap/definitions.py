@@ -1,11 +1,29 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os
-from ruamel.yaml import YAML
+import os, functools
 
+from collections.abc import MutableMapping
 
-yaml = YAML()
+
+class LazyYAML:
+    """
+    ruamel.yaml YAML instance that is only created (and ruamel only imported) the first
+    time it's used, so that commands that never touch YAML don't pay for it.
+    """
+
+    _yaml = None
+
+    def __getattr__(self, name):
+        if self._yaml is None:
+            from ruamel.yaml import YAML
+
+            self._yaml = YAML()
+
+        return getattr(self._yaml, name)
+
+
+yaml = LazyYAML()
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -17,17 +35,72 @@ if os.environ.get("ENV") is None:
 if os.environ.get("USE_LOCAL_ARGO_PROJ") is None:
     os.environ["USE_LOCAL_ARGO_PROJ"] = "false"
 
-with open(os.path.join(ROOT_DIR, "config.yml"), "r") as stream:
-    try:
-        configs = yaml.load(stream)
-        APP_CONFIG = configs[os.environ.get("ENV")]
-    except Exception as error:
-        print(error)
+
+@functools.lru_cache(maxsize=None)
+def load_config():
+    """
+    Load the settings for the current environment (ENV) from config.yml. The file is
+    only parsed once per process.
+
+    Returns:
+        dict: The environment's settings
+    """
+
+    with open(os.path.join(ROOT_DIR, "config.yml"), "r") as stream:
+        try:
+            configs = yaml.load(stream)
+            return configs[os.environ.get("ENV")]
+        except Exception as error:
+            print(error)
+            raise
+
+
+class LazyConfig(MutableMapping):
+    """
+    Read-write view of the settings returned by load_config. config.yml is only parsed
+    the first time a setting is looked up.
+    """
+
+    def __getitem__(self, key):
+        return load_config()[key]
+
+    def __setitem__(self, key, value):
+        load_config()[key] = value
+
+    def __delitem__(self, key):
+        del load_config()[key]
+
+    def __iter__(self):
+        return iter(load_config())
+
+    def __len__(self):
+        return len(load_config())
+
+
+APP_CONFIG = LazyConfig()
 
 
 TEMPLATES_PATH = os.path.join(ROOT_DIR, "templates")
 DEPLOY_TEMPLATES_PATH = os.path.join(TEMPLATES_PATH, "deploy")
-DATA_PATH = os.path.join(ROOT_DIR, "data")
+
+# Working copies of the repos, wiped on every run. Each daemon worker gets its own.
+DATA_PATH = os.environ.get("ARGOCD_BOOTSTRAP_DATA", os.path.join(ROOT_DIR, "data"))
+
+# Persistent caches live outside DATA_PATH, since DATA_PATH is wiped on every run
+CACHE_PATH = os.environ.get(
+    "ARGOCD_BOOTSTRAP_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "argocd_app_bootstrap"),
+)
+TEMPLATES_CACHE_PATH = os.path.join(CACHE_PATH, "templates")
+GIT_MIRRORS_PATH = os.path.join(CACHE_PATH, "mirrors")
+# ArgoCD session tokens, owner-only, one file per API server and user
+ARGOCD_SESSIONS_PATH = os.path.join(CACHE_PATH, "sessions")
+
+# Socket, job logs and worker data dirs of the daemon (argo-bootstrap daemon.serve)
+DAEMON_PATH = os.path.join(CACHE_PATH, "daemon")
+
+# Logs and worker data dirs of batch runs (argo-bootstrap batch.run), one folder per run
+BATCH_PATH = os.path.join(CACHE_PATH, "batch")
 
 # ArgoCD app folder structure
 ARGOCD_DIR = "argocd"
@@ -43,17 +116,27 @@ PROJECTS_PATH = os.path.join(ARGOCD_PATH, PROJECTS_DIR)
 APPS_PARENT_PATH = os.path.join(ARGOCD_PATH, APPS_PARENT_DIR)
 APPS_CHILDREN_PATH = os.path.join(ARGOCD_PATH, APPS_CHILDREN_DIR)
 
+# Index of the resources generated in the parent repo, used by the run tasks
+MANIFEST_INDEX_FILE = ".index.json"
+MANIFEST_INDEX_PATH = os.path.join(ARGOCD_PATH, MANIFEST_INDEX_FILE)
+
 ROOT_APP = "root-app"
 ARGO_PROJ_YAML = "argo_proj.yml"
 
 ARGOCD_ROOT = "argocd"
 
 # App deployment folder structure (Helm + Kustomize)
+KUSTOMIZED_HELM_DIR = "kustomized_helm"
+HELM_BASE_DIR = "helm_base"
+HELM_TEMPLATES_DIR = "templates"
+OVERLAYS_DIR = "overlays"
+
+# Each child app is cloned into its own workspace under CHILD_REPOS_PATH
 CHILD_REPOS_PATH = os.path.join(DATA_PATH, "child_repos")
-KUSTOMIZED_HELM_PATH = os.path.join(CHILD_REPOS_PATH, "kustomized_helm")
-HELM_BASE_PATH = os.path.join(KUSTOMIZED_HELM_PATH, "helm_base")
-HELM_TEMPLATES_PATH = os.path.join(HELM_BASE_PATH, "templates")
+KUSTOMIZED_HELM_PATH = os.path.join(CHILD_REPOS_PATH, KUSTOMIZED_HELM_DIR)
+HELM_BASE_PATH = os.path.join(KUSTOMIZED_HELM_PATH, HELM_BASE_DIR)
+HELM_TEMPLATES_PATH = os.path.join(HELM_BASE_PATH, HELM_TEMPLATES_DIR)
 
-OVERLAYS_PATH = os.path.join(KUSTOMIZED_HELM_PATH, "overlays")
+OVERLAYS_PATH = os.path.join(KUSTOMIZED_HELM_PATH, OVERLAYS_DIR)
 
 PATCH_DIR = "patch"
@@ -1,15 +1,265 @@
-from . import *
+import os
+
+from . import TASK_MODULES, get_namespace
 
 from ._version import __version__
-from invoke import Program
+from .utils import tracing
+from invoke import Argument, Executor, Program
 
 
 version = __version__
 
-program = Program(
+## ------------------
+
+
+class TracedTask:
+    """
+    Wraps a task so that each call is recorded as a span. Everything else is passed
+    through to the task.
+
+    Args:
+        task (Task): The task to wrap
+    """
+
+    def __init__(self, task):
+        self.task = task
+
+    def __getattr__(self, name):
+        return getattr(self.task, name)
+
+    def __call__(self, *args, **kwargs):
+        with tracing.span(self.task.name, tracing.CATEGORY_TASK):
+            return self.task(*args, **kwargs)
+
+
+class TracingExecutor(Executor):
+    """
+    Executor that records a span for every task it runs (including pre and post tasks),
+    when tracing is on.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.traced_tasks = {}
+
+    def expand_calls(self, calls):
+        expanded = super().expand_calls(calls)
+        if not tracing.is_enabled():
+            return expanded
+
+        # The same task must map to the same wrapper, so that calls are still deduped
+        for call in expanded:
+            if not isinstance(call.task, TracedTask):
+                if call.task not in self.traced_tasks:
+                    self.traced_tasks[call.task] = TracedTask(call.task)
+                call.task = self.traced_tasks[call.task]
+
+        return expanded
+
+
+class GraphExecutor(TracingExecutor):
+    """
+    Executor that runs the steps (pre and post tasks) of each task as a graph, so that
+    steps that don't need each other run at the same time (see utils.task_graph). Tasks
+    named on the command line still run one after the other. Each step gets its own copy
+    of the config, as each app does in scaffold_k8s_deployment. What a step changes in the
+    config is merged back when it's done, before the steps that need it start.
+    """
+
+    def execute(self, *tasks):
+        # Imported here, since --help and --version never run a task
+        from invoke.config import copy_dict
+        from .utils import task_graph
+        from .utils.common import LOG_WARN, publish, str2bool
+
+        try:
+            dedupe = self.config.tasks.dedupe
+        except AttributeError:
+            dedupe = True
+
+        direct = self.normalize(tasks)
+        calls = []
+        needs = {}
+        concurrent = False
+        for direct_call in direct:
+            group_start = len(calls)
+            declared = task_graph.get_needs(get_task(direct_call))
+            concurrent = concurrent or bool(declared)
+
+            body = None
+            for call in self.expand_calls([direct_call]):
+                if dedupe and (call in calls):
+                    continue
+
+                # A declared step needs the tasks named before its own on the command
+                # line, its own task if it's a post task, and the steps it declares.
+                # Any other step needs every step before it.
+                step = len(calls)
+                task = get_task(call)
+                if call is direct_call:
+                    body = step
+                    needs[step] = list(range(step))
+                elif task in declared:
+                    needs[step] = list(range(group_start)) + [
+                        other
+                        for other in range(group_start, step)
+                        if (other == body) or (get_task(calls[other]) in declared[task])
+                    ]
+                else:
+                    needs[step] = list(range(step))
+                calls.append(call)
+
+        results = {}
+        started = {}
+
+        def prepare(step):
+            call = calls[step]
+            self.config.load_collection(self.collection.configuration(call.called_as))
+            self.config.load_shell_env()
+            config = self.config.clone()
+            started[step] = (config, copy_dict(config._modifications))
+            context = call.make_context(config)
+
+            def run():
+                results[call.task] = call.task(context, *call.args, **call.kwargs)
+
+            return run
+
+        def on_done(step):
+            config, modifications = started[step]
+            for key, value in config._modifications.items():
+                if (key not in modifications) or (modifications[key] != value):
+                    self.config[key] = value
+
+            call = calls[step]
+            if (call in direct) and call.autoprint:
+                print(results[call.task])
+
+        # Steps only leave the main thread when some of them can run side by side
+        max_workers = task_graph.get_max_workers() if concurrent else 1
+        try:
+            timings = task_graph.run_graph(
+                list(range(len(calls))), needs, prepare, max_workers, on_done
+            )
+        except BaseException:
+            skipped = [
+                call.task.name for step, call in enumerate(calls) if step not in started
+            ]
+            if skipped:
+                publish(
+                    f"WARN: Skipped after a failed step: {', '.join(skipped)}", LOG_WARN
+                )
+            raise
+
+        critical_path = os.environ.get("CRITICAL_PATH", "false")
+        if self.core is not None:
+            critical_path = self.core[0].args["critical-path"].value or critical_path
+        if str2bool(critical_path):
+            task_graph.publish_critical_path(
+                timings,
+                needs,
+                {step: call.task.name for step, call in enumerate(calls)},
+            )
+
+        return results
+
+
+def get_task(call):
+    """
+    Get the task of a call, without the tracing wrapper.
+
+    Args:
+        call (Call): Invoke call
+
+    Returns:
+        Task: The task
+    """
+
+    return call.task.task if isinstance(call.task, TracedTask) else call.task
+
+
+## ------------------
+
+
+class LazyProgram(Program):
+    """
+    Program that only loads the task collections named on the command line. --version
+    doesn't load any, and --list, or --help without a task name, loads all of them.
+    """
+
+    def core_args(self):
+        return super().core_args() + [
+            Argument(
+                names=("trace",),
+                help="Write a Chrome trace of the tasks and commands run to this file. Defaults to TRACE_FILE.",
+            ),
+            Argument(
+                names=("critical-path",),
+                kind=bool,
+                help="Log the chain of steps that set how long the run took. Defaults to CRITICAL_PATH.",
+            ),
+        ]
+
+    def requested_collections(self):
+        """
+        Get the names of the collections that the command line refers to.
+
+        Returns:
+            list: Collection names, or None for all of them
+        """
+
+        if self.args.list.value or self.args.complete.value:
+            return None
+
+        names = []
+        for arg in self.core.unparsed + [self.args.help.value]:
+            if isinstance(arg, str) and (not arg.startswith("-")) and ("." in arg):
+                name = arg.split(".", 1)[0].replace("-", "_")
+                if (name in TASK_MODULES) and (name not in names):
+                    names.append(name)
+
+        return names or None
+
+    def parse_collection(self):
+        self.namespace = get_namespace(self.requested_collections())
+        super().parse_collection()
+
+    def execute(self):
+        # Imported here, since --help and --version never run a task
+        from .utils import limits
+
+        # Counters are per run (e.g. per daemon job). Learned limits are kept.
+        limits.reset_stats()
+        try:
+            self.execute_traced()
+        finally:
+            limits.publish_stats()
+
+    def execute_traced(self):
+        """
+        Run the tasks, recording a trace if one was asked for.
+        """
+
+        trace_path = self.args.trace.value or os.environ.get("TRACE_FILE")
+        if not trace_path:
+            return super().execute()
+
+        tracing.enable()
+        try:
+            with tracing.span(
+                self.binary, tracing.CATEGORY_PROGRAM, argv=" ".join(self.argv)
+            ):
+                super().execute()
+        finally:
+            tracing.export(trace_path)
+
+
+## ------------------
+
+program = LazyProgram(
     name="ArgoCD App Bootstrap",
-    namespace=ns,
     version=version,
     binary="argo-bootstrap",
     binary_names=["argo-bootstrap"],
+    executor_class=GraphExecutor,
 )
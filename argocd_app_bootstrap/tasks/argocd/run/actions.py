@@ -9,24 +9,67 @@ from invoke.tasks import Task
 import argocd_app_bootstrap.tasks.common.actions as common_actions
 import argocd_app_bootstrap.tasks.argocd.setup.actions as setup
 
-from argocd_app_bootstrap.definitions import (
-    APPS_PARENT_PATH,
-    ARGOCD_PATH,
-    PROJECTS_PATH,
-    ROOT_APP,
-    yaml,
+from argocd_app_bootstrap.definitions import APP_CONFIG, PARENT_REPO_PATH
+
+from argocd_app_bootstrap.utils import (
+    app_sets,
+    argocd,
+    common,
+    manifest_index,
+    sync,
+    task_graph,
 )
-
-from argocd_app_bootstrap.utils import common
 from argocd_app_bootstrap.utils.common import LOG_ERROR, LOG_INFO, LOG_WARN, publish
 
 ## ------------------
 
 
+def get_generated_resources(ctxt, role: str, required=True):
+    """
+    Get the generated resources of a given role for the target environment, from the
+    manifest index written by setup-app-of-apps. Parent repos set up before the index
+    existed don't have one, in which case the generated YAML files are parsed instead.
+    The index is only loaded once per run.
+
+    Args:
+        ctxt (Context): Invoke context
+        role (str): What the resources are for (manifest_index.ROLE_*)
+        required (bool, optional): Raise an exception if there is none. Defaults to True.
+
+    Raises:
+        Exception: Raised if there is no resource of that role for the environment, and one is required.
+
+    Returns:
+        list: Resources, each with its path relative to the parent repo
+    """
+
+    environment = ctxt["target_environment"]
+    index = ctxt.config.get("manifest_index")
+    if index is None:
+        index = manifest_index.load_index()
+        if index is None:
+            publish(
+                "WARN: No manifest index found in the parent repo, reading the generated files instead. Re-run setup-app-of-apps to create it.",
+                LOG_WARN,
+            )
+            index = manifest_index.scan_index(environment)
+        ctxt.config["manifest_index"] = index
+
+    resources = manifest_index.lookup(index, environment, role)
+    if required and (not resources):
+        raise Exception(f"No generated {role} found for [{environment}] environment")
+
+    return resources
+
+
+## ------------------
+
+
 @task()
 def register_repos(ctxt):
     """
-    Register the repos in ArgoCD that are specified in the argo_proj.yml.
+    Register the repos in ArgoCD that are specified in the argo_proj.yml. Repos that are
+    already registered are skipped, and the rest are registered up to ctxt["jobs"] at a time.
 
     ** This is a helper task and should not be called on its own.
     """
@@ -36,7 +79,7 @@ def register_repos(ctxt):
 
     try:
 
-        if "argo_proj_yaml" not in ctxt:
+        if "argo_proj" not in ctxt:
             raise Exception("Missing app config")
 
         repos_list = common.get_repos(ctxt)
@@ -45,11 +88,56 @@ def register_repos(ctxt):
             if ctxt.config["git_username"] is not None
             else "blah"
         )
-        for repo_url in repos_list:
-            common.run_command(
-                ctxt,
-                f"argocd repo add {repo_url} --username {git_username} --password {ctxt.config['git_token']}",
-            )
+        backend = argocd.get_backend(ctxt)
+        missing_repos, _ = argocd.diff_repos(repos_list, backend.repo_list())
+        publish(
+            f"INFO: {len(repos_list) - len(missing_repos)}/{len(repos_list)} repos already registered",
+            LOG_INFO,
+        )
+
+        errors = common.run_concurrently(
+            lambda repo_url: backend.repo_add(
+                repo_url, git_username, ctxt.config["git_token"]
+            ),
+            missing_repos,
+            jobs=ctxt.config.get("jobs", 1),
+        )
+        if errors:
+            failed = [
+                f"{missing_repos[index]} ({str(error).strip()})"
+                for index, error in sorted(errors.items())
+            ]
+            raise Exception(f"Failed to register repos: {', '.join(failed)}")
+
+        publish(f"SUCCESS: {task_desc}", LOG_INFO)
+
+    except Exception as e:
+        publish(f"FAIL: {task_desc}. CAUSE: {str(e)}", LOG_ERROR)
+        raise e
+
+
+## ------------------
+
+
+@task()
+def apply_project(ctxt):
+    """
+    Create the ArgoCD project of the target environment in Kubernetes.
+
+    ** This is a helper task and should not be called on its own.
+    """
+
+    environment = ctxt["target_environment"]
+    task_desc = f"Creating ArgoCD project for [{environment}] environment"
+    publish(f"START: {task_desc}", LOG_INFO)
+
+    try:
+        project = get_generated_resources(ctxt, manifest_index.ROLE_PROJECT)[0]
+        common.run_command(
+            ctxt,
+            f"kubectl apply -f {os.path.join(PARENT_REPO_PATH, project['path'])}",
+            retry=True,
+        )
 
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
@@ -64,7 +152,8 @@ def register_repos(ctxt):
 @task()
 def apply_and_sync(ctxt):
     """
-    Deploy the ArgoCD "App of Apps" manifests to Kubernetes, and sync all related apps.
+    Deploy the ArgoCD "App of Apps" root app to Kubernetes, and sync all related apps.
+    Waits until the child apps are all Synced and Healthy, or until the sync timeout expires.
     
     ** This is a helper task and should not be called on its own.
     """
@@ -75,27 +164,42 @@ def apply_and_sync(ctxt):
 
     try:
 
-        # Create ArgoCD project
-        common.run_command(
-            ctxt, f"kubectl apply -f {PROJECTS_PATH}/project-{environment}.yml"
-        )
-
         # Apply and sync master app
-        with open(f"{ARGOCD_PATH}/{ROOT_APP}-{environment}.yml", "r") as stream:
-            root_app_yaml = yaml.load(stream)
-            root_app_name = root_app_yaml["metadata"]["name"]
-
+        root_app = get_generated_resources(ctxt, manifest_index.ROLE_ROOT_APP)[0]
         common.run_command(
-            ctxt, f"kubectl apply -f {ARGOCD_PATH}/{ROOT_APP}-{environment}.yml"
+            ctxt,
+            f"kubectl apply -f {os.path.join(PARENT_REPO_PATH, root_app['path'])}",
+            retry=True,
         )
-        common.run_command(ctxt, f"argocd app sync {root_app_name}")
+        backend = argocd.get_backend(ctxt)
+        sync_config = APP_CONFIG.get("sync", {})
+        root_report = sync.sync_apps(
+            backend,
+            [root_app["name"]],
+            timeout=sync_config.get("timeout-seconds", 600),
+            interval=sync_config.get("poll-interval-seconds", 5),
+        )
+        if root_report["status"] != sync.STATE_READY:
+            root_state = root_report["apps"][0]
+            raise Exception(
+                f"Root app [{root_app['name']}] did not become ready: {root_state['state']} {root_state['error'] or ''}".strip()
+            )
 
-        parent_app_name = f'{ctxt["argo_proj_yaml"]["argocd"]["parent_app"]["name"]}-app-{environment}'
+        child_app_names, selector = get_child_apps(ctxt, root_app)
 
-        common.run_command(
-            ctxt,
-            f"argocd app sync -l app.kubernetes.io/instance=root-{parent_app_name}",
+        report = sync.sync_apps(
+            backend,
+            child_app_names,
+            selector=selector,
+            jobs=ctxt.config.get("jobs", 1),
+            timeout=sync_config.get("timeout-seconds", 600),
+            interval=sync_config.get("poll-interval-seconds", 5),
         )
+        ctxt.config["sync_report"] = report
+        sync.publish_sync_report(report, ctxt.config.get("sync_report_path"))
+
+        if report["status"] != sync.STATE_READY:
+            raise Exception(f"Child apps did not all become ready: {report['status']}")
 
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
@@ -107,22 +211,84 @@ def apply_and_sync(ctxt):
 ## ------------------
 
 
+def get_child_apps(ctxt, root_app: dict):
+    """
+    Get the names of the child apps of the target environment, and a label selector
+    that matches them. Child apps generated by ApplicationSets are found by expanding
+    the ApplicationSets locally.
+
+    Args:
+        ctxt (Context): Invoke context
+        root_app (dict): The environment's root app resource
+
+    Raises:
+        Exception: Raised if there are neither child apps nor ApplicationSets for the environment.
+
+    Returns:
+        tuple: (child app names, label selector)
+    """
+
+    child_apps = get_generated_resources(
+        ctxt, manifest_index.ROLE_CHILD_APP, required=False
+    )
+    if child_apps:
+        return (
+            [child_app["name"] for child_app in child_apps],
+            f"app.kubernetes.io/instance={root_app['name']}",
+        )
+
+    app_set_paths = [
+        os.path.join(PARENT_REPO_PATH, app_set["path"])
+        for app_set in get_generated_resources(
+            ctxt, manifest_index.ROLE_APP_SET, required=False
+        )
+    ]
+    if not app_set_paths:
+        raise Exception(
+            f"No generated child apps found for [{ctxt['target_environment']}] environment"
+        )
+
+    return (
+        app_sets.load_app_names(app_set_paths),
+        f"{app_sets.LABEL_PART_OF}={root_app['name']}",
+    )
+
+
+## ------------------
+
+
 @task()
 def delete_repos(ctxt):
+    """
+    Remove the repos specified in the argo_proj.yml from ArgoCD. Only repos that are
+    actually registered are removed, up to ctxt["jobs"] at a time.
+
+    ** This is a helper task and should not be called on its own.
+    """
 
     task_desc = "Deleting repos"
     publish(f"START: {task_desc}", LOG_INFO)
 
     try:
 
-        if "argo_proj_yaml" not in ctxt:
+        if "argo_proj" not in ctxt:
             raise Exception("Missing app config")
 
         repos_list = common.get_repos(ctxt)
-        for repo_url in repos_list:
-            publish(f"INFO: Removing repo [{repo_url}]", LOG_INFO)
-            result = common.run_command(
-                ctxt, f"argocd repo rm {repo_url}", raise_exception_on_err=False
+        backend = argocd.get_backend(ctxt)
+        _, registered_repos = argocd.diff_repos(repos_list, backend.repo_list())
+        publish(
+            f"INFO: Removing {len(registered_repos)}/{len(repos_list)} repos (the rest aren't registered)",
+            LOG_INFO,
+        )
+
+        errors = common.run_concurrently(
+            backend.repo_rm, registered_repos, jobs=ctxt.config.get("jobs", 1)
+        )
+        for index, error in sorted(errors.items()):
+            publish(
+                f"WARN: Could not remove repo [{registered_repos[index]}]: {str(error).strip()}",
+                LOG_WARN,
             )
 
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
@@ -138,18 +304,13 @@ def delete_repos(ctxt):
 @task()
 def delete_project(ctxt, target_environment=os.environ.get("TARGET_ENVIRONMENT")):
 
-    environment = ctxt["target_environment"]
     task_desc = "Deleting project"
     publish(f"START: {task_desc}", LOG_INFO)
 
     try:
 
-        # Apply and sync master app
-        with open(f"{PROJECTS_PATH}/project-{environment}.yml", "r") as stream:
-            project_yaml = yaml.load(stream)
-            project_name = project_yaml["metadata"]["name"]
-
-            common.run_command(ctxt, f"argocd proj delete {project_name}")
+        project = get_generated_resources(ctxt, manifest_index.ROLE_PROJECT)[0]
+        argocd.get_backend(ctxt).proj_delete(project["name"])
 
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
@@ -176,12 +337,8 @@ def delete_apps(ctxt):
 
     try:
 
-        # Get the app name
-        with open(f"{ARGOCD_PATH}/{ROOT_APP}-{environment}.yml", "r") as stream:
-            root_app_yaml = yaml.load(stream)
-            root_app_name = root_app_yaml["metadata"]["name"]
-
-        common.run_command(ctxt, f"argocd app delete {root_app_name}")
+        root_app = get_generated_resources(ctxt, manifest_index.ROLE_ROOT_APP)[0]
+        argocd.get_backend(ctxt).app_delete(root_app["name"])
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
     except Exception as e:
@@ -200,12 +357,16 @@ def delete_apps(ctxt):
         "argocd-username": "ArgoCD username. Must be a local ArgoCD account (e.g. admin). Does not work with SSO.",
         "argocd-password": "ArgoCD password. Must be a local ArgoCD account. Does not work with SSO.",
         "target-environment": "Target environment to deploy to",
+        "clone-strategy": "How to clone the parent repo: full, shallow, blobless or sparse. Defaults to sparse.",
+        "jobs": "Max number of repos to register and apps to sync concurrently. Defaults to 1.",
+        "sync-report": "Write a JSON report of the child apps' sync status and timings to this file",
     },
     pre=[common_actions.cleanup_data_dir],
     post=[
         common_actions.clone_repo,
         common_actions.argocd_login,
         register_repos,
+        apply_project,
         apply_and_sync,
     ],
 )
@@ -217,6 +378,9 @@ def deploy_app_bundle(
     argocd_username=os.environ.get("ARGOCD_USERNAME"),
     argocd_password=os.environ.get("ARGOCD_PASSWORD"),
     target_environment=os.environ.get("TARGET_ENVIRONMENT"),
+    clone_strategy=os.environ.get("CLONE_STRATEGY"),
+    jobs=int(os.environ.get("JOBS", 1)),
+    sync_report=os.environ.get("SYNC_REPORT"),
 ):
     """
     Deploy the ArgoCD "App of Apps" manifests to Kubernetes, and sync all related apps.
@@ -229,6 +393,9 @@ def deploy_app_bundle(
     * ARGOCD_USERNAME
     * ARGOCD_PASSWORD    
     * TARGET_ENVIRONMENT
+    * CLONE_STRATEGY
+    * JOBS
+    * SYNC_REPORT
     """
 
     common.init_bootstrap(
@@ -239,7 +406,22 @@ def deploy_app_bundle(
         argocd_username,
         argocd_password,
         target_environment=target_environment,
+        clone_strategy=clone_strategy or common.CLONE_SPARSE,
+        jobs=jobs,
     )
+    ctxt.config["sync_report_path"] = sync_report
+
+
+# Log in while the parent repo is being cloned, and create the project while the repos
+# are being registered (see utils.task_graph).
+task_graph.declare(
+    deploy_app_bundle,
+    {
+        common_actions.argocd_login: [],
+        register_repos: [common_actions.clone_repo, common_actions.argocd_login],
+        apply_project: [common_actions.clone_repo],
+    },
+)
 
 
 ## ------------------
@@ -253,6 +435,7 @@ def deploy_app_bundle(
         "argocd-username": "ArgoCD username. Must be a local ArgoCD account (e.g. admin). Does not work with SSO.",
         "argocd-password": "ArgoCD password. Must be a local ArgoCD account. Does not work with SSO.",
         "target-environment": "Target environment to deploy to",
+        "clone-strategy": "How to clone the parent repo: full, shallow, blobless or sparse. Defaults to sparse.",
     },
     pre=[common_actions.cleanup_data_dir],
     post=[common_actions.clone_repo, common_actions.argocd_login, delete_apps],
@@ -265,6 +448,7 @@ def remove_app_bundle(
     argocd_username=os.environ.get("ARGOCD_USERNAME"),
     argocd_password=os.environ.get("ARGOCD_PASSWORD"),
     target_environment=os.environ.get("TARGET_ENVIRONMENT"),
+    clone_strategy=os.environ.get("CLONE_STRATEGY"),
 ):
     """
     Remove the ArgoCD root-app and all its associated child apps and objects (e.g. namespaces).
@@ -278,6 +462,7 @@ def remove_app_bundle(
     * ARGOCD_USERNAME
     * ARGOCD_PASSWORD   
     * TARGET_ENVIRONMENT 
+    * CLONE_STRATEGY
     """
 
     common.init_bootstrap(
@@ -288,9 +473,14 @@ def remove_app_bundle(
         argocd_username,
         argocd_password,
         target_environment=target_environment,
+        clone_strategy=clone_strategy or common.CLONE_SPARSE,
     )
 
 
+# Log in while the parent repo is being cloned (see utils.task_graph).
+task_graph.declare(remove_app_bundle, {common_actions.argocd_login: []})
+
+
 ## ------------------
 
 
@@ -302,6 +492,7 @@ def remove_app_bundle(
         "argocd-username": "ArgoCD username. Must be a local ArgoCD account (e.g. admin). Does not work with SSO.",
         "argocd-password": "ArgoCD password. Must be a local ArgoCD account. Does not work with SSO.",
         "target-environment": "Target environment to deploy to",
+        "clone-strategy": "How to clone the parent repo: full, shallow, blobless or sparse. Defaults to sparse.",
     },
     pre=[common_actions.cleanup_data_dir],
     post=[common_actions.clone_repo, common_actions.argocd_login, delete_project],
@@ -314,6 +505,7 @@ def remove_project(
     argocd_username=os.environ.get("ARGOCD_USERNAME"),
     argocd_password=os.environ.get("ARGOCD_PASSWORD"),
     target_environment=os.environ.get("TARGET_ENVIRONMENT"),
+    clone_strategy=os.environ.get("CLONE_STRATEGY"),
 ):
     """
     Remove the specified project from ArgoCD.
@@ -326,6 +518,7 @@ def remove_project(
     * ARGOCD_USERNAME
     * ARGOCD_PASSWORD    
     * TARGET_ENVIRONMENT
+    * CLONE_STRATEGY
     """
 
     common.init_bootstrap(
@@ -336,9 +529,14 @@ def remove_project(
         argocd_username,
         argocd_password,
         target_environment=target_environment,
+        clone_strategy=clone_strategy or common.CLONE_SPARSE,
     )
 
 
+# Log in while the parent repo is being cloned (see utils.task_graph).
+task_graph.declare(remove_project, {common_actions.argocd_login: []})
+
+
 ## ------------------
 
 
@@ -349,6 +547,8 @@ def remove_project(
         "git-repo-url": "Git repo HTTPS URL of the repo where the ArgoCD app definitions are located",
         "argocd-username": "ArgoCD username. Must be a local ArgoCD account (e.g. admin). Does not work with SSO.",
         "argocd-password": "ArgoCD password. Must be a local ArgoCD account. Does not work with SSO.",
+        "clone-strategy": "How to clone the parent repo: full, shallow, blobless or sparse. Defaults to sparse.",
+        "jobs": "Max number of repos to remove concurrently. Defaults to 1.",
     },
     pre=[common_actions.cleanup_data_dir],
     post=[common_actions.clone_repo, common_actions.argocd_login, delete_repos],
@@ -360,6 +560,8 @@ def remove_repos(
     git_repo_url=os.environ.get("GIT_REPO_URL"),
     argocd_username=os.environ.get("ARGOCD_USERNAME"),
     argocd_password=os.environ.get("ARGOCD_PASSWORD"),
+    clone_strategy=os.environ.get("CLONE_STRATEGY"),
+    jobs=int(os.environ.get("JOBS", 1)),
 ):
     """
     Remove repos from ArgoCD that are specified in argo_proj.yml.
@@ -371,8 +573,21 @@ def remove_repos(
     * GIT_REPO_URL
     * ARGOCD_USERNAME
     * ARGOCD_PASSWORD    
+    * CLONE_STRATEGY
+    * JOBS
     """
 
     common.init_bootstrap(
-        ctxt, git_username, git_token, git_repo_url, argocd_username, argocd_password
+        ctxt,
+        git_username,
+        git_token,
+        git_repo_url,
+        argocd_username,
+        argocd_password,
+        clone_strategy=clone_strategy or common.CLONE_SPARSE,
+        jobs=jobs,
     )
+
+
+# Log in while the parent repo is being cloned (see utils.task_graph).
+task_graph.declare(remove_repos, {common_actions.argocd_login: []})
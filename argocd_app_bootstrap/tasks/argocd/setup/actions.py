@@ -1,9 +1,8 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, copy
+import os, functools
 
-from jinja2 import Environment, FileSystemLoader, environment
 from invoke import task, exceptions
 from pathlib import Path
 
@@ -13,20 +12,25 @@ from argocd_app_bootstrap.definitions import (
     APP_CONFIG,
     ARGOCD_DIR,
     DATA_PATH,
-    NAMESPACES_PATH,
     PARENT_REPO_PATH,
     ARGOCD_PATH,
-    APPS_PARENT_PATH,
     APPS_CHILDREN_PATH,
-    TEMPLATES_PATH,
     PROJECTS_PATH,
     ARGO_PROJ_YAML,
-    ARGOCD_ROOT,
+    MANIFEST_INDEX_PATH,
     yaml,
 )
 
 import argocd_app_bootstrap.tasks.common.actions as common_actions
-from argocd_app_bootstrap.utils import common
+from argocd_app_bootstrap.utils import (
+    app_sets,
+    common,
+    manifest_index,
+    models,
+    staging,
+    task_graph,
+    templates,
+)
 from argocd_app_bootstrap.utils.common import LOG_ERROR, LOG_INFO, LOG_WARN, publish
 
 
@@ -45,11 +49,15 @@ def create_folder_structure(ctxt):
     publish(f"START: {task_desc}", LOG_INFO)
 
     try:
-        if "argo_proj_yaml" not in ctxt:
+        if "argo_proj" not in ctxt:
             raise Exception("Missing app config")
 
+        if ctxt.config.get("dry_run"):
+            publish("INFO: Dry run. Skipping folder creation", LOG_INFO)
+            publish(f"SUCCESS: {task_desc}", LOG_INFO)
+            return
+
         for environment in APP_CONFIG["environments"]:
-            parent_app = ctxt["argo_proj_yaml"]["argocd"]["parent_app"]["name"]
             Path(f"{PROJECTS_PATH}").mkdir(parents=True, exist_ok=True)
             Path(os.path.join(APPS_CHILDREN_PATH, environment)).mkdir(
                 parents=True, exist_ok=True
@@ -77,25 +85,29 @@ def create_project_yaml(ctxt):
     publish(f"START: {task_desc}", LOG_INFO)
 
     try:
-        if "argo_proj_yaml" not in ctxt:
+        if "argo_proj" not in ctxt:
             raise Exception("Missing app config")
 
+        tree = staging.get_tree(ctxt["git_repo_path"])
         for environment in APP_CONFIG["environments"]:
-            project_name = (
-                f'{ctxt["argo_proj_yaml"]["argocd"]["project"]["name"]}-{environment}'
-            )
-            project_description = ctxt["argo_proj_yaml"]["argocd"]["project"][
-                "description"
-            ]
-
-            env = Environment(loader=FileSystemLoader(TEMPLATES_PATH), trim_blocks=True)
-
-            rendered_data = env.get_template(f"project.yml.j2").stream(
-                project_name=project_name, project_description=project_description
+            project_name = ctxt["argo_proj"].get_environment(environment).project_name
+            project_description = ctxt["argo_proj"].project.description
+
+            tree.add(
+                f"{PROJECTS_PATH}/project-{environment}.yml",
+                templates.get_template("project.yml.j2").render(
+                    project_name=project_name,
+                    project_description=project_description,
+                ),
+                manifest_index.make_resource(
+                    "AppProject",
+                    project_name,
+                    common.ARGOCD_NAMESPACE,
+                    environment,
+                    manifest_index.ROLE_PROJECT,
+                ),
             )
 
-            rendered_data.dump(f"{PROJECTS_PATH}/project-{environment}.yml")
-
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
     except Exception as e:
@@ -106,165 +118,221 @@ def create_project_yaml(ctxt):
 ## ------------------
 
 
-@task()
-def create_root_app_yaml(ctxt):
+def render_root_app(argo_proj: models.ArgoProj, environment: str):
     """
-    Create the root-app.yml ArgoCD Application file definition.
+    Render the root-app-{environment}.yml ArgoCD Application file definition.
 
-    ** This is a helper task and should not be called on its own.
+    Args:
+        argo_proj (ArgoProj): The argo_proj.yml model
+        environment (str): Target environment (e.g. dev, qa, prod)
 
+    Returns:
+        tuple: (file path, rendered YAML, resource)
     """
 
-    environment = ctxt["environment"]
-    task_desc = f"Create root-app-{environment}.yml"
-    publish(f"START: {task_desc}", LOG_INFO)
-
-    try:
-        if "argo_proj_yaml" not in ctxt:
-            raise Exception("Missing app config")
-
-        app_of_apps = copy.deepcopy(ctxt["argo_proj_yaml"]["argocd"])
-
-        root_app = {
-            "name": f"root-{app_of_apps['parent_app']['name']}",
-            "filename": f"root-app-{environment}.yml",
-            # "manifest_path": f"{ARGOCD_DIR}/{APPS_PARENT_DIR}/{environment}",
-            "manifest_path": f"{ARGOCD_DIR}/{APPS_CHILDREN_DIR}/{environment}",
-            "repo_url": app_of_apps["parent_app"]["repo_url"],
-        }
-        common.process_app_template(
-            root_app,
-            common.DEFAULT_NAMESPACE,
-            common.DESTINATION_CLUSTER_IN_CLUSTER,
-            app_of_apps["project"]["name"],
-            ARGOCD_PATH,
-            environment,
-        )
+    root_app = {
+        "name": f"root-{argo_proj.parent_app.name}",
+        "filename": f"root-app-{environment}.yml",
+        # "manifest_path": f"{ARGOCD_DIR}/{APPS_PARENT_DIR}/{environment}",
+        "manifest_path": f"{ARGOCD_DIR}/{APPS_CHILDREN_DIR}/{environment}",
+        "repo_url": argo_proj.parent_app.repo_url,
+    }
+    filename, content = common.render_app_template(
+        root_app,
+        common.DEFAULT_NAMESPACE,
+        common.DESTINATION_CLUSTER_IN_CLUSTER,
+        argo_proj.project.name,
+        environment,
+    )
 
-        publish(f"SUCCESS: {task_desc}", LOG_INFO)
+    resource = manifest_index.make_resource(
+        "Application",
+        common.get_app_name(root_app["name"], environment),
+        common.ARGOCD_NAMESPACE,
+        environment,
+        manifest_index.ROLE_ROOT_APP,
+    )
 
-    except Exception as e:
-        publish(f"FAIL: {task_desc}. CAUSE: {str(e)}", LOG_ERROR)
-        raise e
+    return f"{ARGOCD_PATH}/{filename}", content, resource
 
 
 ## ------------------
 
 
-@task()
-def create_namespaces_app_yaml(ctxt):
-    """
-    Create the namespaces-app.yml ArgoCD Application file in the apps-root folder.
-
-    ** This is a helper task and should not be called on its own.
+def render_child_app(
+    argo_proj: models.ArgoProj, child_app: models.ChildApp, environment: str
+):
     """
+    Render the {app_name}-app-{environment}.yml ArgoCD Application file of a child app.
 
-    environment = ctxt["environment"]
-    task_desc = f"Create namespaces-{environment}-app.yml"
-    publish(f"START: {task_desc}", LOG_INFO)
+    Args:
+        argo_proj (ArgoProj): The argo_proj.yml model
+        child_app (ChildApp): Child app
+        environment (str): Target environment (e.g. dev, qa, prod)
 
-    try:
-        if "argo_proj_yaml" not in ctxt:
-            raise Exception("Missing app config")
+    Returns:
+        tuple: (file path, rendered YAML, resource)
+    """
 
-        app_of_apps = copy.deepcopy(ctxt["argo_proj_yaml"]["argocd"])
-        parent_app = {
-            "name": f"namespaces-{app_of_apps['parent_app']['name']}",
-            "filename": f"namespaces-app-{environment}.yml",
-            "manifest_path": f"{ARGOCD_ROOT}/namespaces/{environment}",
-            "repo_url": app_of_apps["parent_app"]["repo_url"],
-        }
-        common.process_app_template(
-            parent_app,
-            common.DEFAULT_NAMESPACE,
-            app_of_apps["child_apps"]["destination_cluster"],
-            app_of_apps["project"]["name"],
-            os.path.join(APPS_PARENT_PATH, environment),
-            environment,
-        )
+    child_app = common.AppView(child_app, environment)
+    filename, content = common.render_app_template(
+        child_app,
+        child_app["namespace"],
+        argo_proj.destination_cluster,
+        argo_proj.project.name,
+        environment,
+        deploy_plugin=child_app.get("deploy_plugin", None),
+    )
 
-        publish(f"SUCCESS: {task_desc}", LOG_INFO)
+    resource = manifest_index.make_resource(
+        "Application",
+        child_app["name"],
+        common.ARGOCD_NAMESPACE,
+        environment,
+        manifest_index.ROLE_CHILD_APP,
+    )
 
-    except Exception as e:
-        publish(f"FAIL: {task_desc}. CAUSE: {str(e)}", LOG_ERROR)
-        raise e
+    return (
+        f"{os.path.join(APPS_CHILDREN_PATH, environment)}/{filename}",
+        content,
+        resource,
+    )
 
 
 ## ------------------
 
 
-@task()
-def create_namespaces_yaml(ctxt):
+def render_app_of_apps_unit(argo_proj: models.ArgoProj, unit: tuple):
     """
-    Create the namespaces.yml file in the namespaces folder. The namespaces are created
-    based on the namespaces listed in the argo_proj.yml file.
+    Render one (environment, child app) unit. A unit without a child app is the
+    environment's root app.
 
-    ** This is a helper task and should not be called on its own.
+    Args:
+        argo_proj (ArgoProj): The argo_proj.yml model
+        unit (tuple): (environment, child app or None)
+
+    Returns:
+        tuple: (file path, rendered YAML, resource)
     """
 
-    environment = ctxt["environment"]
-    task_desc = f"Create namespaces-{environment}.yml"
-    publish(f"START: {task_desc}", LOG_INFO)
+    environment, child_app = unit
+    if child_app is None:
+        return render_root_app(argo_proj, environment)
 
-    try:
-        if "argo_proj_yaml" not in ctxt:
-            raise Exception("Missing app config")
+    return render_child_app(argo_proj, child_app, environment)
 
-        app_of_apps = ctxt["argo_proj_yaml"]["argocd"]
-        namespaces = []
-        for child_app in app_of_apps["child_apps"]["app"]:
-            namespaces.append(f'{child_app["namespace"]}-{environment}')
 
-        env = Environment(loader=FileSystemLoader(TEMPLATES_PATH), trim_blocks=True)
-        rendered_data = env.get_template(f"namespaces.yml.j2").stream(
-            namespaces=namespaces
-        )
+## ------------------
 
-        rendered_data.dump(
-            f"{NAMESPACES_PATH}/{environment}/namespaces-{environment}.yml"
-        )
 
-        publish(f"SUCCESS: {task_desc}", LOG_INFO)
+def render_app_of_apps(
+    argo_proj: models.ArgoProj, environments: list, jobs=1, application_sets=False
+):
+    """
+    Render the root app and every child app for every environment. Each (environment, app)
+    unit is rendered independently, so with jobs > 1 the units are spread over a pool of
+    worker processes. The result is the same, in the same order, whatever the number of jobs.
+    With application_sets, the child apps of each environment are rendered as
+    ApplicationSets instead (see utils.app_sets), after the root apps.
+
+    Args:
+        argo_proj (ArgoProj): The argo_proj.yml model
+        environments (list): Target environments (e.g. dev, qa, prod)
+        jobs (int, optional): Number of worker processes. Defaults to 1.
+        application_sets (bool, optional): Render ApplicationSets instead of child app Applications. Defaults to False.
+
+    Returns:
+        list: (file path, rendered YAML, resource) for each unit
+    """
 
-    except Exception as e:
-        publish(f"FAIL: {task_desc}. CAUSE: {str(e)}", LOG_ERROR)
-        raise e
+    # Only what every unit needs is shipped to the workers, not the whole child app list
+    shared = models.ArgoProj(
+        argo_proj.project, argo_proj.parent_app, argo_proj.destination_cluster, ()
+    )
+    units = []
+    for environment in environments:
+        units.append((environment, None))
+        if not application_sets:
+            units.extend((environment, child_app) for child_app in argo_proj.child_apps)
+
+    rendered = []
+    if application_sets:
+        for environment in environments:
+            rendered.extend(app_sets.render_app_sets(argo_proj, environment))
+
+    render_unit = functools.partial(render_app_of_apps_unit, shared)
+    jobs = min(max(int(jobs), 1), len(units))
+    if jobs <= 1:
+        return [render_unit(unit) for unit in units] + rendered
+
+    # Imported here, since it pulls in multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return (
+            list(
+                executor.map(render_unit, units, chunksize=-(-len(units) // (jobs * 4)))
+            )
+            + rendered
+        )
 
 
 ## ------------------
 
 
 @task()
-def create_parent_apps_yaml(ctxt):
+def create_app_of_apps(ctxt):
     """
-    Create the {app_name}-app.yml ArgoCD Application file defined parent_app.name in the argo_proj.yml file
+    Create the root app and child apps ArgoCD Application files for every environment.
+    Rendering is spread over ctxt["jobs"] worker processes. With app-generation.mode
+    applicationsets in config.yml (or APP_GENERATION), child apps are generated by
+    ApplicationSets, which are checked against the Application files they replace unless
+    app-generation.verify is false.
 
     ** This is a helper task and should not be called on its own.
     """
 
-    environment = ctxt["environment"]
-    task_desc = f"Create {environment} apps-app.yml"
+    task_desc = "Create app of apps"
     publish(f"START: {task_desc}", LOG_INFO)
 
     try:
-        if "argo_proj_yaml" not in ctxt:
+        if "argo_proj" not in ctxt:
             raise Exception("Missing app config")
 
-        app_of_apps = copy.deepcopy(ctxt["argo_proj_yaml"]["argocd"])
-        parent_app = {
-            "name": f'{app_of_apps["parent_app"]["name"]}',
-            "manifest_path": f"{ARGOCD_DIR}/{APPS_CHILDREN_DIR}/{environment}",
-            "repo_url": app_of_apps["parent_app"]["repo_url"],
-        }
-        common.process_app_template(
-            parent_app,
-            common.DEFAULT_NAMESPACE,
-            common.DESTINATION_CLUSTER_IN_CLUSTER,
-            app_of_apps["project"]["name"],
-            os.path.join(APPS_PARENT_PATH, environment),
-            environment,
+        settings = app_sets.get_settings()
+        application_sets = settings["mode"] == app_sets.MODE_APPLICATION_SETS
+
+        # The namespaces app, namespaces and parent apps are not part of the app of apps
+        # for now
+        rendered_apps = render_app_of_apps(
+            ctxt["argo_proj"],
+            APP_CONFIG["environments"],
+            jobs=ctxt.config.get("jobs", 1),
+            application_sets=application_sets,
         )
 
+        if application_sets and settings["verify"]:
+            # The files as written, read back, are what the controller will expand
+            for environment in APP_CONFIG["environments"]:
+                num_apps = app_sets.verify_app_sets(
+                    ctxt["argo_proj"],
+                    environment,
+                    [
+                        yaml.load(content)
+                        for _, content, resource in rendered_apps
+                        if (resource["role"] == manifest_index.ROLE_APP_SET)
+                        and (resource["environment"] == environment)
+                    ],
+                )
+                publish(
+                    f"INFO: ApplicationSets for [{environment}] generate the same {num_apps} child apps",
+                    LOG_INFO,
+                )
+
+        tree = staging.get_tree(ctxt["git_repo_path"])
+        for path, content, resource in rendered_apps:
+            tree.add(path, content, resource)
+
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
     except Exception as e:
@@ -276,35 +344,23 @@ def create_parent_apps_yaml(ctxt):
 
 
 @task()
-def create_child_apps_yaml(ctxt):
+def create_manifest_index(ctxt):
     """
-    Create the *-app.yml ArgoCD Application files related to the target application, defined in the argo_proj.yml file
-    These will be created in the apps-{app_name} folder.
+    Create the manifest index of the generated ArgoCD resources (path, kind, name,
+    namespace and checksum, by environment), so that the run tasks can look them up
+    without parsing the YAML files again.
 
     ** This is a helper task and should not be called on its own.
     """
 
-    environment = ctxt["environment"]
-    task_desc = f"Create child apps for [{environment}] environment"
+    task_desc = "Create manifest index"
     publish(f"START: {task_desc}", LOG_INFO)
 
     try:
-        if "argo_proj_yaml" not in ctxt:
-            raise Exception("Missing app config")
-
-        app_of_apps = copy.deepcopy(ctxt["argo_proj_yaml"]["argocd"])
-        for child_app in app_of_apps["child_apps"]["app"]:
-            child_app["name"] = f"{child_app['name']}"
-            child_app["namespace"] = f'{child_app["namespace"]}-{environment}'
-            common.process_app_template(
-                child_app,
-                child_app["namespace"],
-                app_of_apps["child_apps"]["destination_cluster"],
-                app_of_apps["project"]["name"],
-                os.path.join(APPS_CHILDREN_PATH, environment),
-                environment,
-                deploy_plugin=child_app.get("deploy_plugin", None),
-            )
+        tree = staging.get_tree(ctxt["git_repo_path"])
+        tree.add(
+            MANIFEST_INDEX_PATH, manifest_index.dumps(manifest_index.build_index(tree))
+        )
 
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
@@ -316,24 +372,6 @@ def create_child_apps_yaml(ctxt):
 ## ------------------
 
 
-@task()
-def create_app_of_apps(ctxt):
-
-    for environment in APP_CONFIG["environments"]:
-        ctxt.config["environment"] = environment
-
-        create_root_app_yaml(ctxt)
-        # create_namespaces_app_yaml(ctxt)
-        # create_namespaces_yaml(ctxt)
-        # create_parent_apps_yaml(ctxt)
-        create_child_apps_yaml(ctxt)
-
-        ctxt.config["environment"] = "Not Set"
-
-
-## ------------------
-
-
 @task(
     help={
         "git-username": "Git username (optional for some Git providers)",
@@ -341,14 +379,19 @@ def create_app_of_apps(ctxt):
         "git-repo-url": "Git repo HTTPS URL of the repo where the ArgoCD app definitions are located",
         "argocd-username": "ArgoCD username. Must be a local ArgoCD account (e.g. admin). Does not work with SSO.",
         "argocd-password": "ArgoCD password. Must be a local ArgoCD account. Does not work with SSO.",
+        "clone-strategy": "How to clone the parent repo: full, shallow, blobless or sparse. Defaults to full.",
+        "jobs": "Number of worker processes used to render the app definitions. Defaults to 1.",
+        "dry-run": "Print the rendered files to stdout as yaml or tar, instead of pushing them. Logs go to stderr.",
     },
-    pre=[common_actions.cleanup_data_dir],
     post=[
+        common_actions.cleanup_data_dir,
         common_actions.argocd_login,
         common_actions.clone_repo,
         create_folder_structure,
         create_project_yaml,
         create_app_of_apps,
+        create_manifest_index,
+        common_actions.flush_staged_files,
         common_actions.commit_and_push_changes,
     ],
 )
@@ -359,6 +402,9 @@ def setup_app_of_apps(
     git_repo_url=os.environ.get("GIT_REPO_URL"),
     argocd_username=os.environ.get("ARGOCD_USERNAME"),
     argocd_password=os.environ.get("ARGOCD_PASSWORD"),
+    clone_strategy=os.environ.get("CLONE_STRATEGY"),
+    jobs=int(os.environ.get("JOBS", 1)),
+    dry_run=os.environ.get("DRY_RUN"),
 ):
     """
     Bootstrap an app in ArgoCD using the "App of Apps" pattern. Arguments can be passed
@@ -369,7 +415,34 @@ def setup_app_of_apps(
     * GIT_REPO_URL
     * ARGOCD_USERNAME
     * ARGOCD_PASSWORD    
+    * CLONE_STRATEGY
+    * JOBS
+    * DRY_RUN
     """
     common.init_bootstrap(
-        ctxt, git_username, git_token, git_repo_url, argocd_username, argocd_password
+        ctxt,
+        git_username,
+        git_token,
+        git_repo_url,
+        argocd_username,
+        argocd_password,
+        jobs=jobs,
+        clone_strategy=clone_strategy or common.CLONE_FULL,
+        dry_run=dry_run,
     )
+
+
+# Log in while the data dir is cleaned up and the parent repo is cloned and rendered.
+# Nothing is pushed until the login is done (see utils.task_graph).
+task_graph.declare(
+    setup_app_of_apps,
+    {
+        common_actions.argocd_login: [],
+        common_actions.clone_repo: [common_actions.cleanup_data_dir],
+        create_folder_structure: [common_actions.clone_repo],
+        create_project_yaml: [create_folder_structure],
+        create_app_of_apps: [create_project_yaml],
+        create_manifest_index: [create_app_of_apps],
+        common_actions.flush_staged_files: [create_manifest_index],
+    },
+)
@@ -0,0 +1,83 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+
+from invoke import task
+
+from argocd_app_bootstrap.utils.common import LOG_ERROR, LOG_INFO, publish
+
+## ------------------
+
+
+@task(
+    help={
+        "manifest": "YAML file listing the bundles to process: parent repo URLs, or mappings of job arguments",
+        "job_type": "Job type of bundles that don't set one: setup_app_of_apps (default), deploy_app_bundle or bootstrap_k8s_deployment",
+        "jobs": "Max number of bundles processed at once. Defaults to daemon.workers in config.yml.",
+        "report": "Also write the results of every bundle to this JSON file",
+    }
+)
+def run(
+    ctxt,
+    manifest=os.environ.get("BATCH_MANIFEST"),
+    job_type=os.environ.get("BATCH_JOB_TYPE", "setup_app_of_apps"),
+    jobs=os.environ.get("BATCH_JOBS"),
+    report=os.environ.get("BATCH_REPORT"),
+):
+    """
+    Process many app bundles (parent repos) in one run, a few at a time, and print a
+    table with the result of each. Every bundle runs in its own workspace, on a pool of
+    worker processes that share their ArgoCD session and compiled templates between
+    bundles. Bundles for the same parent repo run one at a time, in manifest order.
+    Arguments can be passed in through the command line, or they can be set as the
+    following environment variables:
+
+    * BATCH_MANIFEST
+    * BATCH_JOB_TYPE
+    * BATCH_JOBS
+    * BATCH_REPORT
+
+    Job arguments that a bundle doesn't set default to environment variables (e.g.
+    GIT_TOKEN, ARGOCD_PASSWORD), as they do on the command line.
+    """
+
+    task_desc = "Run batch"
+    publish(f"START: {task_desc}", LOG_INFO)
+
+    try:
+        if not manifest:
+            raise Exception("A batch manifest is required")
+
+        # Imported here, since worker processes aren't needed to list or describe tasks
+        from argocd_app_bootstrap.utils import batch, daemon
+
+        num_workers = int(jobs or daemon.get_settings()["workers"])
+        if num_workers < 1:
+            raise Exception(f"Invalid number of jobs [{jobs}]")
+
+        finished_jobs = batch.run_batch(
+            batch.load_manifest(manifest, job_type), num_workers
+        )
+
+        print("\n".join(batch.format_table(finished_jobs)))
+        if report:
+            batch.write_report(report, finished_jobs)
+
+        failed = [
+            job for job in finished_jobs if job["status"] != daemon.STATUS_SUCCEEDED
+        ]
+        publish(
+            f"INFO: {len(finished_jobs) - len(failed)}/{len(finished_jobs)} bundles succeeded",
+            LOG_INFO,
+        )
+        if failed:
+            raise Exception(
+                f"Failed bundles: {', '.join([job['name'] for job in failed])}"
+            )
+
+    except Exception as e:
+        publish(f"FAIL: {task_desc}. CAUSE: {str(e)}", LOG_ERROR)
+        raise e
+
+    publish(f"SUCCESS: {task_desc}", LOG_INFO)
@@ -1,9 +1,8 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, copy
+import os, copy, io, sys
 
-from jinja2 import Environment, FileSystemLoader, environment
 from invoke import task, exceptions
 from pathlib import Path
 
@@ -15,7 +14,14 @@ from argocd_app_bootstrap.definitions import (
     yaml,
 )
 
-from argocd_app_bootstrap.utils import common
+from argocd_app_bootstrap.utils import (
+    argocd,
+    common,
+    git_cache,
+    git_commit,
+    models,
+    staging,
+)
 from argocd_app_bootstrap.utils.common import LOG_ERROR, LOG_INFO, LOG_WARN, publish
 
 ## ------------------
@@ -24,7 +30,7 @@ from argocd_app_bootstrap.utils.common import LOG_ERROR, LOG_INFO, LOG_WARN, pub
 @task()
 def cleanup_data_dir(ctxt):
     """
-    Delete the contents of the data dir.
+    Delete the contents of the data dir, and evict stale entries from the git mirror cache.
     
     ** This is a helper task and should not be called on its own.
     """
@@ -34,6 +40,8 @@ def cleanup_data_dir(ctxt):
 
     try:
         common.run_command(ctxt, f"rm -rf {DATA_PATH}/*")
+        staging.reset()
+        git_cache.evict()
 
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
@@ -48,7 +56,7 @@ def cleanup_data_dir(ctxt):
 @task()
 def argocd_login(ctxt):
     """
-    Log in to ArgoCD via the argocd CLI.
+    Log in to ArgoCD, via the API server or the argocd CLI depending on the configured backend.
     
     ** This is a helper task and should not be called on its own.
     """
@@ -57,13 +65,12 @@ def argocd_login(ctxt):
     publish(f"START: {task_desc}", LOG_INFO)
 
     try:
-        insecure = "--insecure" if APP_CONFIG["argocd"]["insecure"] else ""
-        argocd_host = APP_CONFIG["argocd"]["host"]
-        argocd_port = APP_CONFIG["argocd"]["port"]
-        common.run_command(
-            ctxt,
-            f"argocd login {argocd_host}:{argocd_port} {insecure} --username {ctxt['argocd_username']} --password {ctxt['argocd_password']}",
-        )
+        if ctxt.config.get("dry_run"):
+            publish("INFO: Dry run. Skipping ArgoCD login", LOG_INFO)
+        else:
+            argocd.get_backend(ctxt).login(
+                ctxt["argocd_username"], ctxt["argocd_password"]
+            )
 
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
@@ -81,25 +88,48 @@ def clone_repo(ctxt):
     Clone the project's git repo to data/repo_tmp. This folder is used to stage the ArgoCD
     application and namespace files created by bootstrap_app_of_apps.
 
+    If USE_LOCAL_ARGO_PROJ is true, argo_proj.yml is read from ARGO_PROJ_PATH (defaults to
+    ./argo_proj.yml) instead, and on a dry run the repo isn't cloned at all.
+
     ** This is a helper task and should not be called on its own.
     """
 
     task_desc = "Initializing git + cloning parent repo"
     publish(f"START: {task_desc}", LOG_INFO)
 
-    common.clone_repo(ctxt, ctxt["git_repo_url"], PARENT_REPO_PATH)
+    use_local_argo_proj = common.str2bool(os.environ["USE_LOCAL_ARGO_PROJ"])
+    if use_local_argo_proj and ctxt.config.get("dry_run"):
+        publish("INFO: Dry run with a local argo_proj.yml. Skipping clone", LOG_INFO)
+    else:
+        common.clone_repo(
+            ctxt,
+            ctxt["git_repo_url"],
+            PARENT_REPO_PATH,
+            strategy=ctxt.config.get("clone_strategy", common.CLONE_FULL),
+        )
 
-    # Use argo_proj.yml from the app repo
+    # Use argo_proj.yml from the app repo, unless told to use a local one
     argo_proj_yaml_path = os.path.join(PARENT_REPO_PATH, ARGO_PROJ_YAML)
-    with open(argo_proj_yaml_path, "r") as stream:
+    source_path = argo_proj_yaml_path
+    if use_local_argo_proj:
+        source_path = os.environ.get("ARGO_PROJ_PATH", ARGO_PROJ_YAML)
+        publish(f"INFO: Using local argo_proj.yml [{source_path}]", LOG_INFO)
+
+    with open(source_path, "r") as stream:
         argo_proj_yaml_dict = yaml.load(stream)
-        ctxt.config["argo_proj_yaml"] = common.cleanup_argo_proj_yaml(
-            argo_proj_yaml_dict
-        )
+
+    # Typos fail here, rather than in whichever task first reads the bad key. Tasks share
+    # the (read-only) model, and the parsed YAML is dropped once it's written back.
+    models.validate(argo_proj_yaml_dict)
+    common.cleanup_argo_proj_yaml(argo_proj_yaml_dict)
+    ctxt.config["argo_proj"] = models.load(argo_proj_yaml_dict)
 
     # Make sure that argo_proj.yml has the correct repo reference
-    with open(argo_proj_yaml_path, "w") as argo_proj_file:
-        yaml.dump(ctxt["argo_proj_yaml"].__dict__["_config"], argo_proj_file)
+    argo_proj_stream = io.StringIO()
+    yaml.dump(argo_proj_yaml_dict, argo_proj_stream)
+    staging.get_tree(PARENT_REPO_PATH).add(
+        argo_proj_yaml_path, argo_proj_stream.getvalue()
+    )
 
     publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
@@ -107,10 +137,55 @@ def clone_repo(ctxt):
 ## ------------------
 
 
+@task()
+def flush_staged_files(ctxt):
+    """
+    Write the files rendered for the target repo to disk, in one pass. On a dry run, export
+    them to stdout instead. The files stay staged for commit_and_push_changes.
+
+    ** This is a helper task and should not be called on its own.
+    """
+
+    task_desc = "Write rendered files"
+    publish(f"START: {task_desc}", LOG_INFO)
+
+    try:
+        tree = staging.get_tree(ctxt["git_repo_path"])
+        dry_run = ctxt.config.get("dry_run")
+
+        if dry_run:
+            num_files = len(tree)
+            staging.export([tree], dry_run, sys.stdout)
+            tree.clear()
+            publish(f"INFO: Exported {num_files} files as {dry_run}", LOG_INFO)
+        else:
+            written, unchanged = tree.flush(clear=False)
+            for path in written:
+                publish(f"INFO: Created [{path}]", LOG_INFO)
+            publish(
+                f"INFO: Wrote {len(written)} files ({unchanged} unchanged)", LOG_INFO
+            )
+
+        publish(f"SUCCESS: {task_desc}", LOG_INFO)
+
+    except Exception as e:
+        publish(f"FAIL: {task_desc}. CAUSE: {str(e)}", LOG_ERROR)
+        raise e
+
+
+## ------------------
+
+
 @task()
 def commit_and_push_changes(ctxt):
     """
-    Commit and push the newly-created files to git.
+    Commit and push the newly-created files to git. Nothing is committed or pushed if
+    nothing changed.
+
+    With the plumbing commit backend (git-commit-backend in config.yml, or
+    GIT_COMMIT_BACKEND), the commit is built straight from the staged files with git
+    fast-import, without scanning the working tree. With the worktree backend, the working
+    tree is committed with git add and git commit.
 
     ** This is a helper task and should not be called on its own.
     """
@@ -118,16 +193,27 @@ def commit_and_push_changes(ctxt):
     task_desc = "Commit and push changes"
     publish(f"START: {task_desc}", LOG_INFO)
     target_repo_path = ctxt["git_repo_path"]
+    tree = staging.get_tree(target_repo_path)
 
     try:
+        if ctxt.config.get("dry_run"):
+            publish("INFO: Dry run. Nothing to commit", LOG_INFO)
+            publish(f"SUCCESS: {task_desc}", LOG_INFO)
+            return
+
+        if git_commit.get_backend() == git_commit.BACKEND_PLUMBING:
+            committed = git_commit.commit_staged_files(
+                ctxt, target_repo_path, tree.items(base=target_repo_path)
+            )
+        else:
+            committed = git_commit.commit_working_tree(ctxt, target_repo_path)
+        tree.clear()
+
+        if not committed:
+            publish("INFO: No changes to commit", LOG_INFO)
+            publish(f"SUCCESS: {task_desc}", LOG_INFO)
+            return
 
-        common.run_command(ctxt, f"cd {target_repo_path} && git status")
-        common.run_command(ctxt, f"cd {target_repo_path} && git add .")
-        common.run_command(
-            ctxt,
-            f"cd {target_repo_path} && git commit -m 'ArgoCD app configs'",
-            raise_exception_on_err=False,
-        )
         common.run_command(
             ctxt, f"cd {target_repo_path} && git push", raise_exception_on_err=False
         )
@@ -0,0 +1,59 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os, signal, sys
+
+from invoke import task
+
+from argocd_app_bootstrap.utils.common import LOG_ERROR, LOG_INFO, publish
+
+## ------------------
+
+
+@task(
+    help={
+        "socket": "Unix socket to listen on. Defaults to daemon/daemon.sock in the cache dir.",
+        "port": "Listen on this TCP port on 127.0.0.1 instead of a Unix socket. Requests must send the token in daemon/daemon.token in the cache dir.",
+        "workers": "Number of worker processes. Defaults to daemon.workers in config.yml.",
+    }
+)
+def serve(
+    ctxt,
+    socket=os.environ.get("DAEMON_SOCKET"),
+    port=os.environ.get("DAEMON_PORT"),
+    workers=os.environ.get("DAEMON_WORKERS"),
+):
+    """
+    Run as a daemon that accepts setup_app_of_apps, deploy_app_bundle and
+    bootstrap_k8s_deployment jobs over HTTP, and runs them on a pool of warm worker
+    processes. Jobs for the same parent repo run one at a time. Arguments can be passed in
+    through the command line, or they can be set as the following environment variables:
+
+    * DAEMON_SOCKET
+    * DAEMON_PORT
+    * DAEMON_WORKERS
+
+    Job arguments that aren't part of a job request default to the daemon's environment
+    variables (e.g. GIT_TOKEN, ARGOCD_PASSWORD), as they do on the command line.
+    """
+
+    task_desc = "Run daemon"
+    publish(f"START: {task_desc}", LOG_INFO)
+
+    # Shut down cleanly on SIGTERM too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        # Imported here, since the HTTP server isn't needed to list or describe tasks
+        from argocd_app_bootstrap.utils import daemon
+
+        daemon.serve(socket_path=socket, port=port, num_workers=workers)
+
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+    except Exception as e:
+        publish(f"FAIL: {task_desc}. CAUSE: {str(e)}", LOG_ERROR)
+        raise e
+
+    publish(f"SUCCESS: {task_desc}", LOG_INFO)
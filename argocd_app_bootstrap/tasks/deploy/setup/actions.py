@@ -1,19 +1,19 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, copy, shutil
+import os, copy, shutil, sys, time
 
-from jinja2 import Environment, FileSystemLoader, environment
-from invoke import task, exceptions
+from concurrent.futures import ThreadPoolExecutor
+from invoke import Context, task, exceptions
 from pathlib import Path
 
 from argocd_app_bootstrap.definitions import (
     APP_CONFIG,
     CHILD_REPOS_PATH,
-    HELM_BASE_PATH,
-    HELM_TEMPLATES_PATH,
-    KUSTOMIZED_HELM_PATH,
-    OVERLAYS_PATH,
+    HELM_BASE_DIR,
+    HELM_TEMPLATES_DIR,
+    KUSTOMIZED_HELM_DIR,
+    OVERLAYS_DIR,
     PATCH_DIR,
     DEPLOY_TEMPLATES_PATH,
     yaml,
@@ -21,12 +21,37 @@ from argocd_app_bootstrap.definitions import (
 
 import argocd_app_bootstrap.tasks.common.actions as common_actions
 
-from argocd_app_bootstrap.utils import common
+from argocd_app_bootstrap.utils import common, staging, templates
 from argocd_app_bootstrap.utils.common import LOG_ERROR, LOG_INFO, LOG_WARN, publish
 
 ## ------------------
 
 
+def get_workspace_paths(repo_path: str):
+    """
+    Get the Kustomized Helm folder locations inside a child app's workspace.
+
+    Args:
+        repo_path (str): Path of the child repo's working copy
+
+    Returns:
+        dict: Paths keyed by kustomized_helm, helm_base, helm_templates and overlays
+    """
+
+    kustomized_helm_path = os.path.join(repo_path, KUSTOMIZED_HELM_DIR)
+    helm_base_path = os.path.join(kustomized_helm_path, HELM_BASE_DIR)
+
+    return {
+        "kustomized_helm": kustomized_helm_path,
+        "helm_base": helm_base_path,
+        "helm_templates": os.path.join(helm_base_path, HELM_TEMPLATES_DIR),
+        "overlays": os.path.join(kustomized_helm_path, OVERLAYS_DIR),
+    }
+
+
+## ------------------
+
+
 @task()
 def clone_child_repo(ctxt):
     """
@@ -40,7 +65,7 @@ def clone_child_repo(ctxt):
     task_desc = "Initializing git + cloning child repo"
     publish(f"START: {task_desc}", LOG_INFO)
 
-    common.clone_repo(ctxt, git_repo, CHILD_REPOS_PATH)
+    common.clone_repo(ctxt, git_repo, ctxt["git_repo_path"])
 
     publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
@@ -60,16 +85,22 @@ def create_folder_structure(ctxt):
     publish(f"START: {task_desc}", LOG_INFO)
 
     try:
-        if "argo_proj_yaml" not in ctxt:
+        if "argo_proj" not in ctxt:
             raise Exception("Missing app config")
 
-        Path(KUSTOMIZED_HELM_PATH).mkdir(parents=True, exist_ok=True)
-        Path(HELM_BASE_PATH).mkdir(parents=True, exist_ok=True)
-        Path(HELM_TEMPLATES_PATH).mkdir(parents=True, exist_ok=True)
-        Path(OVERLAYS_PATH).mkdir(parents=True, exist_ok=True)
+        if ctxt.config.get("dry_run"):
+            publish("INFO: Dry run. Skipping folder creation", LOG_INFO)
+            publish(f"SUCCESS: {task_desc}", LOG_INFO)
+            return
+
+        paths = get_workspace_paths(ctxt["git_repo_path"])
+        Path(paths["kustomized_helm"]).mkdir(parents=True, exist_ok=True)
+        Path(paths["helm_base"]).mkdir(parents=True, exist_ok=True)
+        Path(paths["helm_templates"]).mkdir(parents=True, exist_ok=True)
+        Path(paths["overlays"]).mkdir(parents=True, exist_ok=True)
 
         for environment in APP_CONFIG["environments"]:
-            Path(os.path.join(OVERLAYS_PATH, environment, PATCH_DIR)).mkdir(
+            Path(os.path.join(paths["overlays"], environment, PATCH_DIR)).mkdir(
                 parents=True, exist_ok=True
             )
 
@@ -95,13 +126,18 @@ def create_template_files(ctxt):
     publish(f"START: {task_desc}", LOG_INFO)
 
     try:
-        if "argo_proj_yaml" not in ctxt:
+        if "argo_proj" not in ctxt:
             raise Exception("Missing app config")
 
+        overlays_path = get_workspace_paths(ctxt["git_repo_path"])["overlays"]
+        with open(f"{DEPLOY_TEMPLATES_PATH}/deployment_patch.yml.j2", "r") as stream:
+            deployment_patch = stream.read()
+
+        tree = staging.get_tree(ctxt["git_repo_path"])
         for environment in APP_CONFIG["environments"]:
-            shutil.copy2(
-                f"{DEPLOY_TEMPLATES_PATH}/deployment_patch.yml.j2",
-                f"{OVERLAYS_PATH}/{environment}/{PATCH_DIR}/deployment_patch.yml",
+            tree.add(
+                f"{overlays_path}/{environment}/{PATCH_DIR}/deployment_patch.yml",
+                deployment_patch,
             )
 
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
@@ -126,41 +162,49 @@ def render_helm_base_yamls(ctxt):
     publish(f"START: {task_desc}", LOG_INFO)
 
     try:
-        if "argo_proj_yaml" not in ctxt:
+        if "argo_proj" not in ctxt:
             raise Exception("Missing app config")
 
-        env = Environment(
-            loader=FileSystemLoader(DEPLOY_TEMPLATES_PATH), trim_blocks=True
-        )
+        paths = get_workspace_paths(ctxt["git_repo_path"])
+        helm_base_path = paths["helm_base"]
+        helm_templates_path = paths["helm_templates"]
+        tree = staging.get_tree(ctxt["git_repo_path"])
 
         # Render Chart.yaml
-        rendered_data = env.get_template(f"Chart.yaml.j2").stream(
+        tree.render(
+            templates.get_deploy_template("Chart.yaml.j2"),
+            f"{helm_base_path}/Chart.yaml",
             app_name=ctxt["child_app_name"],
-            app_version=ctxt["argo_proj_yaml"]["argocd"]["parent_app"]["version"],
+            app_version=ctxt["argo_proj"].parent_app.version,
         )
-        rendered_data.dump(f"{HELM_BASE_PATH}/Chart.yaml")
 
         # Render deployment.yml
-        rendered_data = env.get_template(f"deployment.yml.j2").stream()
-        rendered_data.dump(f"{HELM_TEMPLATES_PATH}/deployment.yml")
+        tree.render(
+            templates.get_deploy_template("deployment.yml.j2"),
+            f"{helm_templates_path}/deployment.yml",
+        )
 
         # Render service.yml
-        rendered_data = env.get_template(f"service.yml.j2").stream()
-        rendered_data.dump(f"{HELM_TEMPLATES_PATH}/service.yml")
+        tree.render(
+            templates.get_deploy_template("service.yml.j2"),
+            f"{helm_templates_path}/service.yml",
+        )
 
         # Render mapping.yml
-        rendered_data = env.get_template(f"mapping.yml.j2").stream(
-            app_name=ctxt["child_app_name"]
+        tree.render(
+            templates.get_deploy_template("mapping.yml.j2"),
+            f"{helm_templates_path}/mapping.yml",
+            app_name=ctxt["child_app_name"],
         )
-        rendered_data.dump(f"{HELM_TEMPLATES_PATH}/mapping.yml")
 
         # Render kustomization_base.yml
-        rendered_data = env.get_template(f"kustomization_base.yml.j2").stream(
+        tree.render(
+            templates.get_deploy_template("kustomization_base.yml.j2"),
+            f"{helm_base_path}/kustomization.yml",
             app_name=ctxt["child_app_name"],
-            parent_app=ctxt["argo_proj_yaml"]["argocd"]["parent_app"]["name"],
-            app_version=ctxt["argo_proj_yaml"]["argocd"]["parent_app"]["version"],
+            parent_app=ctxt["argo_proj"].parent_app.name,
+            app_version=ctxt["argo_proj"].parent_app.version,
         )
-        rendered_data.dump(f"{HELM_BASE_PATH}/kustomization.yml")
 
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
@@ -184,25 +228,29 @@ def render_overlay_templates_yaml(ctxt):
     publish(f"START: {task_desc}", LOG_INFO)
 
     try:
-        if "argo_proj_yaml" not in ctxt:
+        if "argo_proj" not in ctxt:
             raise Exception("Missing app config")
 
-        env = Environment(
-            loader=FileSystemLoader(DEPLOY_TEMPLATES_PATH), trim_blocks=True
-        )
-
+        overlays_path = get_workspace_paths(ctxt["git_repo_path"])["overlays"]
+        tree = staging.get_tree(ctxt["git_repo_path"])
         for environment in APP_CONFIG["environments"]:
             # Render overlay folder's namespace.yml
-            rendered_data = env.get_template(f"namespace.yml.j2").stream(
-                namespace=f'{ctxt["child_namespace"]}-{environment}'
+            tree.render(
+                templates.get_deploy_template("namespace.yml.j2"),
+                f"{overlays_path}/{environment}/namespace.yml",
+                namespace=common.get_namespace_name(
+                    ctxt["child_namespace"], environment
+                ),
             )
-            rendered_data.dump(f"{OVERLAYS_PATH}/{environment}/namespace.yml")
 
             # Render overlay folder's kustomization.yml
-            rendered_data = env.get_template(f"kustomization_overlays.yml.j2").stream(
-                namespace=f'{ctxt["child_namespace"]}-{environment}'
+            tree.render(
+                templates.get_deploy_template("kustomization_overlays.yml.j2"),
+                f"{overlays_path}/{environment}/kustomization.yml",
+                namespace=common.get_namespace_name(
+                    ctxt["child_namespace"], environment
+                ),
             )
-            rendered_data.dump(f"{OVERLAYS_PATH}/{environment}/kustomization.yml")
 
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
@@ -214,10 +262,93 @@ def render_overlay_templates_yaml(ctxt):
 ## ------------------
 
 
+def scaffold_app(ctxt, app):
+    """
+    Clone, render, commit and push a single child app in its own workspace under
+    CHILD_REPOS_PATH. The app gets its own copy of the context, so that several apps
+    can be scaffolded at the same time. On a dry run, the app is only rendered, and its
+    files are left staged for scaffold_k8s_deployment to export.
+
+    Args:
+        ctxt (Context): PyInvoke Context. http://docs.pyinvoke.org/en/stable/api/context.html
+        app (dict): Child app details from argo_proj.yml
+
+    Returns:
+        dict: Result for the app (app, repo_url, status, duration, error)
+    """
+
+    result = {
+        "app": app["name"],
+        "repo_url": app["repo_url"],
+        "status": "SUCCESS",
+        "duration": 0.0,
+        "error": None,
+    }
+    start = time.perf_counter()
+
+    try:
+        app_ctxt = Context(config=ctxt.config.clone())
+        app_ctxt.config["git_repo_path"] = os.path.join(CHILD_REPOS_PATH, app["name"])
+        app_ctxt.config["child_git_repo"] = app["repo_url"]
+        app_ctxt.config["child_app_name"] = app["name"]
+        app_ctxt.config["child_namespace"] = app["namespace"]
+        publish(f"INFO: Now processing app {app['name']}", LOG_INFO)
+
+        dry_run = app_ctxt.config.get("dry_run")
+        if not dry_run:
+            shutil.rmtree(app_ctxt["git_repo_path"], ignore_errors=True)
+            clone_child_repo(app_ctxt)
+            create_folder_structure(app_ctxt)
+
+        create_template_files(app_ctxt)
+        render_helm_base_yamls(app_ctxt)
+        render_overlay_templates_yaml(app_ctxt)
+
+        if not dry_run:
+            common_actions.flush_staged_files(app_ctxt)
+            common_actions.commit_and_push_changes(app_ctxt)
+
+    except Exception as e:
+        result["status"] = "FAIL"
+        result["error"] = str(e).strip()
+
+    result["duration"] = round(time.perf_counter() - start, 2)
+
+    return result
+
+
+## ------------------
+
+
+def publish_scaffold_summary(results: list):
+    """
+    Publish a per-app summary of a scaffolding run.
+
+    Args:
+        results (list): Per-app results returned by scaffold_app
+    """
+
+    for result in results:
+        msg = f"[{result['status']}] {result['app']} ({result['duration']}s)"
+        if result["error"] is not None:
+            publish(f"{msg}: {result['error']}", LOG_ERROR)
+        else:
+            publish(msg, LOG_INFO)
+
+    failed = [result for result in results if result["status"] != "SUCCESS"]
+    publish(
+        f"INFO: Scaffolded {len(results) - len(failed)}/{len(results)} apps", LOG_INFO
+    )
+
+
+## ------------------
+
+
 @task()
 def scaffold_k8s_deployment(ctxt):
     """
-    Create scaffolding folder structure for standardized k8s deployments
+    Create scaffolding folder structure for standardized k8s deployments. Apps are
+    processed on a pool of up to ctxt["jobs"] workers.
 
     ** This is a helper task and should not be called on its own.
     """
@@ -226,20 +357,30 @@ def scaffold_k8s_deployment(ctxt):
     publish(f"START: {task_desc}", LOG_INFO)
 
     try:
-        apps_list = ctxt["argo_proj_yaml"]["argocd"]["child_apps"]["app"]
-        for app in apps_list:
-            common.run_command(ctxt, f"rm -rf {CHILD_REPOS_PATH}")
-            ctxt["child_git_repo"] = app["repo_url"]
-            ctxt["child_app_name"] = app["name"]
-            ctxt["child_namespace"] = app["namespace"]
-            publish(f"INFO: Now processing app {ctxt['child_app_name']}", LOG_INFO)
-
-            clone_child_repo(ctxt)
-            create_folder_structure(ctxt)
-            create_template_files(ctxt)
-            render_helm_base_yamls(ctxt)
-            render_overlay_templates_yaml(ctxt)
-            common_actions.commit_and_push_changes(ctxt),
+        apps_list = ctxt["argo_proj"].child_apps
+        jobs = ctxt.config.get("jobs", 1)
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(lambda app: scaffold_app(ctxt, app), apps_list))
+
+        ctxt.config["scaffold_results"] = results
+        publish_scaffold_summary(results)
+
+        if ctxt.config.get("dry_run"):
+            # Exported in one go, in argo_proj.yml order, so apps don't interleave
+            trees = [
+                staging.get_tree(os.path.join(CHILD_REPOS_PATH, app["name"]))
+                for app in apps_list
+            ]
+            staging.export(trees, ctxt["dry_run"], sys.stdout, base=CHILD_REPOS_PATH)
+            publish(
+                f"INFO: Exported {sum(len(tree) for tree in trees)} files as {ctxt['dry_run']}",
+                LOG_INFO,
+            )
+
+        failed = [result["app"] for result in results if result["status"] != "SUCCESS"]
+        if failed:
+            raise Exception(f"Failed to scaffold apps: {', '.join(failed)}")
 
         publish(f"SUCCESS: {task_desc}", LOG_INFO)
 
@@ -258,9 +399,15 @@ def scaffold_k8s_deployment(ctxt):
         "git-repo-url": "Git repo HTTPS URL of the repo where the ArgoCD app definitions are located",
         "argocd-username": "ArgoCD username. Must be a local ArgoCD account (e.g. admin). Does not work with SSO.",
         "argocd-password": "ArgoCD password. Must be a local ArgoCD account. Does not work with SSO.",
+        "jobs": "Max number of child apps to scaffold concurrently. Defaults to 1.",
+        "clone-strategy": "How to clone the parent repo: full, shallow, blobless or sparse. Defaults to sparse.",
+        "dry-run": "Print the rendered files to stdout as yaml or tar, instead of pushing them. Logs go to stderr.",
     },
-    pre=[common_actions.cleanup_data_dir],
-    post=[common_actions.clone_repo, scaffold_k8s_deployment],
+    post=[
+        common_actions.cleanup_data_dir,
+        common_actions.clone_repo,
+        scaffold_k8s_deployment,
+    ],
 )
 def bootstrap_k8s_deployment(
     ctxt,
@@ -269,6 +416,9 @@ def bootstrap_k8s_deployment(
     git_repo_url=os.environ.get("GIT_REPO_URL"),
     argocd_username=os.environ.get("ARGOCD_USERNAME"),
     argocd_password=os.environ.get("ARGOCD_PASSWORD"),
+    jobs=int(os.environ.get("JOBS", 1)),
+    clone_strategy=os.environ.get("CLONE_STRATEGY"),
+    dry_run=os.environ.get("DRY_RUN"),
 ):
     """
     Bootstrap an app in ArgoCD using the "App of Apps" pattern. Arguments can be passed
@@ -279,6 +429,9 @@ def bootstrap_k8s_deployment(
     * GIT_REPO_URL
     * ARGOCD_USERNAME
     * ARGOCD_PASSWORD    
+    * JOBS
+    * CLONE_STRATEGY
+    * DRY_RUN
     """
     common.init_bootstrap(
         ctxt,
@@ -288,4 +441,7 @@ def bootstrap_k8s_deployment(
         argocd_username,
         argocd_password,
         target_repo_path=CHILD_REPOS_PATH,
+        jobs=jobs,
+        clone_strategy=clone_strategy or common.CLONE_SPARSE,
+        dry_run=dry_run,
     )
@@ -0,0 +1,440 @@
+import os, re, json
+
+from argocd_app_bootstrap.definitions import APP_CONFIG, APPS_CHILDREN_PATH, yaml
+from argocd_app_bootstrap.utils import common, manifest_index, templates
+from argocd_app_bootstrap.utils.common import LOG_ERROR, publish
+
+## ------------------
+
+# How child apps are generated: one Application per child app and environment, or one
+# ApplicationSet per environment (and deploy plugin) that generates them
+MODE_APPLICATIONS = "applications"
+MODE_APPLICATION_SETS = "applicationsets"
+MODES = [MODE_APPLICATIONS, MODE_APPLICATION_SETS]
+
+# Label of the Applications generated by an ApplicationSet, set to the name of the
+# environment's root app. They don't get the root app's app.kubernetes.io/instance
+# label (the root app only tracks the ApplicationSet), so they're selected by this one.
+LABEL_PART_OF = "app.kubernetes.io/part-of"
+
+# Generator parameters, and the child app key each one is read from
+PARAMS = {
+    "name": "name",
+    "namespace": "namespace",
+    "path": "manifest_path",
+    "repoURL": "repo_url",
+}
+
+# Parameter references in an ApplicationSet template (fasttemplate syntax)
+PARAM_REFERENCE = re.compile(r"\{\{\s*([\w.-]+)\s*\}\}")
+
+# Values that YAML reads back as the same string when written unquoted
+PLAIN_VALUE = re.compile(r"[\w./~][\w./~:@+-]*")
+
+## ------------------
+
+
+def get_settings():
+    """
+    Get the app generation settings (app-generation in config.yml), with defaults. The
+    APP_GENERATION environment variable overrides mode.
+
+    Raises:
+        Exception: Raised if the mode is not valid.
+
+    Returns:
+        dict: mode (applications or applicationsets), and verify (whether ApplicationSets are checked against the Applications they replace)
+    """
+
+    settings = APP_CONFIG.get("app-generation", {})
+    mode = os.environ.get(
+        "APP_GENERATION", settings.get("mode", MODE_APPLICATIONS)
+    ).lower()
+
+    if mode not in MODES:
+        msg = f"ERROR: Invalid app generation mode [{mode}]. Valid values: {', '.join(MODES)}"
+        publish(msg, LOG_ERROR)
+        raise Exception(msg)
+
+    return {"mode": mode, "verify": common.str2bool(settings.get("verify", True))}
+
+
+def get_app_set_name(parent_app_name: str, environment: str, deploy_plugin=None):
+    """
+    Get the name of the ApplicationSet of the child apps of a bundle in an environment.
+
+    Args:
+        parent_app_name (str): Parent app name, as listed in argo_proj.yml
+        environment (str): Target environment (e.g. dev, qa, prod)
+        deploy_plugin (str, optional): Deploy plugin of the child apps it generates
+
+    Returns:
+        str: ApplicationSet name
+    """
+
+    plugin = f"{deploy_plugin}-" if deploy_plugin else ""
+    return f"{parent_app_name}-{plugin}apps-{environment}"
+
+
+## ------------------
+
+
+def get_elements(argo_proj, environment: str):
+    """
+    Get the list generator elements of the child apps of a bundle in an environment, by
+    deploy plugin: the plugin is part of the template, so apps with different plugins
+    need different ApplicationSets. Elements are in argo_proj.yml order.
+
+    Args:
+        argo_proj (ArgoProj): The argo_proj.yml model
+        environment (str): Target environment (e.g. dev, qa, prod)
+
+    Returns:
+        dict: Deploy plugin (or None) -> list of elements (generator parameter -> value)
+    """
+
+    elements = {}
+    for child_app in argo_proj.child_apps:
+        child_app = common.AppView(child_app, environment)
+        elements.setdefault(child_app.get("deploy_plugin", None), []).append(
+            {param: str(child_app[key]) for param, key in PARAMS.items()}
+        )
+
+    return elements
+
+
+def render_application(
+    argo_proj, environment: str, values: dict, deploy_plugin=None, labels=None
+):
+    """
+    Render application.yml.j2 for a child app, with the value of each generator
+    parameter given as is (e.g. a parameter reference).
+
+    Args:
+        argo_proj (ArgoProj): The argo_proj.yml model
+        environment (str): Target environment (e.g. dev, qa, prod)
+        values (dict): Generator parameter -> value
+        deploy_plugin (str, optional): Deploy plugin of the child app
+        labels (dict, optional): Labels of the Application
+
+    Returns:
+        str: Rendered YAML
+    """
+
+    return templates.get_template("application.yml.j2").render(
+        app={key: values[param] for param, key in PARAMS.items()},
+        namespace=values["namespace"],
+        destination_cluster=argo_proj.destination_cluster,
+        project_name=common.get_project_name(argo_proj.project.name, environment),
+        deploy_plugin=deploy_plugin,
+        labels=labels,
+    )
+
+
+def render_app_sets(argo_proj, environment: str):
+    """
+    Render the ApplicationSet files of the child apps of a bundle in an environment. They
+    go where the Application files of the child apps would, so the root app picks them
+    up. The template of each ApplicationSet is application.yml.j2, rendered with
+    parameter references, so it generates the same Applications as the files it replaces.
+
+    Args:
+        argo_proj (ArgoProj): The argo_proj.yml model
+        environment (str): Target environment (e.g. dev, qa, prod)
+
+    Returns:
+        list: (file path, rendered YAML, resource) for each ApplicationSet
+    """
+
+    references = {param: f"'{{{{{param}}}}}'" for param in PARAMS}
+    labels = {
+        LABEL_PART_OF: common.get_app_name(
+            f"root-{argo_proj.parent_app.name}", environment
+        )
+    }
+
+    rendered = []
+    for deploy_plugin, elements in get_elements(argo_proj, environment).items():
+        name = get_app_set_name(argo_proj.parent_app.name, environment, deploy_plugin)
+        application = render_application(
+            argo_proj, environment, references, deploy_plugin, labels
+        )
+        content = templates.get_template("application_set.yml.j2").render(
+            name=name,
+            elements=elements,
+            # The template is the Application from its metadata on
+            template=application[application.index("metadata:") :],
+        )
+        rendered.append(
+            (
+                f"{os.path.join(APPS_CHILDREN_PATH, environment)}/{name}.yml",
+                content,
+                manifest_index.make_resource(
+                    "ApplicationSet",
+                    name,
+                    common.ARGOCD_NAMESPACE,
+                    environment,
+                    manifest_index.ROLE_APP_SET,
+                ),
+            )
+        )
+
+    return rendered
+
+
+## ------------------
+
+
+def substitute(value, params: dict, app_set_name: str):
+    """
+    Replace the parameter references in a template (or part of it) with their values.
+
+    Args:
+        value (Any): Template, or a value in it
+        params (dict): Parameter -> value
+        app_set_name (str): Name of the ApplicationSet, for errors
+
+    Raises:
+        Exception: Raised if the template refers to an unknown parameter.
+
+    Returns:
+        Any: A copy of value with the references replaced
+    """
+
+    if isinstance(value, dict):
+        return {
+            key: substitute(item, params, app_set_name) for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [substitute(item, params, app_set_name) for item in value]
+    if not isinstance(value, str):
+        return value
+
+    def lookup(match):
+        if match.group(1) not in params:
+            raise Exception(
+                f"ApplicationSet [{app_set_name}] refers to unknown parameter [{match.group(1)}]"
+            )
+        return str(params[match.group(1)])
+
+    return PARAM_REFERENCE.sub(lookup, value)
+
+
+def expand_app_set(app_set: dict):
+    """
+    Expand the list generators of an ApplicationSet locally, into the Applications the
+    ApplicationSet controller would create.
+
+    Args:
+        app_set (dict): ApplicationSet resource
+
+    Raises:
+        Exception: Raised if the ApplicationSet has a generator other than list, or its template refers to an unknown parameter.
+
+    Returns:
+        list: Applications (dicts), in generator order
+    """
+
+    name = app_set["metadata"]["name"]
+    spec = app_set["spec"]
+
+    applications = []
+    for generator in spec["generators"]:
+        if set(generator) != {"list"}:
+            raise Exception(
+                f"ApplicationSet [{name}] has a generator that can't be expanded locally: {', '.join(generator)}"
+            )
+
+        for params in generator["list"]["elements"]:
+            template = substitute(spec["template"], params, name)
+            metadata = dict(template["metadata"])
+            metadata.setdefault("namespace", app_set["metadata"]["namespace"])
+            applications.append(
+                {
+                    "apiVersion": app_set["apiVersion"],
+                    "kind": "Application",
+                    "metadata": metadata,
+                    "spec": template["spec"],
+                }
+            )
+
+    return applications
+
+
+def load_app_names(app_set_paths: list):
+    """
+    Get the names of the Applications generated by ApplicationSet files, by expanding
+    their generators.
+
+    Args:
+        app_set_paths (list): ApplicationSet files
+
+    Returns:
+        list: Application names
+    """
+
+    names = []
+    for app_set_path in app_set_paths:
+        with open(app_set_path, "r") as stream:
+            app_set = yaml.load(stream)
+        names.extend(
+            application["metadata"]["name"] for application in expand_app_set(app_set)
+        )
+
+    return names
+
+
+## ------------------
+
+
+def is_plain_value(value: str):
+    """
+    Tell whether a value is read back from YAML as the same string when it's written
+    unquoted (e.g. not 1.0, true or a: b).
+
+    Args:
+        value (str): Value
+
+    Returns:
+        bool: True if it is
+    """
+
+    # Imported here, since only verify_app_sets needs it
+    from ruamel.yaml.nodes import ScalarNode
+
+    return (
+        bool(PLAIN_VALUE.fullmatch(value))
+        and (not value.endswith(":"))
+        and (
+            yaml.resolver.resolve(ScalarNode, value, (True, False))
+            == "tag:yaml.org,2002:str"
+        )
+    )
+
+
+def to_plain(value):
+    """
+    Convert a resource to plain dicts and lists, so that comparisons don't depend on key
+    order or on the YAML types it was read as.
+
+    Args:
+        value (Any): Resource
+
+    Returns:
+        Any: A plain copy
+    """
+
+    return json.loads(json.dumps(value, default=str))
+
+
+def get_expected_applications(argo_proj, environment: str):
+    """
+    Get the child app Applications of a bundle in an environment, as read from the
+    Application files that applications mode writes. Parsing thousands of files is slow,
+    so the Application of each deploy plugin is parsed once, rendered with a marker for
+    each parameter. An app's Application is that one with its values in place of the
+    markers, if that gives the same text as its file, and its values are plain YAML
+    strings. Files of other apps are parsed.
+
+    Args:
+        argo_proj (ArgoProj): The argo_proj.yml model
+        environment (str): Target environment (e.g. dev, qa, prod)
+
+    Returns:
+        dict: Application name -> Application (plain dicts and lists)
+    """
+
+    markers = {param: f"app-set-{param}-param" for param in PARAMS}
+
+    def fill(value, values):
+        if isinstance(value, dict):
+            return {key: fill(item, values) for key, item in value.items()}
+        if isinstance(value, list):
+            return [fill(item, values) for item in value]
+        if isinstance(value, str):
+            for param, marker in markers.items():
+                value = value.replace(marker, values[param])
+        return value
+
+    shapes = {}
+    expected = {}
+    for child_app in argo_proj.child_apps:
+        child_app = common.AppView(child_app, environment)
+        deploy_plugin = child_app.get("deploy_plugin", None)
+        _, content = common.render_app_template(
+            child_app,
+            child_app["namespace"],
+            argo_proj.destination_cluster,
+            argo_proj.project.name,
+            environment,
+            deploy_plugin=deploy_plugin,
+        )
+
+        if deploy_plugin not in shapes:
+            marked = render_application(argo_proj, environment, markers, deploy_plugin)
+            shapes[deploy_plugin] = (marked, to_plain(yaml.load(marked)))
+        marked, shape = shapes[deploy_plugin]
+
+        values = {param: str(child_app[key]) for param, key in PARAMS.items()}
+        for param, marker in markers.items():
+            marked = marked.replace(marker, values[param])
+
+        if (marked == content) and all(map(is_plain_value, values.values())):
+            expected[child_app["name"]] = fill(shape, values)
+        else:
+            expected[child_app["name"]] = to_plain(yaml.load(content))
+
+    return expected
+
+
+def verify_app_sets(argo_proj, environment: str, app_sets: list):
+    """
+    Check that ApplicationSets generate the same Applications as the Application files
+    they replace: expand them locally, and compare the result with the child apps of
+    applications mode (see get_expected_applications). The LABEL_PART_OF label is the
+    only difference allowed.
+
+    Args:
+        argo_proj (ArgoProj): The argo_proj.yml model
+        environment (str): Target environment (e.g. dev, qa, prod)
+        app_sets (list): ApplicationSet resources (dicts), as read from their files
+
+    Raises:
+        Exception: Raised if an Application is missing, extra, or different.
+
+    Returns:
+        int: Number of Applications checked
+    """
+
+    expected = get_expected_applications(argo_proj, environment)
+
+    generated = {}
+    for app_set in app_sets:
+        for application in expand_app_set(app_set):
+            application = to_plain(application)
+            labels = application["metadata"].get("labels", {})
+            labels.pop(LABEL_PART_OF, None)
+            if not labels:
+                application["metadata"].pop("labels", None)
+            generated[application["metadata"]["name"]] = application
+
+    problems = [
+        f"{name} is not generated" for name in expected if name not in generated
+    ]
+    problems += [
+        f"{name} is generated but not expected"
+        for name in generated
+        if name not in expected
+    ]
+    problems += [
+        f"{name} is different"
+        for name in expected
+        if (name in generated) and (generated[name] != expected[name])
+    ]
+    if problems:
+        raise Exception(
+            f"ApplicationSets for [{environment}] don't match the child apps: {'; '.join(problems[:10])}"
+            + (f" (and {len(problems) - 10} more)" if len(problems) > 10 else "")
+        )
+
+    return len(generated)
@@ -0,0 +1,463 @@
+import os, json, queue, socket, threading
+
+from urllib.parse import quote, urlencode
+from invoke import Context
+
+from argocd_app_bootstrap.definitions import APP_CONFIG
+from argocd_app_bootstrap.utils import argocd_session, common, limits, tracing
+from argocd_app_bootstrap.utils.common import LOG_ERROR, LOG_INFO, LOG_WARN, publish
+
+## ------------------
+
+# ArgoCD backends
+BACKEND_REST = "rest"
+BACKEND_CLI = "cli"
+
+# Statuses returned by an overloaded API server (or the proxies in front of it)
+OVERLOADED_STATUSES = (429, 502, 503, 504)
+
+## ------------------
+
+
+class ArgoCDAPIError(Exception):
+    """
+    Raised when the ArgoCD API server returns an error.
+
+    Args:
+        status (int): HTTP status code
+        message (str): Error message returned by the server
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"ArgoCD API error {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+## ------------------
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of kept-alive HTTP(S) connections to a single host, so that requests
+    don't pay for a new TCP connection and TLS handshake every time. http.client and ssl
+    are only imported when a pool is created, since the CLI backend doesn't need them.
+
+    Args:
+        host (str): Server host name
+        port (int): Server port
+        plaintext (bool, optional): Use plain HTTP instead of HTTPS. Defaults to False.
+        insecure (bool, optional): Skip TLS certificate verification. Defaults to False.
+        max_size (int, optional): Max number of idle connections kept around. Defaults to 16.
+        timeout (int, optional): Socket timeout, in seconds. Defaults to 60.
+    """
+
+    def __init__(
+        self, host, port, plaintext=False, insecure=False, max_size=16, timeout=60
+    ):
+        import http.client, ssl
+
+        self._http = http.client
+        # Errors raised when a kept-alive connection was closed by the server in the meantime
+        self._stale_connection_errors = (
+            http.client.RemoteDisconnected,
+            http.client.CannotSendRequest,
+            BrokenPipeError,
+            ConnectionResetError,
+        )
+
+        self.host = host
+        self.port = port
+        self.plaintext = plaintext
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=max_size)
+
+        self._ssl_context = None
+        if not plaintext:
+            self._ssl_context = ssl.create_default_context()
+            if insecure:
+                self._ssl_context.check_hostname = False
+                self._ssl_context.verify_mode = ssl.CERT_NONE
+
+    def _connect(self):
+        if self.plaintext:
+            return self._http.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+        return self._http.HTTPSConnection(
+            self.host, self.port, timeout=self.timeout, context=self._ssl_context
+        )
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def _checkin(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method: str, path: str, body=None, headers=None):
+        """
+        Send a request on a pooled connection. A request on a reused connection that the
+        server has closed in the meantime is retried once on a fresh connection.
+
+        Args:
+            method (str): HTTP method
+            path (str): Request path, including the query string
+            body (bytes, optional): Request body
+            headers (dict, optional): Request headers
+
+        Returns:
+            tuple: (status, response body as bytes)
+        """
+
+        conn, reused = self._checkout()
+        while True:
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except self._stale_connection_errors:
+                conn.close()
+                if not reused:
+                    raise
+                conn, reused = self._connect(), False
+                continue
+            except Exception:
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._checkin(conn)
+
+            return response.status, data
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def is_overloaded_response(response, error):
+    """
+    Tell whether an API call found the server overloaded: it returned 429 or a gateway
+    error, or timed out. A refused or reset connection is a plain failure, as it is for
+    commands (see common.OVERLOADED_COMMAND_ERROR).
+
+    Args:
+        response (tuple): (status, body) returned by ConnectionPool.request, or None
+        error (Exception): Exception raised by ConnectionPool.request, or None
+
+    Returns:
+        bool: True if the server was overloaded
+    """
+
+    if error is not None:
+        return isinstance(error, (TimeoutError, socket.timeout))
+
+    return response[0] in OVERLOADED_STATUSES
+
+
+## ------------------
+
+
+class CLIBackend:
+    """
+    ArgoCD backend that shells out to the argocd CLI.
+
+    Args:
+        ctxt (Context): PyInvoke Context. http://docs.pyinvoke.org/en/stable/api/context.html
+    """
+
+    name = BACKEND_CLI
+
+    def __init__(self, ctxt: Context):
+        self.ctxt = ctxt
+
+    def login(self, username: str, password: str):
+        insecure = "--insecure" if APP_CONFIG["argocd"]["insecure"] else ""
+        argocd_host = APP_CONFIG["argocd"]["host"]
+        argocd_port = APP_CONFIG["argocd"]["port"]
+        common.run_command(
+            self.ctxt,
+            f"argocd login {argocd_host}:{argocd_port} {insecure} --username {username} --password {password}",
+        )
+
+    def repo_add(self, repo_url: str, username: str, password: str):
+        common.run_command(
+            self.ctxt,
+            f"argocd repo add {repo_url} --username {username} --password {password}",
+        )
+
+    def repo_rm(self, repo_url: str):
+        common.run_command(self.ctxt, f"argocd repo rm {repo_url}")
+
+    def repo_list(self):
+        result = common.run_command(
+            self.ctxt, "argocd repo list -o url", hide="out", retry=True
+        )
+        return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+
+    def app_list(self, selector=None):
+        selector_flag = f"-l {selector}" if selector else ""
+        result = common.run_command(
+            self.ctxt,
+            f"argocd app list {selector_flag} -o json",
+            hide="out",
+            retry=True,
+        )
+        return json.loads(result.stdout or "[]") or []
+
+    def app_sync(self, app_name: str):
+        # Only starts the sync operation, as the REST backend does; use utils.sync to wait
+        common.run_command(self.ctxt, f"argocd app sync {app_name} --async")
+
+    def app_delete(self, app_name: str):
+        common.run_command(self.ctxt, f"argocd app delete {app_name}")
+
+    def proj_delete(self, project_name: str):
+        common.run_command(self.ctxt, f"argocd proj delete {project_name}")
+
+
+## ------------------
+
+
+class RESTBackend:
+    """
+    ArgoCD backend that talks to the ArgoCD API server's REST (gRPC-gateway) API over a
+    pool of kept-alive connections. A single bearer token is shared by all requests, and
+    cached on disk for later runs (see utils.argocd_session).
+
+    Args:
+        host (str): ArgoCD API server host name
+        port (int): ArgoCD API server port
+        plaintext (bool, optional): Use plain HTTP instead of HTTPS. Defaults to False.
+        insecure (bool, optional): Skip TLS certificate verification. Defaults to False.
+    """
+
+    name = BACKEND_REST
+
+    def __init__(self, host: str, port: int, plaintext=False, insecure=False):
+        self.pool = ConnectionPool(host, port, plaintext=plaintext, insecure=insecure)
+        self.token = None
+        self._credentials = None
+        self._login_lock = threading.Lock()
+
+    def _request(self, method: str, path: str, payload=None, authenticate=True):
+        body = None if payload is None else json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if authenticate and (self.token is not None):
+            headers["Authorization"] = f"Bearer {self.token}"
+
+        with tracing.span(
+            f"{method} {path.split('?')[0]}", tracing.CATEGORY_HTTP, path=path
+        ) as span_args:
+            request = lambda: self.pool.request(
+                method, path, body=body, headers=headers
+            )
+            # Other requests may have been carried out before the server gave up on them
+            retry = method == "GET"
+            status, data = limits.call(
+                limits.TARGET_ARGOCD, request, is_overloaded_response, retry=retry
+            )
+
+            # Token expired: log in again and retry once
+            if (status == 401) and authenticate and (self._credentials is not None):
+                self.login(*self._credentials, refresh=True)
+                headers["Authorization"] = f"Bearer {self.token}"
+                status, data = limits.call(
+                    limits.TARGET_ARGOCD, request, is_overloaded_response, retry=retry
+                )
+
+            span_args.update(status=status, response_bytes=len(data))
+
+        # Errors may come from a proxy in front of the API server, as HTML or plain text
+        if status >= 400:
+            message = data.decode("utf-8", "replace").strip()
+            try:
+                response = json.loads(data)
+                if isinstance(response, dict) and response.get("message"):
+                    message = response["message"]
+            except ValueError:
+                pass
+            raise ArgoCDAPIError(status, message)
+
+        return json.loads(data) if data.strip() else {}
+
+    def login(self, username: str, password: str, refresh=False):
+        with self._login_lock:
+            # Backends are shared by the whole process (e.g. a daemon worker), so a token
+            # from an earlier login with the same credentials is re-used. Expired tokens
+            # are refreshed by _request.
+            if (
+                (not refresh)
+                and (self.token is not None)
+                and (self._credentials == (username, password))
+            ):
+                return
+
+            # Other processes share the token through the session cache on disk
+            self.token = argocd_session.get_token(
+                self.pool.host,
+                self.pool.port,
+                username,
+                password,
+                lambda: self._request(
+                    "POST",
+                    "/api/v1/session",
+                    {"username": username, "password": password},
+                    authenticate=False,
+                )["token"],
+                rejected_token=self.token if refresh else None,
+            )
+            self._credentials = (username, password)
+
+    def repo_add(self, repo_url: str, username: str, password: str):
+        self._request(
+            "POST",
+            "/api/v1/repositories",
+            {"repo": repo_url, "username": username, "password": password},
+        )
+
+    def repo_rm(self, repo_url: str):
+        self._request("DELETE", f"/api/v1/repositories/{quote(repo_url, safe='')}")
+
+    def repo_list(self):
+        """
+        List the URLs of the repos registered in ArgoCD.
+
+        Returns:
+            list: Repo URLs
+        """
+
+        items = self._request("GET", "/api/v1/repositories").get("items") or []
+        return [item["repo"] for item in items]
+
+    def app_list(self, selector=None):
+        """
+        List applications, optionally filtered by a label selector.
+
+        Returns:
+            list: Application objects
+        """
+
+        query = f"?{urlencode({'selector': selector})}" if selector else ""
+        return self._request("GET", f"/api/v1/applications{query}").get("items") or []
+
+    def app_sync(self, app_name: str):
+        # The API only starts the sync operation; use utils.sync to wait on the result
+        self._request("POST", f"/api/v1/applications/{quote(app_name)}/sync", {})
+
+    def app_delete(self, app_name: str):
+        self._request("DELETE", f"/api/v1/applications/{quote(app_name)}?cascade=true")
+
+    def proj_delete(self, project_name: str):
+        self._request("DELETE", f"/api/v1/projects/{quote(project_name)}")
+
+
+## ------------------
+
+
+def normalize_repo_url(repo_url: str):
+    """
+    Normalize a repo URL for comparison (case, trailing slash and .git suffix are ignored).
+
+    Args:
+        repo_url (str): Repo URL
+
+    Returns:
+        str: Normalized repo URL
+    """
+
+    repo_url = repo_url.strip().rstrip("/").lower()
+    return repo_url[: -len(".git")] if repo_url.endswith(".git") else repo_url
+
+
+## ------------------
+
+
+def diff_repos(repos_list: list, registered_repos: list):
+    """
+    Split a list of repos into the ones that still need to be registered in ArgoCD, and
+    the ones that already are.
+
+    Args:
+        repos_list (list): Repo URLs
+        registered_repos (list): Repo URLs already registered in ArgoCD
+
+    Returns:
+        tuple: (missing repos, registered repos), both in the order of repos_list
+    """
+
+    registered = {normalize_repo_url(repo_url) for repo_url in registered_repos}
+    missing = [
+        repo_url
+        for repo_url in repos_list
+        if normalize_repo_url(repo_url) not in registered
+    ]
+    present = [
+        repo_url
+        for repo_url in repos_list
+        if normalize_repo_url(repo_url) in registered
+    ]
+
+    return missing, present
+
+
+## ------------------
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(ctxt: Context):
+    """
+    Get the ArgoCD backend configured by argocd-backend in config.yml, or the ARGOCD_BACKEND
+    environment variable. REST backends are shared by everything in the process that talks
+    to the same server, so they keep their connections and token between tasks.
+
+    Args:
+        ctxt (Context): PyInvoke Context. http://docs.pyinvoke.org/en/stable/api/context.html
+
+    Raises:
+        Exception: Raised if the backend name is not valid.
+
+    Returns:
+        CLIBackend | RESTBackend: ArgoCD backend
+    """
+
+    backend_name = os.environ.get(
+        "ARGOCD_BACKEND", APP_CONFIG.get("argocd-backend", BACKEND_CLI)
+    ).lower()
+
+    if backend_name == BACKEND_CLI:
+        return CLIBackend(ctxt)
+
+    if backend_name != BACKEND_REST:
+        msg = f"ERROR: Invalid ArgoCD backend [{backend_name}]. Valid values: {BACKEND_REST}, {BACKEND_CLI}"
+        publish(msg, LOG_ERROR)
+        raise Exception(msg)
+
+    argocd_config = APP_CONFIG["argocd"]
+    key = (argocd_config["host"], int(argocd_config["port"]))
+    with _backends_lock:
+        if key not in _backends:
+            _backends[key] = RESTBackend(
+                argocd_config["host"],
+                int(argocd_config["port"]),
+                plaintext=common.str2bool(argocd_config.get("plaintext", False)),
+                insecure=common.str2bool(argocd_config.get("insecure", False)),
+            )
+
+    return _backends[key]
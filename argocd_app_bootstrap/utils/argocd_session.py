@@ -0,0 +1,212 @@
+import os, json, time, base64, fcntl, hashlib, hmac
+
+from contextlib import contextmanager
+
+from argocd_app_bootstrap.definitions import APP_CONFIG, ARGOCD_SESSIONS_PATH
+from argocd_app_bootstrap.utils import common
+from argocd_app_bootstrap.utils.common import LOG_INFO, publish
+
+## ------------------
+
+# Cached tokens that expire within this many seconds are not re-used
+EXPIRY_MARGIN_SECONDS = 60
+
+## ------------------
+
+
+def get_settings():
+    """
+    Get the session cache settings (argocd-session in config.yml), with defaults. The
+    ARGOCD_SESSION_CACHE environment variable overrides enabled.
+
+    Returns:
+        dict: enabled, and max-age-hours (how long a token that doesn't say when it expires is re-used)
+    """
+
+    settings = APP_CONFIG.get("argocd-session", {})
+    return {
+        "enabled": common.str2bool(
+            os.environ.get("ARGOCD_SESSION_CACHE", settings.get("enabled", True))
+        ),
+        "max-age-hours": float(settings.get("max-age-hours", 24)),
+    }
+
+
+def get_session_path(host: str, port: int, username: str):
+    """
+    Get the path of the cached session of a user on an ArgoCD API server.
+
+    Args:
+        host (str): ArgoCD API server host name
+        port (int): ArgoCD API server port
+        username (str): ArgoCD user
+
+    Returns:
+        str: Path of the session file, named after a hash of the server and user
+    """
+
+    key = hashlib.sha256(f"{host}:{port}\n{username}".encode("utf-8")).hexdigest()[:32]
+    return os.path.join(ARGOCD_SESSIONS_PATH, f"{key}.json")
+
+
+@contextmanager
+def session_lock(session_path: str):
+    """
+    Hold an exclusive lock on a cached session. The lock is an flock on a file next to
+    the session file, so it is shared with other processes (e.g. daemon workers).
+
+    Args:
+        session_path (str): Path of the session file
+    """
+
+    os.makedirs(ARGOCD_SESSIONS_PATH, mode=0o700, exist_ok=True)
+    lock_fd = os.open(f"{session_path}.lock", os.O_WRONLY | os.O_CREAT, 0o600)
+    with os.fdopen(lock_fd, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+## ------------------
+
+
+def get_token_expiry(token: str):
+    """
+    Get when a token expires, from the exp claim of a JWT (which ArgoCD session tokens
+    are). The signature isn't checked: the server does that.
+
+    Args:
+        token (str): Session token
+
+    Returns:
+        float: Expiry time (seconds since the epoch), or None if the token isn't a JWT with an exp claim
+    """
+
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(
+            base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        )
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def get_password_check(token: str, password: str):
+    """
+    Get a value that ties a token to the password it was issued for, so that a cached
+    token is only re-used with the same password. The password itself is never stored.
+
+    Args:
+        token (str): Session token
+        password (str): ArgoCD password
+
+    Returns:
+        str: HMAC-SHA256 of the password, keyed with the token (hex)
+    """
+
+    return hmac.new(
+        token.encode("utf-8"), password.encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+
+
+def read_session(session_path: str, password: str):
+    """
+    Read a cached session token, if it's still valid for the given password.
+
+    Args:
+        session_path (str): Path of the session file
+        password (str): ArgoCD password
+
+    Returns:
+        str: The token, or None if there is none, it expires soon, or it was issued for another password
+    """
+
+    try:
+        with open(session_path, "r") as stream:
+            session = json.load(stream)
+        token = session["token"]
+        password_check = str(session["password_check"])
+        expires_at = float(session["expires_at"])
+    except (OSError, KeyError, TypeError, ValueError):
+        return None
+
+    if not hmac.compare_digest(password_check, get_password_check(token, password)):
+        return None
+    if expires_at - EXPIRY_MARGIN_SECONDS <= time.time():
+        return None
+
+    return token
+
+
+def write_session(session_path: str, password: str, token: str, max_age_hours: float):
+    """
+    Cache a session token. The file is only readable by its owner, and is replaced
+    atomically so that readers never see half of it.
+
+    Args:
+        session_path (str): Path of the session file
+        password (str): ArgoCD password the token was issued for
+        token (str): Session token
+        max_age_hours (float): How long to re-use the token if it doesn't say when it expires
+    """
+
+    expires_at = get_token_expiry(token) or (time.time() + max_age_hours * 3600)
+
+    tmp_path = f"{session_path}.{os.getpid()}.tmp"
+    tmp_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(tmp_fd, "w") as stream:
+        json.dump(
+            {
+                "token": token,
+                "password_check": get_password_check(token, password),
+                "expires_at": expires_at,
+            },
+            stream,
+        )
+    os.replace(tmp_path, session_path)
+
+
+## ------------------
+
+
+def get_token(
+    host: str, port: int, username: str, password: str, login, rejected_token=None
+):
+    """
+    Get a session token for an ArgoCD user: the cached one if it's still valid, or else a
+    new one from login, which is then cached. Processes that want a token for the same
+    user and server at the same time take turns, so only the first one logs in.
+
+    Args:
+        host (str): ArgoCD API server host name
+        port (int): ArgoCD API server port
+        username (str): ArgoCD user
+        password (str): ArgoCD password
+        login (callable): Logs in, and returns a new token
+        rejected_token (str, optional): Token the server just rejected. It isn't re-used, but a token another process got since then is.
+
+    Returns:
+        str: Session token
+    """
+
+    settings = get_settings()
+    if not settings["enabled"]:
+        return login()
+
+    session_path = get_session_path(host, port, username)
+    with session_lock(session_path):
+        token = read_session(session_path, password)
+        if (token is not None) and (token != rejected_token):
+            publish(
+                f"INFO: Re-using cached ArgoCD session of [{username}] on [{host}:{port}]",
+                LOG_INFO,
+            )
+            return token
+
+        token = login()
+        write_session(session_path, password, token, settings["max-age-hours"])
+
+    return token
@@ -0,0 +1,201 @@
+import os, json, time, shutil
+
+from argocd_app_bootstrap.definitions import BATCH_PATH, yaml
+from argocd_app_bootstrap.utils import daemon
+from argocd_app_bootstrap.utils.common import LOG_INFO, LOG_WARN, publish
+
+## ------------------
+
+# Columns of the summary table: header, job key. The last column isn't padded.
+TABLE_COLUMNS = [
+    ("BUNDLE", "name"),
+    ("JOB", "type"),
+    ("STATUS", "status"),
+    ("QUEUED", "queue_seconds"),
+    ("RUN", "run_seconds"),
+    ("ERROR", "error"),
+]
+
+## ------------------
+
+
+def load_manifest(manifest_path: str, default_type: str):
+    """
+    Read the bundles to process from a manifest. The manifest is a YAML list of bundles, or
+    a mapping with bundles and defaults (arguments every bundle gets unless it sets its own,
+    if its job type takes them).
+    A bundle is a parent repo URL, or a mapping of task arguments (e.g. git_repo_url,
+    target_environment) with an optional type (job type) and name.
+
+    Args:
+        manifest_path (str): Manifest file
+        default_type (str): Job type of bundles that don't set one (see daemon.JOB_TASKS)
+
+    Raises:
+        Exception: Raised if the manifest doesn't list any bundle, or a bundle isn't a repo URL or a mapping.
+
+    Returns:
+        list: Job requests (type, name, args), in manifest order
+    """
+
+    with open(manifest_path, "r") as stream:
+        manifest = yaml.load(stream)
+
+    defaults = {}
+    if isinstance(manifest, dict):
+        defaults = manifest.get("defaults") or {}
+        manifest = manifest.get("bundles")
+
+    if (not isinstance(manifest, list)) or (not manifest):
+        raise Exception(f"[{manifest_path}] must list at least one bundle")
+
+    requests = []
+    for i, bundle in enumerate(manifest):
+        if isinstance(bundle, str):
+            bundle = {"git_repo_url": bundle}
+        if not isinstance(bundle, dict):
+            raise Exception(
+                f"Bundle {i} in [{manifest_path}] must be a repo URL or a mapping"
+            )
+
+        args = dict(bundle)
+        job_type = args.pop("type", default_type)
+        if job_type in daemon.JOB_TASKS:
+            valid_args = daemon.get_task_args(job_type)
+            for name, value in defaults.items():
+                if (name in valid_args) and (name not in args):
+                    args[name] = value
+
+        requests.append(
+            {"type": job_type, "name": args.pop("name", None), "args": args}
+        )
+
+    return requests
+
+
+## ------------------
+
+
+def run_batch(requests: list, num_workers: int):
+    """
+    Run bundles concurrently on up to num_workers worker processes (see daemon.Worker).
+    Each bundle is a job with its own invoke context and a freshly wiped data dir. ArgoCD
+    sessions and compiled templates are shared by the bundles that run on the same worker.
+    Jobs for the same parent repo run one at a time, in manifest order. If the run is
+    interrupted, the bundles that are running are finished, and the others fail.
+
+    Args:
+        requests (list): Job requests, as returned by load_manifest
+        num_workers (int): Max number of bundles processed at once
+
+    Raises:
+        Exception: Raised if a bundle is not valid. Nothing is run then.
+
+    Returns:
+        list: The jobs, in manifest order
+    """
+
+    run_path = os.path.join(
+        BATCH_PATH, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    )
+    logs_path = os.path.join(run_path, "logs")
+    workers_path = os.path.join(run_path, daemon.WORKERS_DIR)
+
+    jobs = []
+    for i, request in enumerate(requests):
+        try:
+            jobs.append(daemon.make_job(request, logs_path))
+        except Exception as e:
+            name = request.get("name") or request["args"].get("git_repo_url")
+            raise Exception(f"Invalid bundle {i} [{name}]: {str(e)}")
+
+    queue = daemon.JobQueue(len(jobs))
+    for job in jobs:
+        queue.submit(job)
+
+    workers = [
+        daemon.Worker(index, queue, workers_path)
+        for index in range(min(num_workers, len(jobs)))
+    ]
+    publish(
+        f"INFO: Processing {len(jobs)} bundles on {len(workers)} workers. Logs: [{logs_path}]",
+        LOG_INFO,
+    )
+
+    try:
+        for worker in workers:
+            worker.start()
+
+        for job in jobs:
+            while queue.get(job["id"], wait_seconds=60)["status"] in (
+                daemon.STATUS_QUEUED,
+                daemon.STATUS_RUNNING,
+            ):
+                pass
+
+    except KeyboardInterrupt:
+        publish("WARN: Interrupted. Waiting for running bundles", LOG_WARN)
+
+    finally:
+        queue.close()
+        for worker in workers:
+            if worker.process is not None:
+                worker.stop()
+        shutil.rmtree(workers_path, ignore_errors=True)
+
+    return jobs
+
+
+## ------------------
+
+
+def format_table(jobs: list):
+    """
+    Format a table with one row per job: its name, type, status, time queued and running,
+    and for failed jobs, the first line of the error and the log file.
+
+    Args:
+        jobs (list): The jobs
+
+    Returns:
+        list: Table lines
+    """
+
+    rows = [[header for header, _ in TABLE_COLUMNS]]
+    for job in jobs:
+        row = []
+        for _, key in TABLE_COLUMNS:
+            value = job[key]
+            if key.endswith("_seconds"):
+                value = "-" if value is None else f"{value}s"
+            # One line per job: multi-line errors are in full in the log
+            row.append("" if value is None else str(value).strip().split("\n")[0])
+
+        if job["status"] == daemon.STATUS_FAILED and os.path.exists(job["log"]):
+            row[-1] = f"{row[-1]} (log: {job['log']})"
+        rows.append(row)
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(TABLE_COLUMNS) - 1)]
+    return [
+        "  ".join(
+            [cell.ljust(width) for cell, width in zip(row, widths)] + [row[-1]]
+        ).rstrip()
+        for row in rows
+    ]
+
+
+def write_report(report_path: str, jobs: list):
+    """
+    Write the details of every job (see daemon.get_job_details) to a JSON file.
+
+    Args:
+        report_path (str): File to write to
+        jobs (list): The jobs
+    """
+
+    with open(report_path, "w") as stream:
+        json.dump(
+            {"bundles": [daemon.get_job_details(job) for job in jobs]},
+            stream,
+            indent=2,
+        )
@@ -1,17 +1,25 @@
-import os, inspect, re, string
+import os, re, string, sys, functools, threading, time
+
+from concurrent.futures import ThreadPoolExecutor
 
 from invoke import Context
-from jinja2 import Environment, FileSystemLoader
-from structlog import get_logger
 
 
 from argocd_app_bootstrap.definitions import (
     APP_CONFIG,
+    ARGOCD_DIR,
     ARGO_PROJ_YAML,
     PARENT_REPO_PATH,
-    TEMPLATES_PATH,
     yaml,
 )
+from argocd_app_bootstrap.utils import (
+    git_cache,
+    limits,
+    log,
+    staging,
+    templates,
+    tracing,
+)
 
 ## ------------------
 
@@ -36,8 +44,6 @@ def str2bool(value: str):
 
 ## ------------------
 
-logger = get_logger()
-
 # Logging states
 LOG_INFO = "INFO"
 LOG_WARN = "WARN"
@@ -46,18 +52,73 @@ LOG_ERROR = "ERROR"
 DEFAULT_NAMESPACE = "default"
 DESTINATION_CLUSTER_IN_CLUSTER = "in-cluster"
 
+# Namespace that ArgoCD Applications and AppProjects are created in
+ARGOCD_NAMESPACE = "argocd"
+
+# Clone strategies. Full clones go through the git mirror cache (if enabled); the others
+# fetch as little as possible straight from the remote.
+CLONE_FULL = "full"
+CLONE_SHALLOW = "shallow"
+CLONE_BLOBLESS = "blobless"
+CLONE_SPARSE = "sparse"
+
+CLONE_FLAGS = {
+    CLONE_FULL: "",
+    CLONE_SHALLOW: "--depth 1",
+    CLONE_BLOBLESS: "--filter=blob:none",
+    # Only the top-level files (e.g. argo_proj.yml) and the argocd folder are checked out
+    CLONE_SPARSE: "--depth 1 --filter=blob:none --sparse",
+}
+
+# Last progress line of each pack git receives, e.g. "Receiving objects: 100% (29/29),
+# 3.61 KiB | 3.61 MiB/s, done.". The size is left out when the pack arrives quickly.
+RECEIVED_PACK = re.compile(
+    r"Receiving objects: +\d+% \(\d+/\d+\)(?:, ([\d.]+) (bytes|KiB|MiB|GiB) \| [^,\r\n]*)?, done\."
+)
+SIZE_UNITS = {"bytes": 1, "KiB": 1024, "MiB": 1024**2, "GiB": 1024**3}
+
+# Kubernetes-compatible names: "_" becomes "-", other punctuation and whitespace is dropped
+K8S_NAME_TRANSLATION = str.maketrans(
+    "_", "-", string.punctuation.replace("-", "").replace("_", "") + string.whitespace
+)
+
+# DNS-1123 length limits. Namespaces and label values are labels; most other resource
+# names (e.g. AppProjects) are subdomains. Application names are held to the label limit,
+# since ArgoCD copies them into the app.kubernetes.io/instance label.
+DNS1123_LABEL_MAX_LENGTH = 63
+DNS1123_SUBDOMAIN_MAX_LENGTH = 253
+
+# Errors of argocd and kubectl commands that mean the server was overloaded: gRPC codes,
+# HTTP statuses (only where they're reported as one, since app names, revisions and the
+# like can hold the same digits) and network timeouts. Timeouts of the command itself
+# (e.g. argocd app wait --timeout) aren't, nor is a refused connection.
+OVERLOADED_COMMAND_ERROR = re.compile(
+    r"code = (Unavailable|ResourceExhausted|DeadlineExceeded)\b"
+    r"|\b(status|status code|HTTP/[\d.]+)[ :=]+(429|502|503|504)\b"
+    r"|\b429 Too Many Requests|\b502 Bad Gateway|\b503 Service Unavailable|\b504 Gateway Timeout"
+    r"|too many requests|the server is currently unable to handle the request"
+    r"|context deadline exceeded|i/o timeout|TLS handshake timeout|Client\.Timeout exceeded",
+    re.IGNORECASE,
+)
+
 ## ------------------
 
 
-def run_command(ctxt: Context, command: str, raise_exception_on_err=True, hide=None):
+def run_command(
+    ctxt: Context, command: str, raise_exception_on_err=True, hide=None, retry=False
+):
     """
-    Run command-line command
+    Run command-line command. When tracing is on, the call is recorded as a span, with the
+    (redacted) command, exit code and output size. Commands are limited by target (their
+    first word, e.g. argocd or kubectl; see utils.limits), and, if they are safe to run
+    again, retried when they fail because the server is overloaded.
 
     Args:
         ctxt (Context): PyInvoke Context. http://docs.pyinvoke.org/en/stable/api/context.html
         command (str): The command to execute
         raise_exception_on_err (bool, optional): If false, don't raise an exception. We can use this to capture the error message. Defaults to True.
         hide (bool, optional): If true, hide the command outputs. Valid values: "err", "out", "both", "none". Defaults to None.
+        retry (bool, optional): Retry the command if the server was overloaded. Only for commands that can safely run twice (reads, kubectl apply). Defaults to False.
 
     Raises:
         Exception: Exception raised if command errs out (non-zero return code).
@@ -66,7 +127,20 @@ def run_command(ctxt: Context, command: str, raise_exception_on_err=True, hide=N
         Result: PyInvoke result object. http://docs.pyinvoke.org/en/stable/api/runners.html
     """
 
-    result = ctxt.run(command, warn=True, hide=hide)
+    with tracing.span(
+        tracing.get_command_name(command), tracing.CATEGORY_COMMAND, command=command
+    ) as span_args:
+        result = limits.call(
+            tracing.get_command_name(command).split(" ")[0],
+            lambda: ctxt.run(command, warn=True, hide=hide),
+            is_overloaded_command,
+            retry=retry,
+        )
+        span_args.update(
+            exit_code=result.exited,
+            stdout_bytes=len(result.stdout.encode("utf-8")),
+            stderr_bytes=len(result.stderr.encode("utf-8")),
+        )
 
     if raise_exception_on_err and (result.exited != 0):
         raise Exception(f"{result.stderr}")
@@ -74,41 +148,95 @@ def run_command(ctxt: Context, command: str, raise_exception_on_err=True, hide=N
     return result
 
 
+def is_overloaded_command(result, error):
+    """
+    Tell whether a command failed because the server it called was overloaded (e.g. it
+    returned 429 or 503, or timed out).
+
+    Args:
+        result (Result): PyInvoke result object, or None
+        error (Exception): Exception raised when running the command, or None
+
+    Returns:
+        bool: True if the server was overloaded
+    """
+
+    if result is None:
+        return False
+
+    return (result.exited != 0) and bool(OVERLOADED_COMMAND_ERROR.search(result.stderr))
+
+
+## ------------------
+
+
+def run_concurrently(func, items: list, jobs=1):
+    """
+    Call func on every item, on a pool of up to `jobs` threads. Every item is processed,
+    even if some of them fail.
+
+    Args:
+        func (callable): Function to call on each item
+        items (list): Items to process
+        jobs (int, optional): Max number of concurrent calls. Defaults to 1.
+
+    Returns:
+        dict: Exceptions raised by func, keyed by item index
+    """
+
+    errors = {}
+
+    def call(index_item):
+        index, item = index_item
+        try:
+            func(item)
+        except Exception as e:
+            errors[index] = e
+
+    with ThreadPoolExecutor(max_workers=max(int(jobs), 1)) as executor:
+        list(executor.map(call, enumerate(items)))
+
+    return errors
+
+
 ## ------------------
 
 
 def publish(msg: str, type: str):
     """
     Wrapper for logging. Future state: post message to listener endpoint (future state)
+    Messages below the configured level (see log.configure) are dropped before anything
+    else is done.
 
     Args:
         msg (str): The message to be published.
         type (str): The log type. Valid values: LOG_ERROR, LOG_INFO, LOG_WARN
     """
 
-    # Always include these in every log
-    log = logger.bind(
-        app="argocd_app_bootstrap", caller=inspect.currentframe().f_back.f_code.co_name
-    )
+    if type not in log.LEVELS:
+        type = type.upper()
 
-    # Loggers for different occasions
-    if type.upper() == LOG_INFO:
-        log.info(msg)
+    if not log.is_enabled(type):
+        return
 
-    if type.upper() == LOG_ERROR:
-        log.error(f"AN ERROR HAS OCCURRED: {msg}")
+    if type == LOG_ERROR:
+        msg = f"AN ERROR HAS OCCURRED: {msg}"
 
-    if type.upper() == LOG_WARN:
-        log.warning(msg)
+    # Always include the caller in every log
+    getattr(log.get_logger(), log.METHODS[type])(
+        msg, caller=sys._getframe(1).f_code.co_name
+    )
 
 
 ## ------------------
 
 
+@functools.lru_cache(maxsize=None)
 def cleanup_str_for_k8s(value: str):
     """
     Clean up string so that it is kubernetes-compatible: remove special chars (except "-"), and
-    convert all text to lower-case.
+    convert all text to lower-case. Results are cached, since the same names and namespaces
+    come up again and again.
 
     Args:
         value (str): The string to clean up
@@ -117,29 +245,139 @@ def cleanup_str_for_k8s(value: str):
         str: The kubernetes-compatible string
     """
 
-    value = value.replace("_", "-")
-    invalid_chars = string.punctuation.replace("-", "") + string.whitespace
-    chars = re.escape(invalid_chars)
-    new_value = re.sub(r"[" + chars + "]", "", value).lower()
-    return new_value
+    return str(value).translate(K8S_NAME_TRANSLATION).lower()
 
 
 ## ------------------
 
 
-def cleanup_argo_proj_yaml(argo_proj_yaml):
+def normalize_child_apps(child_apps: list, environments: list, parent_app_name=None):
+    """
+    Clean up the names and namespaces of all child apps in one pass, and find the names that
+    Kubernetes or ArgoCD would not accept: apps whose names clean up to the same value (their
+    Applications would overwrite each other), and names or namespaces that are empty or too
+    long, once the "-app-{environment}" (or "-{environment}" for namespaces) suffix is added.
+    The root and namespaces apps of the parent app are checked too.
 
-    argo_proj_yaml["argocd"]["project"]["name"] = cleanup_str_for_k8s(
-        argo_proj_yaml["argocd"]["project"]["name"]
+    Args:
+        child_apps (list): Child app details (dicts with a name and namespace)
+        environments (list): Environments that Applications are generated for
+        parent_app_name (str, optional): Cleaned up parent app name. Its Applications count towards collisions. Defaults to None.
+
+    Returns:
+        dict: names and namespaces (cleaned up, in the same order as child_apps), collisions (cleaned up name -> original names, for names shared by more than one app), and invalid (list of problems with names and namespaces)
+    """
+
+    names = [cleanup_str_for_k8s(child_app["name"]) for child_app in child_apps]
+    namespaces = [
+        cleanup_str_for_k8s(child_app["namespace"]) for child_app in child_apps
+    ]
+
+    originals = {}
+    if parent_app_name is not None:
+        originals[parent_app_name] = [f"{parent_app_name} (parent app)"]
+    for child_app, name in zip(child_apps, names):
+        originals.setdefault(name, []).append(str(child_app["name"]))
+
+    collisions = {
+        name: original_names
+        for name, original_names in originals.items()
+        if len(original_names) > 1
+    }
+
+    invalid = []
+    app_names = list(originals)
+    if parent_app_name:
+        app_names.extend([f"root-{parent_app_name}", f"namespaces-{parent_app_name}"])
+    for name in app_names:
+        longest_app_name = max(
+            [get_app_name(name, environment) for environment in environments],
+            key=len,
+            default=name,
+        )
+        if not name:
+            invalid.append("App name is empty once cleaned up")
+        elif len(longest_app_name) > DNS1123_LABEL_MAX_LENGTH:
+            invalid.append(
+                f"Application name [{longest_app_name}] is longer than {DNS1123_LABEL_MAX_LENGTH} characters"
+            )
+    for namespace in dict.fromkeys(namespaces):
+        longest_namespace = max(
+            [
+                get_namespace_name(namespace, environment)
+                for environment in environments
+            ],
+            key=len,
+            default=namespace,
+        )
+        if not namespace:
+            invalid.append("App namespace is empty once cleaned up")
+        elif len(longest_namespace) > DNS1123_LABEL_MAX_LENGTH:
+            invalid.append(
+                f"Namespace [{longest_namespace}] is longer than {DNS1123_LABEL_MAX_LENGTH} characters"
+            )
+
+    return {
+        "names": names,
+        "namespaces": namespaces,
+        "collisions": collisions,
+        "invalid": invalid,
+    }
+
+
+## ------------------
+
+
+def cleanup_argo_proj_yaml(argo_proj_yaml, environments=None):
+    """
+    Clean up the project, parent app and child app names (and child app namespaces) in
+    argo_proj.yml so that they are kubernetes-compatible.
+
+    Args:
+        argo_proj_yaml (dict): Contents of argo_proj.yml
+        environments (list, optional): Environments that Applications are generated for. Defaults to the environments in config.yml.
+
+    Raises:
+        Exception: Raised if names collide or are not valid, once cleaned up.
+
+    Returns:
+        dict: argo_proj_yaml, cleaned up
+    """
+
+    argocd_config = argo_proj_yaml["argocd"]
+    environments = environments or APP_CONFIG["environments"]
+
+    argocd_config["project"]["name"] = cleanup_str_for_k8s(
+        argocd_config["project"]["name"]
+    )
+
+    argocd_config["parent_app"]["name"] = cleanup_str_for_k8s(
+        argocd_config["parent_app"]["name"]
     )
 
-    argo_proj_yaml["argocd"]["parent_app"]["name"] = cleanup_str_for_k8s(
-        argo_proj_yaml["argocd"]["parent_app"]["name"]
+    child_apps = argocd_config["child_apps"]["app"]
+    normalized = normalize_child_apps(
+        child_apps, environments, argocd_config["parent_app"]["name"]
     )
+    for child_app, name, namespace in zip(
+        child_apps, normalized["names"], normalized["namespaces"]
+    ):
+        child_app["name"] = name
+        child_app["namespace"] = namespace
+
+    problems = [
+        f"Apps [{', '.join(original_names)}] all map to [{name}]"
+        for name, original_names in normalized["collisions"].items()
+    ] + normalized["invalid"]
+
+    project_name = argocd_config["project"]["name"]
+    if len(project_name) > DNS1123_SUBDOMAIN_MAX_LENGTH:
+        problems.append(
+            f"Project name [{project_name}] is longer than {DNS1123_SUBDOMAIN_MAX_LENGTH} characters"
+        )
 
-    for child_app in argo_proj_yaml["argocd"]["child_apps"]["app"]:
-        child_app["name"] = cleanup_str_for_k8s(child_app["name"])
-        child_app["namespace"] = cleanup_str_for_k8s(child_app["namespace"])
+    if problems:
+        raise Exception(f"Invalid app names in {ARGO_PROJ_YAML}: {'; '.join(problems)}")
 
     return argo_proj_yaml
 
@@ -156,6 +394,9 @@ def init_bootstrap(
     argocd_password: str,
     target_repo_path=PARENT_REPO_PATH,
     target_environment=None,
+    jobs=1,
+    clone_strategy=CLONE_FULL,
+    dry_run=None,
 ):
     """
     Set up context variables.
@@ -168,12 +409,24 @@ def init_bootstrap(
         argocd_username (str): ArgoCD username
         argocd_password (str): ArgoCD password
         target_environment (str): Target environment to deploy to
+        jobs (int): Max number of apps to process concurrently. Defaults to 1.
+        clone_strategy (str): How to clone the parent repo (full, shallow, blobless, sparse). Defaults to full.
+        dry_run (str): If set, export the rendered files to stdout in this format (yaml, tar) instead of pushing them. Defaults to None.
 
     Raises:
         Exception: Raise exception when any of the params (except git username) is missing.
     """
 
-    if (
+    if dry_run:
+        if dry_run not in staging.EXPORT_FORMATS:
+            msg = f"ERROR: Invalid dry run format [{dry_run}]. Valid values: {', '.join(staging.EXPORT_FORMATS)}"
+            publish(msg, LOG_ERROR)
+            raise Exception(msg)
+
+        # stdout is reserved for the exported files
+        log.configure(stream=sys.stderr)
+
+    elif (
         (git_token is None)
         or (git_repo_url is None)
         or (argocd_username is None)
@@ -183,6 +436,11 @@ def init_bootstrap(
         publish(msg, LOG_ERROR)
         raise Exception(msg)
 
+    if clone_strategy not in CLONE_FLAGS:
+        msg = f"ERROR: Invalid clone strategy [{clone_strategy}]. Valid values: {', '.join(CLONE_FLAGS)}"
+        publish(msg, LOG_ERROR)
+        raise Exception(msg)
+
     # Git details
     ctxt.config["git_username"] = (
         git_username if (git_username is not None) and (git_username != "") else None
@@ -194,54 +452,146 @@ def init_bootstrap(
     ctxt.config["argocd_username"] = argocd_username
     ctxt.config["argocd_password"] = argocd_password
 
+    # Keep credentials out of traces
+    tracing.add_secret(git_token)
+    tracing.add_secret(argocd_password)
+
     ctxt.config["git_repo_path"] = target_repo_path
 
     # Target environment
     if target_environment is not None:
         ctxt.config["target_environment"] = target_environment.lower()
 
+    ctxt.config["jobs"] = max(int(jobs), 1)
+    ctxt.config["clone_strategy"] = clone_strategy
+    ctxt.config["dry_run"] = dry_run or None
+
 
 ## ------------------
 
 
-def process_app_template(
+def get_app_name(app_name: str, environment: str):
+    """
+    Get the name of the ArgoCD Application of an app in the given environment.
+
+    Args:
+        app_name (str): App name
+        environment (str): Target environment (e.g. dev, qa, prod)
+
+    Returns:
+        str: Application name
+    """
+
+    return f"{app_name}-app-{environment}"
+
+
+def get_namespace_name(namespace: str, environment: str):
+    """
+    Get the name of an app's namespace in the given environment.
+
+    Args:
+        namespace (str): Namespace, as listed in argo_proj.yml
+        environment (str): Target environment (e.g. dev, qa, prod)
+
+    Returns:
+        str: Namespace name
+    """
+
+    return f"{namespace}-{environment}"
+
+
+def get_project_name(project_name: str, environment: str):
+    """
+    Get the name of the ArgoCD AppProject in the given environment.
+
+    Args:
+        project_name (str): Project name, as listed in argo_proj.yml
+        environment (str): Target environment (e.g. dev, qa, prod)
+
+    Returns:
+        str: AppProject name
+    """
+
+    return f"{project_name}-{environment}"
+
+
+## ------------------
+
+
+class AppView:
+    """
+    Read-only view of an app in one environment. name and namespace are the app's
+    Application name and namespace in that environment, worked out when they're read.
+    Everything else is read straight from the app, which is never copied or changed.
+    Supports the dict lookups that templates and tasks use ([key], get, in).
+
+    Args:
+        app (dict): App details (e.g. a ChildApp from the argo_proj.yml model)
+        environment (str): Target environment (e.g. dev, qa, prod)
+    """
+
+    __slots__ = ("app", "environment")
+
+    def __init__(self, app: dict, environment: str):
+        self.app = app
+        self.environment = environment
+
+    def __getitem__(self, key):
+        value = self.app[key]
+        if key == "name":
+            return get_app_name(value, self.environment)
+        if key == "namespace":
+            return get_namespace_name(value, self.environment)
+        return value
+
+    def __contains__(self, key):
+        return key in self.app
+
+    def get(self, key, default=None):
+        return self[key] if key in self.app else default
+
+
+## ------------------
+
+
+def render_app_template(
     app_details: dict,
     namespace: str,
     destination_cluster: str,
     project_name: str,
-    destination_dir: str,
     environment: str,
     deploy_plugin=None,
 ):
     """
-    Apply the ArgoCD application template to the given data set.
+    Render the ArgoCD application template for the given data set, without writing it out.
+    The app is rendered through an AppView, so app_details is neither copied nor changed,
+    and the same app can be rendered for several environments at once.
 
     Args:
-        app_details (dict): Information about the app
+        app_details (dict): Information about the app, or an AppView of it in the environment
         namespace (str): App's target namespace
         destination_cluster (str): App target ArgoCD cluster
         project_name (str): Name of ArgoCD project that the app belongs to
-        destination_dir (str): Destination directory that transformed YAML file is written to.
         environment (str): Target environment (e.g. dev, qa, prod)
         deploy_plugin (str): Plugin to use for deployment (other than Helm or Kustomize)
-    """
 
-    env = Environment(loader=FileSystemLoader(TEMPLATES_PATH), trim_blocks=True)
+    Returns:
+        tuple: (file name, rendered YAML)
+    """
 
-    app_details["name"] = f"{app_details['name']}-app-{environment}"
+    if not isinstance(app_details, AppView):
+        app_details = AppView(app_details, environment)
 
-    # app_details["name"] = app_details["name"]
-    rendered_data = env.get_template(f"application.yml.j2").stream(
+    filename = app_details.get("filename", f"{app_details['name']}.yml")
+    content = templates.get_template("application.yml.j2").render(
         app=app_details,
         namespace=namespace,
         destination_cluster=destination_cluster,
-        project_name=f"{project_name}-{environment}",
+        project_name=get_project_name(project_name, environment),
         deploy_plugin=deploy_plugin,
     )
 
-    filename = app_details.get("filename", f"{app_details['name']}.yml")
-    rendered_data.dump(f"{destination_dir}/{filename}")
-    publish(f"INFO: Created [{destination_dir}/{filename}]", LOG_INFO)
+    return filename, content
 
 
 ## ------------------
@@ -250,14 +600,11 @@ def process_app_template(
 def get_repos(ctxt, children_only=False):
 
     # Get child repos
-    repos_list = [
-        child_app["repo_url"]
-        for child_app in ctxt["argo_proj_yaml"]["argocd"]["child_apps"]["app"]
-    ]
+    repos_list = [child_app.repo_url for child_app in ctxt["argo_proj"].child_apps]
 
     # Add parent repo
     if not children_only:
-        repos_list.append(ctxt["argo_proj_yaml"]["argocd"]["parent_app"]["repo_url"])
+        repos_list.append(ctxt["argo_proj"].parent_app.repo_url)
 
     # Remove duplicates from list
     repos_list = list(dict.fromkeys(repos_list))
@@ -268,13 +615,28 @@ def get_repos(ctxt, children_only=False):
 ## ------------------
 
 
-def clone_repo(ctxt, git_repo, target_path):
+# Token that the global git config was last set up with
+_git_configured_token = None
+_git_config_lock = threading.Lock()
+
+
+def configure_git(ctxt):
+    """
+    Set up git token access and the commit identity. Global git config is only written
+    once per process (and again if the token changes, e.g. between daemon jobs), so that
+    concurrent clones don't fight over ~/.gitconfig.lock.
+
+    Args:
+        ctxt (Context): PyInvoke Context. http://docs.pyinvoke.org/en/stable/api/context.html
+    """
+
+    global _git_configured_token
 
     git_provider = APP_CONFIG["git-provider"]
-    git_url_prefix = f"git@{git_provider}:"
-    if os.environ["ENV"] != "development":
+    with _git_config_lock:
+        if _git_configured_token == ctxt["git_token"]:
+            return
 
-        git_url_prefix = f"https://{git_provider}/"
         os.environ["MY_GIT_TOKEN"] = ctxt["git_token"]
 
         run_command(
@@ -288,6 +650,98 @@ def clone_repo(ctxt, git_repo, target_path):
             ctxt, f'git config --global user.email {APP_CONFIG["argocd-admin-email"]}'
         )
 
+        _git_configured_token = ctxt["git_token"]
+
+
+## ------------------
+
+
+def get_received_bytes(stderr: str, repo_path: str):
+    """
+    Get the number of bytes a git clone received, from its progress output (--progress).
+    When git leaves the size out of a pack's progress line, the size of the packs in the
+    new repo is used instead, since a clone stores the packs it receives as they are.
+
+    Args:
+        stderr (str): Standard error of the clone
+        repo_path (str): The cloned repo
+
+    Returns:
+        int: Bytes received, or None if nothing was received over the network (e.g. a clone of a local path)
+    """
+
+    packs = list(RECEIVED_PACK.finditer(stderr))
+    if not packs:
+        return None
+
+    if all(pack.group(1) for pack in packs):
+        return int(
+            sum(float(pack.group(1)) * SIZE_UNITS[pack.group(2)] for pack in packs)
+        )
+
+    pack_path = os.path.join(repo_path, ".git", "objects", "pack")
+    return sum(
+        os.path.getsize(os.path.join(pack_path, name))
+        for name in os.listdir(pack_path)
+        if name.endswith(".pack")
+    )
+
+
+def clone_repo(ctxt, git_repo, target_path, strategy=CLONE_FULL):
+    """
+    Clone a git repo, and report how much was fetched and how long it took.
+
+    Args:
+        ctxt (Context): PyInvoke Context. http://docs.pyinvoke.org/en/stable/api/context.html
+        git_repo (str): Git repo HTTPS URL
+        target_path (str): Where to clone the repo to
+        strategy (str, optional): Clone strategy (full, shallow, blobless, sparse). Defaults to full.
+
+    Returns:
+        dict: Clone stats (strategy, fetched_bytes, seconds). fetched_bytes is what the
+            mirror grew by with the mirror cache, and what git reports receiving otherwise
+            (None if nothing was received over the network). Blobs fetched later on
+            demand (e.g. by sparse-checkout) aren't counted.
+    """
+
+    git_provider = APP_CONFIG["git-provider"]
+    git_url_prefix = f"git@{git_provider}:"
+    if os.environ["ENV"] != "development":
+
+        git_url_prefix = f"https://{git_provider}/"
+        configure_git(ctxt)
+
     git_url = git_repo.replace(f"https://{git_provider}/", git_url_prefix)
     publish(f"INFO: Using Git URL [{git_url}]", LOG_INFO)
-    run_command(ctxt, f"git clone {git_url} {target_path}")
+
+    start = time.perf_counter()
+    use_cache = str2bool(APP_CONFIG.get("git-cache", {}).get("enabled", False))
+
+    if (strategy == CLONE_FULL) and use_cache:
+        fetched_bytes = git_cache.clone(ctxt, git_url, target_path)
+    else:
+        result = run_command(
+            ctxt,
+            f"git clone --progress {CLONE_FLAGS[strategy]} {git_url} {target_path}",
+            hide="err",
+        )
+        fetched_bytes = get_received_bytes(result.stderr, target_path)
+        if strategy == CLONE_SPARSE:
+            run_command(ctxt, f"git -C {target_path} sparse-checkout set {ARGOCD_DIR}")
+
+    stats = {
+        "strategy": strategy,
+        "fetched_bytes": fetched_bytes,
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+    fetched = (
+        "nothing over the network"
+        if fetched_bytes is None
+        else f"{fetched_bytes / 1024:.1f} KiB"
+    )
+    publish(
+        f"INFO: Cloned [{git_url}] ({strategy}): fetched {fetched} in {stats['seconds']}s",
+        LOG_INFO,
+    )
+
+    return stats
@@ -0,0 +1,831 @@
+import os, sys, hmac, json, time, uuid, socket, inspect, secrets, threading, socketserver
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from argocd_app_bootstrap.definitions import (
+    APP_CONFIG,
+    DAEMON_PATH,
+    DATA_PATH,
+    DEPLOY_TEMPLATES_PATH,
+    TEMPLATES_PATH,
+)
+from argocd_app_bootstrap.utils import argocd, limits, log, tracing
+from argocd_app_bootstrap.utils.common import LOG_ERROR, LOG_INFO, LOG_WARN, publish
+
+## ------------------
+
+# Tasks that can be run as jobs, by job type
+JOB_TASKS = {
+    "setup_app_of_apps": "argo-setup.setup-app-of-apps",
+    "deploy_app_bundle": "argo-run.deploy-app-bundle",
+    "bootstrap_k8s_deployment": "deploy-setup.bootstrap-k8s-deployment",
+}
+
+# Job states
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+# Job arguments that are never shown in job details
+SECRET_ARG_NAMES = ("token", "password", "secret")
+
+SOCKET_FILE = "daemon.sock"
+TOKEN_FILE = "daemon.token"
+JOBS_DIR = "jobs"
+WORKERS_DIR = "workers"
+
+# Max time a GET /jobs/<id>?wait=<seconds> request waits for the job to finish
+MAX_WAIT_SECONDS = 300
+
+# Max size of a job request, in bytes
+MAX_REQUEST_BYTES = 1024 * 1024
+
+## ------------------
+
+
+def get_settings():
+    """
+    Get the daemon settings (daemon in config.yml), with defaults.
+
+    Returns:
+        dict: workers (number of worker processes) and max-finished-jobs
+    """
+
+    settings = APP_CONFIG.get("daemon", {})
+    return {
+        "workers": int(settings.get("workers", 2)),
+        "max-finished-jobs": int(settings.get("max-finished-jobs", 500)),
+    }
+
+
+## ------------------
+
+
+def get_task_args(job_type: str):
+    """
+    Get the names of the arguments that a job type takes, i.e. its task's arguments.
+
+    Args:
+        job_type (str): Job type (a key of JOB_TASKS)
+
+    Returns:
+        list: Argument names (e.g. git_repo_url)
+    """
+
+    # Imported here, since it loads the task modules
+    from argocd_app_bootstrap import get_namespace
+
+    collection_name = JOB_TASKS[job_type].split(".", 1)[0]
+    task = get_namespace([collection_name.replace("-", "_")])[JOB_TASKS[job_type]]
+    return list(inspect.signature(task.body).parameters)[1:]
+
+
+def make_job(request: dict, logs_path=os.path.join(DAEMON_PATH, JOBS_DIR)):
+    """
+    Build a job from a job request.
+
+    Args:
+        request (dict): type (a key of JOB_TASKS), args (task arguments by name, e.g.
+            {"git_repo_url": "...", "jobs": 4}) and, optionally, a name to show for the job
+            (defaults to the repo URL). Arguments that aren't given, or are null or false,
+            default to the daemon's environment variables, as they do on the command line.
+        logs_path (str, optional): Folder for the job's log. Defaults to the daemon's jobs folder.
+
+    Raises:
+        Exception: Raised if the job type or an argument is not valid.
+
+    Returns:
+        dict: The job, queued
+    """
+
+    job_type = request.get("type")
+    if job_type not in JOB_TASKS:
+        raise Exception(
+            f"Invalid job type [{job_type}]. Valid values: {', '.join(JOB_TASKS)}"
+        )
+
+    args = request.get("args") or {}
+    if not isinstance(args, dict):
+        raise Exception("args must be a mapping of task arguments")
+
+    valid_args = get_task_args(job_type)
+    invalid_args = [name for name in args if name not in valid_args]
+    if invalid_args:
+        raise Exception(
+            f"Invalid args for [{job_type}]: {', '.join(invalid_args)}. Valid values: {', '.join(valid_args)}"
+        )
+
+    non_scalar_args = [
+        name
+        for name, value in args.items()
+        if not isinstance(value, (str, int, float, bool, type(None)))
+    ]
+    if non_scalar_args:
+        raise Exception(
+            f"Invalid args for [{job_type}]: {', '.join(non_scalar_args)}. Values must be strings, numbers or booleans"
+        )
+
+    argv = ["argo-bootstrap", JOB_TASKS[job_type]]
+    for name, value in args.items():
+        # Task arguments are strings: false means "not set", as an empty value does
+        if (value is None) or (value is False):
+            continue
+        argv += [f"--{name.replace('_', '-')}", "true" if value is True else str(value)]
+
+    # Jobs for the same parent repo run one at a time
+    repo_url = args.get("git_repo_url") or os.environ.get("GIT_REPO_URL") or ""
+
+    job_id = uuid.uuid4().hex[:12]
+    return {
+        "id": job_id,
+        "name": str(request.get("name") or repo_url),
+        "type": job_type,
+        "args": args,
+        "argv": argv,
+        "repo": argocd.normalize_repo_url(repo_url),
+        "status": STATUS_QUEUED,
+        "submitted_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "queue_seconds": None,
+        "run_seconds": None,
+        "exit_code": None,
+        "error": None,
+        "tasks": [],
+        "commands": None,
+        "limits": None,
+        "worker": None,
+        "log": os.path.join(logs_path, f"{job_id}.log"),
+    }
+
+
+def get_job_details(job: dict):
+    """
+    Get the details of a job that can be shown to clients: everything but the command
+    line and secret arguments.
+
+    Args:
+        job (dict): The job
+
+    Returns:
+        dict: Job details
+    """
+
+    details = {key: value for key, value in job.items() if key != "argv"}
+    details["args"] = {
+        name: (
+            tracing.REDACTED
+            if any(secret in name for secret in SECRET_ARG_NAMES)
+            else value
+        )
+        for name, value in job["args"].items()
+    }
+
+    return details
+
+
+## ------------------
+
+
+class JobQueue:
+    """
+    Thread-safe job queue. Jobs are run in the order they were submitted, except that jobs
+    for the same parent repo run one at a time: a job waits while another job for its repo
+    is running, and jobs for other repos can go ahead of it. Finished jobs are kept (up to
+    max_finished, oldest dropped first, with their logs) so that they can be looked up.
+
+    Args:
+        max_finished (int): Max number of finished jobs kept
+    """
+
+    def __init__(self, max_finished: int):
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._queued = []
+        self._finished = []
+        self._running_repos = set()
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def submit(self, job: dict):
+        with self._condition:
+            if self._closed:
+                raise Exception("The daemon is shutting down")
+
+            self._jobs[job["id"]] = job
+            self._queued.append(job)
+            self._condition.notify_all()
+
+    def take(self):
+        """
+        Wait for the next job that can run, and mark it as running.
+
+        Returns:
+            dict: The job, or None once the queue is closed
+        """
+
+        with self._condition:
+            while not self._closed:
+                for job in self._queued:
+                    if job["repo"] not in self._running_repos:
+                        self._queued.remove(job)
+                        self._running_repos.add(job["repo"])
+                        job["status"] = STATUS_RUNNING
+                        job["started_at"] = time.time()
+                        job["queue_seconds"] = round(
+                            job["started_at"] - job["submitted_at"], 3
+                        )
+                        return job
+
+                self._condition.wait()
+
+            return None
+
+    def finish(self, job: dict, result: dict):
+        """
+        Record the result of a job, and let the next job for its repo run.
+
+        Args:
+            job (dict): The job
+            result (dict): exit_code, error, tasks and commands, as returned by run_job
+        """
+
+        with self._condition:
+            job.update(result)
+            job["finished_at"] = time.time()
+            job["run_seconds"] = round(job["finished_at"] - job["started_at"], 3)
+            job["status"] = STATUS_SUCCEEDED if job["exit_code"] == 0 else STATUS_FAILED
+            self._running_repos.discard(job["repo"])
+
+            self._finished.append(job)
+            while len(self._finished) > self.max_finished:
+                dropped = self._finished.pop(0)
+                del self._jobs[dropped["id"]]
+                if os.path.exists(dropped["log"]):
+                    os.remove(dropped["log"])
+
+            self._condition.notify_all()
+
+    def get(self, job_id: str, wait_seconds=0):
+        """
+        Get a job by id.
+
+        Args:
+            job_id (str): Job id
+            wait_seconds (float, optional): Wait up to this long for the job to finish
+
+        Returns:
+            dict: The job, or None if there is no such job
+        """
+
+        deadline = time.monotonic() + wait_seconds
+        with self._condition:
+            job = self._jobs.get(job_id)
+            while (job is not None) and (job["finished_at"] is None):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            return job
+
+    def list(self):
+        with self._condition:
+            return list(self._jobs.values())
+
+    def stats(self):
+        with self._condition:
+            statuses = [job["status"] for job in self._jobs.values()]
+
+        return {
+            status: statuses.count(status)
+            for status in (
+                STATUS_QUEUED,
+                STATUS_RUNNING,
+                STATUS_SUCCEEDED,
+                STATUS_FAILED,
+            )
+        }
+
+    def close(self):
+        """
+        Stop handing out jobs. Jobs that are still queued are dropped.
+        """
+
+        with self._condition:
+            self._closed = True
+            for job in self._queued:
+                job["status"] = STATUS_FAILED
+                job["error"] = "Stopped before the job started"
+            self._queued.clear()
+            self._condition.notify_all()
+
+
+## ------------------
+
+# Environment variables can only be set per worker process while it's being started
+_spawn_lock = threading.Lock()
+
+
+class Worker:
+    """
+    Runs jobs from a JobQueue, one at a time, in a long-lived worker process (see
+    run_worker). Each worker process has its own data dir and global git config, so
+    that workers don't step on each other's working copies and credentials. If the
+    process dies, the job it was running fails, and a new process is started.
+
+    Args:
+        index (int): Worker number
+        jobs (JobQueue): Queue to take jobs from
+        workers_path (str, optional): Folder for the workers' data. Defaults to the daemon's.
+    """
+
+    def __init__(
+        self,
+        index: int,
+        jobs: JobQueue,
+        workers_path=os.path.join(DAEMON_PATH, WORKERS_DIR),
+    ):
+        self.index = index
+        self.jobs = jobs
+        self.path = os.path.join(workers_path, str(index))
+        self.process = None
+        self.conn = None
+        self.thread = threading.Thread(
+            target=self._run, name=f"daemon-worker-{index}", daemon=True
+        )
+
+    def start(self):
+        self._start_process()
+        self.thread.start()
+
+    def _start_process(self):
+        import multiprocessing
+
+        # Spawned rather than forked, since the daemon has threads. Not a daemonic process,
+        # since jobs can start process pools of their own (--jobs).
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=run_worker,
+            args=(child_conn, self.path),
+            name=f"argo-bootstrap-worker-{self.index}",
+        )
+
+        data_path = os.path.join(self.path, "data")
+        with _spawn_lock:
+            saved_data_path = os.environ.get("ARGOCD_BOOTSTRAP_DATA")
+            os.environ["ARGOCD_BOOTSTRAP_DATA"] = data_path
+            try:
+                self.process.start()
+            finally:
+                if saved_data_path is None:
+                    del os.environ["ARGOCD_BOOTSTRAP_DATA"]
+                else:
+                    os.environ["ARGOCD_BOOTSTRAP_DATA"] = saved_data_path
+        child_conn.close()
+
+        ready = self.conn.recv()
+        publish(
+            f"INFO: Worker {self.index} ready (pid {ready['pid']}, warmed up in {ready['seconds']}s)",
+            LOG_INFO,
+        )
+
+    def _run(self):
+        while True:
+            job = self.jobs.take()
+            if job is None:
+                return
+
+            job["worker"] = self.index
+            publish(
+                f"INFO: Job [{job['id']}] {job['type']} of [{job['name']}] started on worker {self.index}",
+                LOG_INFO,
+            )
+            try:
+                # Replace a worker process that died while it was idle
+                if not self.process.is_alive():
+                    self._start_process()
+
+                self.conn.send({"argv": job["argv"], "log": job["log"]})
+                result = self.conn.recv()
+            except (EOFError, OSError) as e:
+                self.process.join(5)
+                result = {
+                    "exit_code": -1,
+                    "error": f"Worker process died (exit code {self.process.exitcode}): {str(e)}",
+                }
+                self._start_process()
+            except Exception as e:
+                result = {"exit_code": -1, "error": str(e)}
+
+            self.jobs.finish(job, result)
+            publish(
+                f"INFO: Job [{job['id']}] {job['status']} in {job['run_seconds']}s",
+                LOG_INFO if job["status"] == STATUS_SUCCEEDED else LOG_WARN,
+            )
+
+    def stop(self, timeout=None):
+        """
+        Wait for the job being run to finish, then stop the worker process.
+
+        Args:
+            timeout (float, optional): Max time to wait for the job, in seconds
+        """
+
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+        try:
+            self.conn.send(None)
+        except (EOFError, OSError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+## ------------------
+
+
+def warm_up():
+    """
+    Load everything a job needs before the first job comes in: task modules and
+    compiled templates.
+    """
+
+    from argocd_app_bootstrap import get_namespace
+    from argocd_app_bootstrap.utils import templates
+
+    get_namespace()
+    for templates_path in (TEMPLATES_PATH, DEPLOY_TEMPLATES_PATH):
+        for name in sorted(os.listdir(templates_path)):
+            if name.endswith(".j2"):
+                templates.get_template(name, templates_path)
+
+
+def run_job(argv: list, log_path: str):
+    """
+    Run a job in this process, like the CLI would. Everything the job writes to stdout and
+    stderr (including the output of the commands it runs) goes to its log file.
+
+    Args:
+        argv (list): Command line (e.g. ["argo-bootstrap", "argo-run.deploy-app-bundle"])
+        log_path (str): Log file
+
+    Returns:
+        dict: exit_code, error (None if the job succeeded), tasks (name and seconds of each
+            task, in the order they finished), commands (number of commands run) and limits
+            (counters of the limited targets it called, see utils.limits)
+    """
+
+    from argocd_app_bootstrap.main import program
+
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = (os.dup(1), os.dup(2))
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.close(log_fd)
+
+    exit_code, error = 0, None
+    try:
+        # A dry run in an earlier job sends logs to stderr
+        log.configure()
+        tracing.enable()
+        program.run(argv)
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        if exit_code != 0:
+            error = f"Exited with code {exit_code}"
+    except BaseException as e:
+        exit_code, error = 1, str(e)
+        publish(f"Job failed. CAUSE: {error}", LOG_ERROR)
+    finally:
+        log.flush()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, saved_fd in zip((1, 2), saved_fds):
+            os.dup2(saved_fd, fd)
+            os.close(saved_fd)
+
+    return {
+        "exit_code": exit_code,
+        "error": error,
+        "tasks": [
+            {"name": span["name"], "seconds": round(span["dur"] / 1e6, 3)}
+            for span in tracing.get_spans(tracing.CATEGORY_TASK)
+        ],
+        "commands": len(tracing.get_spans(tracing.CATEGORY_COMMAND)),
+        "limits": limits.get_stats(),
+    }
+
+
+def run_worker(conn, worker_path: str):
+    """
+    Entry point of a worker process. Warms up, then runs the jobs sent over conn until it
+    gets None. ArgoCD sessions, the git config and compiled templates are kept from one
+    job to the next.
+
+    Args:
+        conn (Connection): Pipe to the daemon
+        worker_path (str): The worker's folder
+    """
+
+    start = time.perf_counter()
+    os.makedirs(DATA_PATH, exist_ok=True)
+
+    # git config --global writes to the worker's own file, which includes the user's
+    gitconfig_path = os.path.join(worker_path, "gitconfig")
+    user_gitconfig = os.environ.get(
+        "GIT_CONFIG_GLOBAL", os.path.join(os.path.expanduser("~"), ".gitconfig")
+    )
+    with open(gitconfig_path, "w") as stream:
+        stream.write(f"[include]\n\tpath = {user_gitconfig}\n")
+    os.environ["GIT_CONFIG_GLOBAL"] = gitconfig_path
+
+    warm_up()
+    conn.send({"pid": os.getpid(), "seconds": round(time.perf_counter() - start, 3)})
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+
+        conn.send(run_job(request["argv"], request["log"]))
+
+
+## ------------------
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the daemon:
+
+        POST /jobs                  Submit a job: {"type": ..., "args": {...}}. Returns the job.
+        GET  /jobs                  List jobs, oldest first
+        GET  /jobs/<id>[?wait=<s>]  Get a job, optionally waiting up to <s> seconds for it to finish
+        GET  /jobs/<id>/log         Get a job's log
+        GET  /health                Number of workers, and of jobs in each state
+
+    When the daemon listens on a TCP port, every request must send the daemon's token as
+    "Authorization: Bearer <token>".
+    """
+
+    server_version = "argocd-app-bootstrap"
+    protocol_version = "HTTP/1.1"
+
+    def send_body(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status: int, value):
+        self.send_body(
+            status, json.dumps(value, indent=2).encode("utf-8"), "application/json"
+        )
+
+    def send_error_json(self, status: int, message: str):
+        self.send_json(status, {"error": message})
+
+    def is_authorized(self):
+        """
+        Check the bearer token of the request, if the server requires one. Unauthorized
+        requests are answered with 401.
+
+        Returns:
+            bool: True if the request can go on
+        """
+
+        if self.server.token is None:
+            return True
+
+        scheme, _, token = (self.headers.get("Authorization") or "").partition(" ")
+        if (scheme.lower() == "bearer") and hmac.compare_digest(
+            token.strip().encode("utf-8"), self.server.token.encode("utf-8")
+        ):
+            return True
+
+        # The request body isn't read, so the connection can't be re-used
+        self.close_connection = True
+        self.send_error_json(401, "Missing or invalid bearer token")
+        return False
+
+    def do_GET(self):
+        if not self.is_authorized():
+            return
+
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        jobs = self.server.jobs
+
+        if parts == ["health"]:
+            self.send_json(
+                200, {"workers": len(self.server.workers), "jobs": jobs.stats()}
+            )
+
+        elif parts == ["jobs"]:
+            self.send_json(200, {"jobs": [get_job_details(job) for job in jobs.list()]})
+
+        elif (len(parts) in (2, 3)) and (parts[0] == "jobs"):
+            try:
+                wait_seconds = float(parse_qs(url.query).get("wait", ["0"])[0])
+            except ValueError:
+                return self.send_error_json(400, "wait must be a number of seconds")
+
+            job = jobs.get(
+                parts[1], wait_seconds=min(max(wait_seconds, 0), MAX_WAIT_SECONDS)
+            )
+            if job is None:
+                self.send_error_json(404, f"No job [{parts[1]}]")
+            elif len(parts) == 2:
+                self.send_json(200, get_job_details(job))
+            elif (parts[2] == "log") and os.path.exists(job["log"]):
+                with open(job["log"], "rb") as stream:
+                    self.send_body(200, stream.read(), "text/plain; charset=utf-8")
+            else:
+                self.send_error_json(404, f"No {parts[2]} for job [{parts[1]}]")
+
+        else:
+            self.send_error_json(404, f"Not found: {url.path}")
+
+    def do_POST(self):
+        if not self.is_authorized():
+            return
+
+        if urlparse(self.path).path.strip("/") != "jobs":
+            return self.send_error_json(404, f"Not found: {self.path}")
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_REQUEST_BYTES:
+            return self.send_error_json(413, "Job request too large")
+
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request, dict):
+                raise Exception("A job request must be a JSON object")
+            job = make_job(request)
+            self.server.jobs.submit(job)
+        except Exception as e:
+            return self.send_error_json(400, str(e))
+
+        publish(f"INFO: Job [{job['id']}] {job['type']} queued", LOG_INFO)
+        self.send_json(202, get_job_details(job))
+
+    def log_message(self, format: str, *args):
+        # Jobs are logged when they're queued, started and finished
+        pass
+
+
+class DaemonHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, jobs: JobQueue, workers: list, token=None):
+        self.jobs = jobs
+        self.workers = workers
+        self.token = token
+        super().__init__(address, RequestHandler)
+
+
+class UnixDaemonHTTPServer(DaemonHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        # HTTPServer.server_bind expects a (host, port) address
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("local", 0)
+
+
+## ------------------
+
+
+def bind_unix_socket(socket_path: str, jobs: JobQueue, workers: list):
+    """
+    Listen on a Unix socket that only the current user can connect to. A socket left
+    behind by a daemon that's no longer running is replaced.
+
+    Raises:
+        Exception: Raised if another daemon is listening on the socket.
+
+    Returns:
+        UnixDaemonHTTPServer: The server
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            raise Exception(f"A daemon is already listening on [{socket_path}]")
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(socket_path)
+        finally:
+            probe.close()
+
+    # Job requests carry credentials
+    umask = os.umask(0o077)
+    try:
+        return UnixDaemonHTTPServer(socket_path, jobs, workers)
+    finally:
+        os.umask(umask)
+
+
+def write_token(token_path: str):
+    """
+    Generate a token for the daemon's TCP port, and write it to a file that only the
+    current user can read.
+
+    Args:
+        token_path (str): Token file
+
+    Returns:
+        str: The token
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(token_path)), exist_ok=True)
+    if os.path.exists(token_path):
+        os.remove(token_path)
+
+    token = secrets.token_urlsafe(32)
+    fd = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as token_file:
+        token_file.write(token)
+
+    return token
+
+
+def serve(socket_path=None, port=None, num_workers=None):
+    """
+    Run the daemon until it's interrupted: start the worker processes, then accept jobs
+    over HTTP on a Unix socket, or on a TCP port on 127.0.0.1. Anyone on the host can
+    connect to the TCP port, and jobs run with the daemon's credentials, so requests on
+    it must send a bearer token, generated at startup and written to daemon.token in
+    DAEMON_PATH. On exit, running jobs are finished and queued jobs are dropped.
+
+    Args:
+        socket_path (str, optional): Unix socket. Defaults to daemon.sock in DAEMON_PATH.
+        port (int, optional): Listen on this TCP port on 127.0.0.1 instead of a Unix socket
+        num_workers (int, optional): Number of worker processes. Defaults to daemon.workers in config.yml.
+    """
+
+    settings = get_settings()
+    num_workers = int(num_workers or settings["workers"])
+    if num_workers < 1:
+        raise Exception(f"Invalid number of workers [{num_workers}]. Must be 1 or more")
+
+    jobs = JobQueue(settings["max-finished-jobs"])
+    workers = [Worker(index, jobs) for index in range(num_workers)]
+
+    token_path = os.path.join(DAEMON_PATH, TOKEN_FILE)
+    if port:
+        token = write_token(token_path)
+        server = DaemonHTTPServer(("127.0.0.1", int(port)), jobs, workers, token=token)
+        address = f"http://127.0.0.1:{server.server_port}"
+    else:
+        socket_path = socket_path or os.path.join(DAEMON_PATH, SOCKET_FILE)
+        server = bind_unix_socket(socket_path, jobs, workers)
+        address = f"unix://{socket_path}"
+
+    try:
+        # Jobs from earlier runs of the daemon can't be looked up anymore
+        jobs_path = os.path.join(DAEMON_PATH, JOBS_DIR)
+        if os.path.isdir(jobs_path):
+            for name in os.listdir(jobs_path):
+                os.remove(os.path.join(jobs_path, name))
+
+        for worker in workers:
+            worker.start()
+
+        publish(f"INFO: Listening on [{address}] with {num_workers} workers", LOG_INFO)
+        if port:
+            publish(
+                f"INFO: Requests must send the bearer token in [{token_path}]", LOG_INFO
+            )
+        server.serve_forever()
+
+    finally:
+        server.server_close()
+        if port:
+            if os.path.exists(token_path):
+                os.remove(token_path)
+        elif os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        publish("INFO: Shutting down. Waiting for running jobs", LOG_INFO)
+        jobs.close()
+        for worker in workers:
+            if worker.process is not None:
+                worker.stop()
@@ -0,0 +1,217 @@
+import os, fcntl, hashlib, shutil, time
+
+from contextlib import contextmanager
+from invoke import Context
+
+from argocd_app_bootstrap.definitions import APP_CONFIG, GIT_MIRRORS_PATH
+
+# common imports this module, so only refer to it by attribute at call time
+from argocd_app_bootstrap.utils import common
+
+## ------------------
+
+
+def mirror_path(git_url: str):
+    """
+    Get the location of the local mirror for a repo. Mirrors are keyed by a hash of the repo URL.
+
+    Args:
+        git_url (str): Repo URL
+
+    Returns:
+        str: Path of the bare mirror repo
+    """
+
+    key = hashlib.sha256(git_url.encode("utf-8")).hexdigest()[:32]
+    return os.path.join(GIT_MIRRORS_PATH, f"{key}.git")
+
+
+## ------------------
+
+
+@contextmanager
+def mirror_lock(path: str, blocking=True):
+    """
+    Hold an exclusive lock on a mirror. The lock is an flock on a file next to the mirror,
+    so it is shared with other processes using the same cache.
+
+    Args:
+        path (str): Path of the bare mirror repo
+        blocking (bool, optional): If false, yield False straight away when the lock is taken. Defaults to True.
+
+    Yields:
+        bool: True if the lock was acquired
+    """
+
+    os.makedirs(GIT_MIRRORS_PATH, exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, flags)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+## ------------------
+
+
+def update_mirror(ctxt: Context, git_url: str):
+    """
+    Create the mirror for a repo, or bring it up to date with an incremental fetch.
+    Must be called with the mirror lock held.
+
+    Args:
+        ctxt (Context): PyInvoke Context. http://docs.pyinvoke.org/en/stable/api/context.html
+        git_url (str): Repo URL
+
+    Returns:
+        int: Number of bytes the mirror grew by (i.e. objects fetched from the remote)
+    """
+
+    path = mirror_path(git_url)
+    objects_path = os.path.join(path, "objects")
+
+    if os.path.isdir(path):
+        size_before = get_size(objects_path)
+        result = common.run_command(
+            ctxt,
+            f"git --git-dir={path} fetch --prune --quiet origin",
+            raise_exception_on_err=False,
+        )
+        if result.exited == 0:
+            common.publish(f"INFO: Updated git mirror for [{git_url}]", common.LOG_INFO)
+            os.utime(path)
+            return max(get_size(objects_path) - size_before, 0)
+
+        common.publish(
+            f"WARN: Re-creating broken git mirror for [{git_url}]", common.LOG_WARN
+        )
+        shutil.rmtree(path, ignore_errors=True)
+
+    common.run_command(ctxt, f"git clone --mirror --quiet {git_url} {path}")
+    common.publish(f"INFO: Created git mirror for [{git_url}]", common.LOG_INFO)
+
+    return get_size(objects_path)
+
+
+## ------------------
+
+
+def clone(ctxt: Context, git_url: str, target_path: str):
+    """
+    Clone a repo through the local mirror cache. The mirror is fetched incrementally, then
+    the working copy is cloned from it locally (objects are hard-linked where possible, so
+    the working copy doesn't depend on the mirror once it's created). The working copy's
+    origin is pointed back at the real repo, so pushes go to the remote as before.
+
+    Args:
+        ctxt (Context): PyInvoke Context. http://docs.pyinvoke.org/en/stable/api/context.html
+        git_url (str): Repo URL
+        target_path (str): Where to create the working copy
+
+    Returns:
+        int: Number of bytes fetched from the remote into the mirror
+    """
+
+    path = mirror_path(git_url)
+    with mirror_lock(path):
+        fetched_bytes = update_mirror(ctxt, git_url)
+        common.run_command(ctxt, f"git clone --quiet {path} {target_path}")
+
+    common.run_command(
+        ctxt,
+        f"git -C {target_path} remote set-url origin {git_url}",
+    )
+
+    return fetched_bytes
+
+
+## ------------------
+
+
+def get_size(path: str):
+    """
+    Get the size of a folder (e.g. a mirror or a .git/objects folder) on disk, in bytes.
+
+    Args:
+        path (str): Folder path
+
+    Returns:
+        int: Size in bytes
+    """
+
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+
+    return size
+
+
+## ------------------
+
+
+def evict(max_size_mb=None, max_age_days=None):
+    """
+    Remove mirrors that haven't been used for max_age_days, then remove the least recently
+    used mirrors until the cache is below max_size_mb. Mirrors that are locked by another
+    run are left alone.
+
+    Args:
+        max_size_mb (int, optional): Max total size of the cache. Defaults to git-cache.max-size-mb in config.yml.
+        max_age_days (int, optional): Max age of an unused mirror. Defaults to git-cache.max-age-days in config.yml.
+
+    Returns:
+        list: Paths of the mirrors that were removed
+    """
+
+    cache_config = APP_CONFIG.get("git-cache", {})
+    max_size_mb = (
+        cache_config.get("max-size-mb") if max_size_mb is None else max_size_mb
+    )
+    max_age_days = (
+        cache_config.get("max-age-days") if max_age_days is None else max_age_days
+    )
+
+    if not os.path.isdir(GIT_MIRRORS_PATH):
+        return []
+
+    mirrors = []
+    for name in os.listdir(GIT_MIRRORS_PATH):
+        path = os.path.join(GIT_MIRRORS_PATH, name)
+        if name.endswith(".git") and os.path.isdir(path):
+            mirrors.append((os.stat(path).st_mtime, get_size(path), path))
+
+    # Least recently used first
+    mirrors.sort()
+    total_size = sum(size for _, size, _ in mirrors)
+    now = time.time()
+    evicted = []
+
+    for last_used, size, path in mirrors:
+        too_old = (max_age_days is not None) and (
+            now - last_used > max_age_days * 86400
+        )
+        too_big = (max_size_mb is not None) and (total_size > max_size_mb * 1024**2)
+        if not (too_old or too_big):
+            continue
+
+        with mirror_lock(path, blocking=False) as locked:
+            if not locked:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+
+        total_size -= size
+        evicted.append(path)
+        common.publish(f"INFO: Evicted git mirror [{path}]", common.LOG_INFO)
+
+    return evicted
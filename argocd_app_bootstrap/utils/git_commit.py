@@ -0,0 +1,261 @@
+import os, hashlib
+
+from invoke import Context
+
+from argocd_app_bootstrap.definitions import APP_CONFIG
+from argocd_app_bootstrap.utils import common
+from argocd_app_bootstrap.utils.common import LOG_ERROR, LOG_INFO, publish
+
+## ------------------
+
+# Commit backends
+BACKEND_PLUMBING = "plumbing"
+BACKEND_WORKTREE = "worktree"
+BACKENDS = (BACKEND_PLUMBING, BACKEND_WORKTREE)
+
+COMMIT_MESSAGE = "ArgoCD app configs"
+
+# Mode of new files. Files that are already in the repo keep theirs.
+FILE_MODE = "100644"
+
+# Where the fast-import stream is written, under the repo's .git folder
+FAST_IMPORT_FILE = "argocd-bootstrap.fast-import"
+
+## ------------------
+
+
+def get_backend():
+    """
+    Get the commit backend configured by git-commit-backend in config.yml, or the
+    GIT_COMMIT_BACKEND environment variable.
+
+    Raises:
+        Exception: Raised if the backend name is not valid.
+
+    Returns:
+        str: plumbing or worktree
+    """
+
+    backend_name = os.environ.get(
+        "GIT_COMMIT_BACKEND", APP_CONFIG.get("git-commit-backend", BACKEND_WORKTREE)
+    ).lower()
+
+    if backend_name not in BACKENDS:
+        msg = f"ERROR: Invalid git commit backend [{backend_name}]. Valid values: {', '.join(BACKENDS)}"
+        publish(msg, LOG_ERROR)
+        raise Exception(msg)
+
+    return backend_name
+
+
+## ------------------
+
+
+def get_blob_id(data: bytes):
+    """
+    Get the id git gives a file with the given contents, without running git.
+
+    Args:
+        data (bytes): File contents
+
+    Returns:
+        str: Blob id (SHA-1, hex)
+    """
+
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def quote_path(path: str):
+    """
+    Quote a path for a fast-import stream, if it needs it.
+
+    Args:
+        path (str): Path relative to the repo root
+
+    Returns:
+        str: The path, C-style quoted if it starts with a quote or has a line break
+    """
+
+    if not (path.startswith('"') or ("\n" in path)):
+        return path
+
+    escaped = path.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'"{escaped}"'
+
+
+## ------------------
+
+
+def read_head(ctxt: Context, repo_path: str):
+    """
+    Get the branch that HEAD points to, the author and committer identities git would use,
+    the HEAD commit and every file in it, in one command. Only the object database is read,
+    not the working tree or the index.
+
+    Args:
+        ctxt (Context): PyInvoke Context. http://docs.pyinvoke.org/en/stable/api/context.html
+        repo_path (str): Path of the repo's working copy
+
+    Raises:
+        Exception: Raised if HEAD is not on a branch, or if git has no identity to commit with.
+
+    Returns:
+        dict: ref (e.g. refs/heads/main), author, committer, commit, and files (path -> (mode, blob id)). commit is empty and files is empty for a repo without commits.
+    """
+
+    result = common.run_command(
+        ctxt,
+        f"cd {repo_path} && git symbolic-ref -q HEAD"
+        " && git var GIT_AUTHOR_IDENT && git var GIT_COMMITTER_IDENT"
+        " && (git rev-parse -q --verify HEAD || echo)"
+        " && (git ls-tree -r -z --full-tree HEAD 2>/dev/null || true)",
+        hide="out",
+    )
+    ref, author, committer, commit, tree = result.stdout.split("\n", 4)
+
+    files = {}
+    for entry in tree.split("\0"):
+        if entry:
+            info, path = entry.split("\t", 1)
+            mode, object_type, object_id = info.split(" ")
+            if object_type == "blob":
+                files[path] = (mode, object_id)
+
+    return {
+        "ref": ref,
+        "author": author,
+        "committer": committer,
+        "commit": commit,
+        "files": files,
+    }
+
+
+def get_changes(head_files: dict, staged_files: list):
+    """
+    Get the staged files that are new or differ from the HEAD commit.
+
+    Args:
+        head_files (dict): Files in the HEAD commit (path -> (mode, blob id))
+        staged_files (list): (path relative to the repo root, contents as bytes)
+
+    Returns:
+        list: (path, mode, contents as bytes) of each changed file
+    """
+
+    changes = []
+    for path, data in staged_files:
+        mode, blob_id = head_files.get(path, (FILE_MODE, None))
+        if get_blob_id(data) != blob_id:
+            changes.append((path, mode, data))
+
+    return changes
+
+
+def write_fast_import_stream(stream_path: str, head: dict, changes: list, message: str):
+    """
+    Write a git fast-import stream that commits the changed files on top of the HEAD
+    commit, on HEAD's branch. Files that aren't in changes are kept as they are in HEAD.
+
+    Args:
+        stream_path (str): File to write the stream to
+        head (dict): HEAD details, as returned by read_head
+        changes (list): (path, mode, contents as bytes) of each changed file
+        message (str): Commit message
+    """
+
+    message = f"{message}\n".encode("utf-8")
+    with open(stream_path, "wb") as stream:
+        stream.write(
+            f"commit {head['ref']}\n"
+            f"author {head['author']}\n"
+            f"committer {head['committer']}\n"
+            f"data {len(message)}\n".encode("utf-8")
+        )
+        stream.write(message)
+        if head["commit"]:
+            stream.write(f"from {head['commit']}\n".encode("utf-8"))
+        for path, mode, data in changes:
+            stream.write(
+                f"M {mode} inline {quote_path(path)}\ndata {len(data)}\n".encode(
+                    "utf-8"
+                )
+            )
+            stream.write(data)
+            stream.write(b"\n")
+        stream.write(b"\ndone\n")
+
+
+## ------------------
+
+
+def commit_staged_files(
+    ctxt: Context, repo_path: str, staged_files: list, message=COMMIT_MESSAGE
+):
+    """
+    Commit staged files straight into the repo's object database with git fast-import,
+    and move HEAD's branch to the new commit. The working tree is never scanned: changes
+    are found by comparing the staged files with the HEAD commit's file list. The index
+    is not updated.
+
+    Args:
+        ctxt (Context): PyInvoke Context. http://docs.pyinvoke.org/en/stable/api/context.html
+        repo_path (str): Path of the repo's working copy
+        staged_files (list): (path relative to the repo root, contents as bytes)
+        message (str, optional): Commit message. Defaults to COMMIT_MESSAGE.
+
+    Returns:
+        int: Number of files committed. Nothing is committed if it's 0.
+    """
+
+    head = read_head(ctxt, repo_path)
+    changes = get_changes(head["files"], staged_files)
+    if not changes:
+        return 0
+
+    stream_path = os.path.join(repo_path, ".git", FAST_IMPORT_FILE)
+    write_fast_import_stream(stream_path, head, changes, message)
+    try:
+        common.run_command(
+            ctxt, f"cd {repo_path} && git fast-import --quiet --done < {stream_path}"
+        )
+    finally:
+        os.remove(stream_path)
+
+    publish(
+        f"INFO: Committed {len(changes)} files to [{head['ref']}] with git fast-import",
+        LOG_INFO,
+    )
+
+    return len(changes)
+
+
+## ------------------
+
+
+def commit_working_tree(ctxt: Context, repo_path: str, message=COMMIT_MESSAGE):
+    """
+    Commit every change in the repo's working tree with git add and git commit.
+
+    Args:
+        ctxt (Context): PyInvoke Context. http://docs.pyinvoke.org/en/stable/api/context.html
+        repo_path (str): Path of the repo's working copy
+        message (str, optional): Commit message. Defaults to COMMIT_MESSAGE.
+
+    Returns:
+        bool: False if the working tree was clean, so nothing was committed
+    """
+
+    result = common.run_command(
+        ctxt, f"cd {repo_path} && git status --porcelain", hide="out"
+    )
+    if result.stdout.strip() == "":
+        return False
+
+    common.run_command(ctxt, f"cd {repo_path} && git add .")
+    common.run_command(
+        ctxt,
+        f"cd {repo_path} && git commit -m '{message}'",
+        raise_exception_on_err=False,
+    )
+
+    return True
@@ -0,0 +1,336 @@
+import random, threading, time
+
+from argocd_app_bootstrap.definitions import APP_CONFIG
+
+## ------------------
+
+# Targets (limits.<target> in config.yml). Commands are limited by their first word.
+TARGET_ARGOCD = "argocd"
+TARGET_KUBECTL = "kubectl"
+
+# Backoff before retrying an overloaded call: a random wait of up to base * 2^attempt
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30
+
+## ------------------
+
+# Limiters of the process, by target. Shared by every thread, so that concurrent steps
+# and sync workers don't each get a full share of the target.
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+## ------------------
+
+
+class Limiter:
+    """
+    Limits on the calls made to one target (e.g. the ArgoCD API server): a token bucket
+    that caps how many calls start per second, and a concurrency limit that adapts to
+    how the target copes (AIMD). The concurrency limit starts at max_concurrency, is
+    halved when a call finds the target overloaded, and grows back by one for each
+    round of calls that succeed. Overloaded calls are retried after a jittered backoff.
+
+    Args:
+        target (str): Target name
+        rate (float): Calls started per second. 0 for no limit.
+        burst (int): Calls that can start at once after a quiet spell
+        max_concurrency (int): Max calls running at once
+        min_concurrency (int, optional): Concurrency limit never goes below this. Defaults to 1.
+        retries (int, optional): Times an overloaded call is retried. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        target: str,
+        rate: float,
+        burst: int,
+        max_concurrency: int,
+        min_concurrency=1,
+        retries=0,
+    ):
+        self.target = target
+        self.rate = float(rate)
+        self.burst = max(int(burst), 1)
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.min_concurrency = min(max(int(min_concurrency), 1), self.max_concurrency)
+        self.retries = max(int(retries), 0)
+
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._decreased_at = 0.0
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Reset the counters. The concurrency limit that was learned is kept.
+        """
+
+        with self._condition:
+            self._stats = {
+                "calls": 0,
+                "failed": 0,
+                "overloaded": 0,
+                "retries": 0,
+                "decreases": 0,
+                "rate_wait_seconds": 0.0,
+                "concurrency_wait_seconds": 0.0,
+                "peak_in_flight": 0,
+                "min_limit": int(self.limit),
+            }
+
+    def get_stats(self):
+        """
+        Get the counters since they were last reset.
+
+        Returns:
+            dict: calls (including retries), failed, overloaded, retries, decreases (of the
+                concurrency limit), rate_wait_seconds and concurrency_wait_seconds (time calls
+                waited to start), peak_in_flight, min_limit, and limit (current concurrency limit)
+        """
+
+        with self._condition:
+            stats = dict(self._stats, limit=int(self.limit))
+        for key in ("rate_wait_seconds", "concurrency_wait_seconds"):
+            stats[key] = round(stats[key], 3)
+        return stats
+
+    def _take_token(self):
+        """
+        Take a token from the bucket, waiting for one if it's empty.
+        """
+
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._refilled_at) * self.rate
+                )
+                self._refilled_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+    def acquire(self):
+        """
+        Wait until a call can start: a token is taken, and fewer calls than the
+        concurrency limit are running.
+
+        Returns:
+            float: When the call started (time.monotonic), to pass to release
+        """
+
+        start = time.monotonic()
+        self._take_token()
+        token_at = time.monotonic()
+
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+            started_at = time.monotonic()
+            self._stats["calls"] += 1
+            self._stats["rate_wait_seconds"] += token_at - start
+            self._stats["concurrency_wait_seconds"] += started_at - token_at
+            self._stats["peak_in_flight"] = max(
+                self._stats["peak_in_flight"], self.in_flight
+            )
+
+        return started_at
+
+    def release(self, started_at: float, overloaded: bool, failed: bool):
+        """
+        Record the end of a call, and adapt the concurrency limit.
+
+        Args:
+            started_at (float): As returned by acquire
+            overloaded (bool): The target was overloaded (e.g. 429, 503, timeout)
+            failed (bool): The call failed
+        """
+
+        with self._condition:
+            self.in_flight -= 1
+            if failed or overloaded:
+                self._stats["failed"] += 1
+
+            if overloaded:
+                self._stats["overloaded"] += 1
+                # Calls that started before the last decrease ran under the old limit:
+                # they don't halve it again
+                if started_at >= self._decreased_at:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self._decreased_at = time.monotonic()
+                    self._stats["decreases"] += 1
+                    self._stats["min_limit"] = min(
+                        self._stats["min_limit"], int(self.limit)
+                    )
+            elif not failed:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+            self._condition.notify_all()
+
+    def get_backoff(self, attempt: int):
+        """
+        Get how long to wait before a retry ("full jitter", so that calls that were
+        overloaded together don't retry together).
+
+        Args:
+            attempt (int): Retries made so far
+
+        Returns:
+            float: Seconds to wait
+        """
+
+        return random.uniform(
+            0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt)
+        )
+
+    def call(self, func, is_overloaded, retry=True):
+        """
+        Call func within the limits, and retry it while the target is overloaded, up to
+        retries times.
+
+        Args:
+            func (callable): The call. Takes no arguments.
+            is_overloaded (callable): Called with the result of func and the exception it raised (one of them is None). Returns whether the target was overloaded.
+            retry (bool, optional): If false, never retry (e.g. the call isn't idempotent). Overloads still lower the concurrency limit. Defaults to True.
+
+        Returns:
+            Any: What func returned on the last attempt. What it raised on the last attempt is raised.
+        """
+
+        attempt = 0
+        while True:
+            started_at = self.acquire()
+            result, error = None, None
+            try:
+                result = func()
+            except Exception as e:
+                error = e
+
+            overloaded = bool(is_overloaded(result, error))
+            self.release(started_at, overloaded, error is not None)
+
+            if overloaded and retry and (attempt < self.retries):
+                with self._condition:
+                    self._stats["retries"] += 1
+                time.sleep(self.get_backoff(attempt))
+                attempt += 1
+                continue
+
+            if error is not None:
+                raise error
+            return result
+
+
+## ------------------
+
+
+def get_limiter(target: str):
+    """
+    Get the limiter of a target, as configured in limits.<target> in config.yml (rate,
+    burst, min-concurrency, max-concurrency, retries).
+
+    Args:
+        target (str): Target name (e.g. TARGET_ARGOCD)
+
+    Returns:
+        Limiter: The target's limiter, or None if the target isn't limited
+    """
+
+    with _limiters_lock:
+        if target not in _limiters:
+            settings = APP_CONFIG.get("limits", {}).get(target)
+            _limiters[target] = (
+                None
+                if not settings
+                else Limiter(
+                    target,
+                    rate=settings.get("rate", 0),
+                    burst=settings.get("burst", 1),
+                    max_concurrency=settings.get("max-concurrency", 8),
+                    min_concurrency=settings.get("min-concurrency", 1),
+                    retries=settings.get("retries", 0),
+                )
+            )
+
+        return _limiters[target]
+
+
+def call(target: str, func, is_overloaded, retry=True):
+    """
+    Call func within the limits of a target (see Limiter.call). Calls to targets that
+    aren't limited are made right away, and not retried.
+
+    Args:
+        target (str): Target name
+        func (callable): The call. Takes no arguments.
+        is_overloaded (callable): Called with the result of func and the exception it raised. Returns whether the target was overloaded.
+        retry (bool, optional): If false, never retry the call. Defaults to True.
+
+    Returns:
+        Any: What func returned
+    """
+
+    limiter = get_limiter(target)
+    if limiter is None:
+        return func()
+
+    return limiter.call(func, is_overloaded, retry=retry)
+
+
+## ------------------
+
+
+def get_stats():
+    """
+    Get the counters of the targets that were called since they were last reset.
+
+    Returns:
+        dict: Target -> counters (see Limiter.get_stats)
+    """
+
+    with _limiters_lock:
+        limiters = [limiter for limiter in _limiters.values() if limiter is not None]
+
+    stats = {limiter.target: limiter.get_stats() for limiter in limiters}
+    return {target: counters for target, counters in stats.items() if counters["calls"]}
+
+
+def reset_stats():
+    """
+    Reset the counters of every target (e.g. between daemon jobs). Learned concurrency
+    limits are kept.
+    """
+
+    with _limiters_lock:
+        limiters = [limiter for limiter in _limiters.values() if limiter is not None]
+
+    for limiter in limiters:
+        limiter.reset_stats()
+
+
+def publish_stats():
+    """
+    Publish the counters of every target that was called, one line per target.
+    """
+
+    # Imported here, since common limits the commands it runs
+    from argocd_app_bootstrap.utils.common import LOG_INFO, publish
+
+    for target, counters in get_stats().items():
+        publish(
+            f"INFO: [{target}] {counters['calls']} calls, "
+            f"{counters['retries']} retries, {counters['overloaded']} overloaded, "
+            f"concurrency {counters['limit']} (min {counters['min_limit']}, peak in flight {counters['peak_in_flight']}), "
+            f"waited {counters['rate_wait_seconds']}s for rate and {counters['concurrency_wait_seconds']}s for concurrency",
+            LOG_INFO,
+        )
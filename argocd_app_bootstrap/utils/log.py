@@ -0,0 +1,277 @@
+import os, sys, time, queue, atexit, datetime, threading
+
+from argocd_app_bootstrap.definitions import APP_CONFIG
+
+## ------------------
+
+# Log formats
+FORMAT_CONSOLE = "console"
+FORMAT_JSON = "json"
+FORMATS = (FORMAT_CONSOLE, FORMAT_JSON)
+
+# Log types (see common.LOG_*), by severity
+LEVELS = {"INFO": 20, "WARN": 30, "ERROR": 40}
+
+# Logger method for each log type
+METHODS = {"INFO": "info", "WARN": "warning", "ERROR": "error"}
+
+CONSOLE_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M.%S"
+
+## ------------------
+
+
+def add_log_level(logger, method_name: str, event_dict: dict):
+    event_dict["level"] = method_name
+    return event_dict
+
+
+def add_log_time(logger, method_name: str, event_dict: dict):
+    event_dict["_time"] = time.time()
+    return event_dict
+
+
+class LogTimeStamper:
+    """
+    structlog processor that adds a timestamp: the time the event was logged (see
+    add_log_time), or else the current time. "iso" gives UTC ISO 8601 timestamps. Any
+    other format is a strftime format for local time with a resolution of one second,
+    which is only formatted again when the second changes.
+
+    Args:
+        fmt (str): "iso" or a strftime format
+    """
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self._cache = (None, None)
+
+    def __call__(self, logger, method_name: str, event_dict: dict):
+        log_time = event_dict.pop("_time", None) or time.time()
+
+        if self.fmt == "iso":
+            event_dict["timestamp"] = (
+                datetime.datetime.utcfromtimestamp(log_time).isoformat() + "Z"
+            )
+            return event_dict
+
+        second, timestamp = self._cache
+        if int(log_time) != second:
+            second = int(log_time)
+            timestamp = time.strftime(self.fmt, time.localtime(second))
+            self._cache = (second, timestamp)
+
+        event_dict["timestamp"] = timestamp
+        return event_dict
+
+
+## ------------------
+
+
+class LogWriter:
+    """
+    structlog logger that renders and writes events from a background thread. Callers
+    only queue the event, so they never wait on rendering or on the stream (e.g. a full
+    pipe). Events are written in the order they were logged.
+
+    Args:
+        stream (TextIO): Stream to write to
+        processors (list): structlog processors that turn an event into a log line
+    """
+
+    def __init__(self, stream, processors: list):
+        self.stream = stream
+        self.processors = processors
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def msg(self, **event_dict):
+        self._queue.put(event_dict)
+
+    log = debug = info = warn = warning = msg
+    err = error = critical = exception = failure = fatal = msg
+
+    def render(self, event_dict: dict):
+        try:
+            for processor in self.processors:
+                event_dict = processor(self, "msg", event_dict)
+            return event_dict
+        except Exception as e:
+            return f"{event_dict!r} (could not render log line: {e})"
+
+    def _run(self):
+        while True:
+            event_dict = self._queue.get()
+            if event_dict is None:
+                break
+
+            if isinstance(event_dict, threading.Event):
+                self.stream.flush()
+                event_dict.set()
+                continue
+
+            self.stream.write(self.render(event_dict) + "\n")
+            if self._queue.empty():
+                self.stream.flush()
+
+        self.stream.flush()
+
+    def flush(self):
+        """
+        Wait until every event queued so far is written.
+        """
+
+        if self._thread.is_alive():
+            written = threading.Event()
+            self._queue.put(written)
+            written.wait()
+
+    def close(self):
+        """
+        Write whatever is left in the queue, then stop the thread.
+        """
+
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+## ------------------
+
+_logger = None
+_writer = None
+_min_level = LEVELS["INFO"]
+_lock = threading.Lock()
+
+
+def configure(level=None, log_format=None, background=None, stream=None):
+    """
+    Set up the logger used by publish. Settings that aren't passed come from the
+    LOG_LEVEL, LOG_FORMAT and LOG_BACKGROUND environment variables, then from logging in
+    config.yml. The logger is built once here, rather than on every publish call.
+
+    Args:
+        level (str, optional): Lowest log type that is written (INFO, WARN or ERROR)
+        log_format (str, optional): console (human-readable) or json (one object per line)
+        background (bool, optional): Render and write log lines from a background thread
+        stream (TextIO, optional): Stream to write to. Defaults to stdout.
+
+    Raises:
+        Exception: Raised if the level or format is not valid.
+    """
+
+    global _logger, _writer, _min_level
+
+    settings = APP_CONFIG.get("logging", {})
+    level = (
+        level or os.environ.get("LOG_LEVEL") or settings.get("level", "INFO")
+    ).upper()
+    log_format = (
+        log_format
+        or os.environ.get("LOG_FORMAT")
+        or settings.get("format", FORMAT_CONSOLE)
+    ).lower()
+    if background is None:
+        background = os.environ.get("LOG_BACKGROUND", settings.get("background", False))
+    background = str(background).lower() in ("true", "1", "yes")
+
+    if level not in LEVELS:
+        raise Exception(
+            f"Invalid log level [{level}]. Valid values: {', '.join(LEVELS)}"
+        )
+    if log_format not in FORMATS:
+        raise Exception(
+            f"Invalid log format [{log_format}]. Valid values: {', '.join(FORMATS)}"
+        )
+
+    # structlog is only imported the first time something is published
+    from structlog import BoundLogger, PrintLogger, wrap_logger
+    from structlog.dev import ConsoleRenderer
+    from structlog.processors import JSONRenderer
+
+    stream = stream or sys.stdout
+    if log_format == FORMAT_JSON:
+        processors = [add_log_level]
+        renderers = [LogTimeStamper("iso"), JSONRenderer()]
+    else:
+        # Only color log lines that go to a terminal
+        processors = []
+        renderers = [
+            LogTimeStamper(CONSOLE_TIMESTAMP_FORMAT),
+            ConsoleRenderer(colors=stream.isatty()),
+        ]
+
+    with _lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+
+        if background:
+            # Only the log time is taken by the caller, the rest is done by the writer
+            _writer = LogWriter(stream, renderers)
+            logger = _writer
+            processors = processors + [add_log_time]
+        else:
+            logger = PrintLogger(stream)
+            processors = processors + renderers
+
+        _logger = wrap_logger(
+            logger,
+            processors=processors,
+            wrapper_class=BoundLogger,
+            app="argocd_app_bootstrap",
+        ).bind()
+        _min_level = LEVELS[level]
+
+
+## ------------------
+
+
+def get_logger():
+    """
+    Get the logger used by publish, setting it up on first use.
+
+    Returns:
+        BoundLogger: The logger
+    """
+
+    if _logger is None:
+        configure()
+
+    return _logger
+
+
+def is_enabled(log_type: str):
+    """
+    Check if a log type is written at the configured level.
+
+    Args:
+        log_type (str): The log type (INFO, WARN or ERROR)
+
+    Returns:
+        bool: True if it is written. Always false for unknown log types.
+    """
+
+    if _logger is None:
+        configure()
+
+    return LEVELS.get(log_type, 0) >= _min_level
+
+
+## ------------------
+
+
+def flush():
+    """
+    Wait until every queued log line is written, if log lines are written from a
+    background thread. Also called on exit.
+    """
+
+    writer = _writer
+    if writer is not None:
+        writer.flush()
+
+
+atexit.register(flush)
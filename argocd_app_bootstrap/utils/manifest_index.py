@@ -0,0 +1,199 @@
+import os, glob, hashlib, json
+
+from argocd_app_bootstrap.definitions import (
+    APPS_CHILDREN_PATH,
+    ARGOCD_PATH,
+    MANIFEST_INDEX_PATH,
+    PROJECTS_PATH,
+    yaml,
+)
+
+## ------------------
+
+INDEX_VERSION = 1
+
+# What a generated resource is for
+ROLE_PROJECT = "project"
+ROLE_ROOT_APP = "root_app"
+ROLE_PARENT_APP = "parent_app"
+ROLE_CHILD_APP = "child_app"
+ROLE_APP_SET = "app_set"
+ROLE_NAMESPACES_APP = "namespaces_app"
+ROLE_NAMESPACES = "namespaces"
+
+## ------------------
+
+
+def make_resource(kind: str, name: str, namespace: str, environment: str, role: str):
+    """
+    Describe a generated resource, for the manifest index.
+
+    Args:
+        kind (str): Kubernetes kind (e.g. Application)
+        name (str): metadata.name
+        namespace (str): metadata.namespace
+        environment (str): Target environment (e.g. dev, qa, prod)
+        role (str): What the resource is for (ROLE_*)
+
+    Returns:
+        dict: The resource
+    """
+
+    return {
+        "kind": kind,
+        "name": name,
+        "namespace": namespace,
+        "environment": environment,
+        "role": role,
+    }
+
+
+## ------------------
+
+
+def build_index(tree):
+    """
+    Build the manifest index of the resources staged in a tree. Every resource is
+    recorded with its path (relative to the repo) and the SHA-256 of its contents, and
+    is also listed under its environment and role for direct lookups.
+
+    Args:
+        tree (StagingTree): Staging tree of the parent repo
+
+    Returns:
+        dict: The manifest index
+    """
+
+    resources = {}
+    environments = {}
+    for path, data, resource in tree.resource_items():
+        resources[path] = dict(resource, sha256=hashlib.sha256(data).hexdigest())
+        environments.setdefault(resource["environment"], {}).setdefault(
+            resource["role"], []
+        ).append(path)
+
+    return {
+        "version": INDEX_VERSION,
+        "resources": resources,
+        "environments": environments,
+    }
+
+
+## ------------------
+
+
+def dumps(index: dict):
+    """
+    Serialize a manifest index. Output is stable (sorted keys), so that unchanged
+    resources give an unchanged file.
+
+    Args:
+        index (dict): The manifest index
+
+    Returns:
+        str: JSON document
+    """
+
+    return json.dumps(index, indent=1, sort_keys=True, separators=(",", ":")) + "\n"
+
+
+## ------------------
+
+
+def load_index(index_path: str = MANIFEST_INDEX_PATH):
+    """
+    Load a manifest index from the parent repo.
+
+    Args:
+        index_path (str, optional): Index file. Defaults to MANIFEST_INDEX_PATH.
+
+    Returns:
+        dict: The manifest index, or None if there is none, or it has another version.
+    """
+
+    try:
+        with open(index_path, "r") as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        return None
+
+    if index.get("version") != INDEX_VERSION:
+        return None
+
+    return index
+
+
+## ------------------
+
+
+def scan_index(environment: str):
+    """
+    Build a partial manifest index for an environment by reading the generated YAML files,
+    for parent repos that were set up before the index existed. Only the project, root
+    app and child apps (or the ApplicationSets that generate them) are picked up.
+
+    Args:
+        environment (str): Target environment (e.g. dev, qa, prod)
+
+    Returns:
+        dict: The manifest index
+    """
+
+    paths = {
+        ROLE_PROJECT: [os.path.join(PROJECTS_PATH, f"project-{environment}.yml")],
+        ROLE_ROOT_APP: [os.path.join(ARGOCD_PATH, f"root-app-{environment}.yml")],
+        ROLE_CHILD_APP: sorted(
+            glob.glob(os.path.join(APPS_CHILDREN_PATH, environment, "*.yml"))
+        ),
+    }
+
+    resources = {}
+    roles = {}
+    repo_path = os.path.dirname(ARGOCD_PATH)
+    for role, role_paths in paths.items():
+        for path in role_paths:
+            if not os.path.isfile(path):
+                continue
+
+            with open(path, "r") as stream:
+                manifest = yaml.load(stream)
+
+            file_role = role
+            if (role == ROLE_CHILD_APP) and (manifest["kind"] == "ApplicationSet"):
+                file_role = ROLE_APP_SET
+
+            relative_path = os.path.relpath(path, repo_path).replace(os.sep, "/")
+            resources[relative_path] = make_resource(
+                manifest["kind"],
+                manifest["metadata"]["name"],
+                manifest["metadata"].get("namespace"),
+                environment,
+                file_role,
+            )
+            roles.setdefault(file_role, []).append(relative_path)
+
+    return {
+        "version": INDEX_VERSION,
+        "resources": resources,
+        "environments": {environment: roles},
+    }
+
+
+## ------------------
+
+
+def lookup(index: dict, environment: str, role: str):
+    """
+    Get the resources of a given role in an environment.
+
+    Args:
+        index (dict): The manifest index
+        environment (str): Target environment (e.g. dev, qa, prod)
+        role (str): What the resource is for (ROLE_*)
+
+    Returns:
+        list: Resources, each with its path relative to the repo
+    """
+
+    paths = index["environments"].get(environment, {}).get(role, [])
+    return [dict(index["resources"][path], path=path) for path in paths]
@@ -0,0 +1,292 @@
+import sys
+
+from argocd_app_bootstrap.definitions import ARGO_PROJ_YAML
+from argocd_app_bootstrap.utils import common
+
+## ------------------
+
+# Keys allowed in each section of argo_proj.yml, and whether they are required
+SCHEMA = {
+    "": {"argocd": True},
+    "argocd": {"project": True, "parent_app": True, "child_apps": True},
+    "argocd.project": {"name": True, "description": True},
+    "argocd.parent_app": {"name": True, "repo_url": True, "version": True},
+    "argocd.child_apps": {"destination_cluster": True, "app": True},
+    "argocd.child_apps.app": {
+        "name": True,
+        "repo_url": True,
+        "namespace": True,
+        "manifest_path": True,
+        "deploy_plugin": False,
+    },
+}
+
+## ------------------
+
+
+class Model:
+    """
+    Base class for the argo_proj.yml model. Models are slotted and read-only, so one
+    instance is shared by every task (and every copy of the invoke config) instead of being
+    copied. Fields can also be read like dict keys (e.g. app["name"]), so a model can be
+    handed to templates and AppView like the parsed YAML could. Unset fields are None.
+
+    Args:
+        *args: Field values, in __slots__ order
+        **kwargs: Field values, by name
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        values = dict(zip(self.__slots__, args), **kwargs)
+        for field in self.__slots__:
+            object.__setattr__(self, field, values.get(field))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return (key in self.__slots__) and (getattr(self, key) is not None)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __eq__(self, other):
+        return (type(self) is type(other)) and all(
+            getattr(self, field) == getattr(other, field) for field in self.__slots__
+        )
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, field) for field in self.__slots__))
+
+    def __repr__(self):
+        fields = ", ".join(
+            f"{field}={getattr(self, field)!r}" for field in self.__slots__
+        )
+        return f"{type(self).__name__}({fields})"
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, field) for field in self.__slots__)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class Project(Model):
+    __slots__ = ("name", "description")
+
+
+class ParentApp(Model):
+    __slots__ = ("name", "repo_url", "version")
+
+
+class ChildApp(Model):
+    __slots__ = ("name", "repo_url", "namespace", "manifest_path", "deploy_plugin")
+
+
+class ArgoProj(Model):
+    """
+    The argocd section of argo_proj.yml. The child_apps section is flattened into
+    destination_cluster and child_apps (a tuple of ChildApp).
+    """
+
+    __slots__ = ("project", "parent_app", "destination_cluster", "child_apps")
+
+    def __repr__(self):
+        # invoke formats the whole config for its debug log every time it's merged
+        return (
+            f"ArgoProj(project={self.project!r}, parent_app={self.parent_app!r}, "
+            f"destination_cluster={self.destination_cluster!r}, "
+            f"child_apps=<{len(self.child_apps)} apps>)"
+        )
+
+    def get_environment(self, environment: str):
+        return Environment(self, environment)
+
+
+## ------------------
+
+
+class Environment(Model):
+    """
+    The app bundle in one environment. Names that depend on the environment are worked out
+    when they're read, so the same ArgoProj is shared by every environment.
+    """
+
+    __slots__ = ("argo_proj", "name")
+
+    @property
+    def project_name(self):
+        return common.get_project_name(self.argo_proj.project.name, self.name)
+
+    @property
+    def destination_cluster(self):
+        return self.argo_proj.destination_cluster
+
+    @property
+    def child_apps(self):
+        return [
+            common.AppView(child_app, self.name)
+            for child_app in self.argo_proj.child_apps
+        ]
+
+    @property
+    def namespaces(self):
+        return [
+            common.get_namespace_name(child_app.namespace, self.name)
+            for child_app in self.argo_proj.child_apps
+        ]
+
+
+## ------------------
+
+
+def check_section(values, section: str, path: str, problems: list):
+    """
+    Check one section of argo_proj.yml against SCHEMA: it must be a mapping, with every
+    required key, and no unknown keys. Problems are added to the problems list.
+
+    Args:
+        values (dict): The section
+        section (str): The section's key in SCHEMA
+        path (str): Where the section is, for error messages (e.g. argocd.child_apps.app[3])
+        problems (list): Problems found so far
+
+    Returns:
+        bool: True if the section is a mapping (so that its values can be checked)
+    """
+
+    if not isinstance(values, dict):
+        problems.append(f"{path or 'the file'} must be a mapping")
+        return False
+
+    fields = SCHEMA[section]
+    prefix = f"{path}." if path else ""
+    for key in values:
+        if key not in fields:
+            # Imported here, since it's only needed when there's a typo
+            import difflib
+
+            hint = difflib.get_close_matches(str(key), list(fields), n=1)
+            problems.append(
+                f"{prefix}{key} is not a valid key"
+                + (f" (did you mean {hint[0]}?)" if hint else "")
+            )
+
+    for key, required in fields.items():
+        if required and (values.get(key) is None):
+            problems.append(f"{prefix}{key} is missing")
+        elif isinstance(values.get(key), (dict, list)) and (
+            f"{section}.{key}".lstrip(".") not in SCHEMA
+        ):
+            problems.append(f"{prefix}{key} must be a single value")
+
+    return True
+
+
+def validate(argo_proj_yaml: dict):
+    """
+    Check that argo_proj.yml has every required key, and nothing else, so that typos fail
+    when the file is loaded rather than halfway through a run. Every problem is reported
+    at once.
+
+    Args:
+        argo_proj_yaml (dict): Contents of argo_proj.yml
+
+    Raises:
+        Exception: Raised if argo_proj.yml is not valid.
+    """
+
+    problems = []
+    if check_section(argo_proj_yaml, "", "", problems):
+        argocd_config = argo_proj_yaml.get("argocd")
+        if check_section(argocd_config, "argocd", "argocd", problems):
+            for section in ("project", "parent_app", "child_apps"):
+                if argocd_config.get(section) is not None:
+                    check_section(
+                        argocd_config[section],
+                        f"argocd.{section}",
+                        f"argocd.{section}",
+                        problems,
+                    )
+
+            child_apps = argocd_config.get("child_apps")
+            apps = child_apps.get("app") if isinstance(child_apps, dict) else None
+            if (apps is not None) and not isinstance(apps, list):
+                problems.append("argocd.child_apps.app must be a list")
+            else:
+                for i, child_app in enumerate(apps or []):
+                    check_section(
+                        child_app,
+                        "argocd.child_apps.app",
+                        f"argocd.child_apps.app[{i}]",
+                        problems,
+                    )
+
+    if problems:
+        raise Exception(f"Invalid {ARGO_PROJ_YAML}: {'; '.join(problems)}")
+
+
+## ------------------
+
+
+def to_text(value):
+    """
+    Convert a value from argo_proj.yml to a plain, interned string, so that values repeated
+    across apps (e.g. manifest paths) are only stored once.
+
+    Args:
+        value: The value
+
+    Returns:
+        str: The string, or None if value is None
+    """
+
+    return None if value is None else sys.intern(str(value))
+
+
+def load(argo_proj_yaml: dict):
+    """
+    Build the model of a validated (see validate) argo_proj.yml.
+
+    Args:
+        argo_proj_yaml (dict): Contents of argo_proj.yml
+
+    Returns:
+        ArgoProj: The model
+    """
+
+    argocd_config = argo_proj_yaml["argocd"]
+    project = argocd_config["project"]
+    parent_app = argocd_config["parent_app"]
+
+    return ArgoProj(
+        project=Project(
+            name=to_text(project["name"]), description=to_text(project["description"])
+        ),
+        parent_app=ParentApp(
+            name=to_text(parent_app["name"]),
+            repo_url=to_text(parent_app["repo_url"]),
+            version=to_text(parent_app["version"]),
+        ),
+        destination_cluster=to_text(argocd_config["child_apps"]["destination_cluster"]),
+        child_apps=tuple(
+            ChildApp(
+                name=to_text(child_app["name"]),
+                repo_url=to_text(child_app["repo_url"]),
+                namespace=to_text(child_app["namespace"]),
+                manifest_path=to_text(child_app["manifest_path"]),
+                deploy_plugin=to_text(child_app.get("deploy_plugin")),
+            )
+            for child_app in argocd_config["child_apps"]["app"]
+        ),
+    )
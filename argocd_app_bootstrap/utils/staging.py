@@ -0,0 +1,294 @@
+import os, io, threading
+
+## ------------------
+
+# Dry-run export formats
+EXPORT_YAML = "yaml"
+EXPORT_TAR = "tar"
+EXPORT_FORMATS = (EXPORT_YAML, EXPORT_TAR)
+
+## ------------------
+
+
+class StagingTree:
+    """
+    In-memory tree of rendered files, keyed by path relative to a root folder (usually a
+    repo's working copy). Files are only written to disk when the tree is flushed, or
+    can be exported without touching the disk at all.
+
+    Args:
+        root (str): Folder the tree is flushed to
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.files = {}
+        self.resources = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.files)
+
+    def relpath(self, path: str):
+        """
+        Get the path of a file relative to the root of the tree.
+
+        Args:
+            path (str): Absolute path, or path relative to the root
+
+        Raises:
+            Exception: Raised if the path is outside of the tree.
+
+        Returns:
+            str: Path relative to the root, with forward slashes
+        """
+
+        relative_path = os.path.relpath(os.path.join(self.root, path), self.root)
+        if relative_path.startswith(os.pardir):
+            raise Exception(f"Path [{path}] is outside of [{self.root}]")
+
+        return relative_path.replace(os.sep, "/")
+
+    def add(self, path: str, content: str, resource=None):
+        """
+        Stage a file. Staging the same path twice keeps the last content.
+
+        Args:
+            path (str): Absolute path, or path relative to the root
+            content (str): File contents
+            resource (dict, optional): What the file defines (kind, name, etc.), for the manifest index.
+        """
+
+        relative_path = self.relpath(path)
+        with self._lock:
+            self.files[relative_path] = content.encode("utf-8")
+            if resource is not None:
+                self.resources[relative_path] = resource
+            else:
+                self.resources.pop(relative_path, None)
+
+    def render(self, template, path: str, **variables):
+        """
+        Render a template and stage the output.
+
+        Args:
+            template (Template): Compiled Jinja template
+            path (str): Absolute path, or path relative to the root
+            **variables: Variables to bind to the template
+        """
+
+        self.add(path, template.render(**variables))
+
+    def items(self, base=None):
+        """
+        Get the staged files in path order.
+
+        Args:
+            base (str, optional): Make paths relative to this folder instead of the root.
+
+        Returns:
+            list: (relative path, contents as bytes)
+        """
+
+        prefix = ""
+        if base is not None:
+            prefix = os.path.relpath(self.root, os.path.abspath(base)).replace(
+                os.sep, "/"
+            )
+            prefix = "" if prefix == "." else f"{prefix}/"
+
+        with self._lock:
+            return [
+                (f"{prefix}{path}", data) for path, data in sorted(self.files.items())
+            ]
+
+    def resource_items(self):
+        """
+        Get the staged files that define a resource, in path order.
+
+        Returns:
+            list: (relative path, contents as bytes, resource)
+        """
+
+        with self._lock:
+            return [
+                (path, self.files[path], resource)
+                for path, resource in sorted(self.resources.items())
+            ]
+
+    def flush(self, clear=True):
+        """
+        Write every staged file under the root in a single pass, then empty the tree.
+        Each file is written to a temporary file next to it and renamed into place, so
+        readers never see a half-written file. Files whose content is unchanged on disk
+        are left alone.
+
+        Args:
+            clear (bool, optional): If false, keep the files staged (e.g. to commit them). Defaults to True.
+
+        Returns:
+            tuple: (paths written, number of unchanged files)
+        """
+
+        written = []
+        unchanged = 0
+        created_dirs = set()
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+
+        for relative_path, data in self.items():
+            path = os.path.join(self.root, relative_path)
+            try:
+                if os.path.getsize(path) == len(data):
+                    with open(path, "rb") as existing_file:
+                        if existing_file.read() == data:
+                            unchanged += 1
+                            continue
+            except OSError:
+                pass
+
+            directory = os.path.dirname(path)
+            if directory not in created_dirs:
+                os.makedirs(directory, exist_ok=True)
+                created_dirs.add(directory)
+
+            tmp_path = os.path.join(directory, f".{os.path.basename(path)}{suffix}")
+            try:
+                with open(tmp_path, "wb") as tmp_file:
+                    tmp_file.write(data)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            written.append(path)
+
+        if clear:
+            self.clear()
+
+        return written, unchanged
+
+    def clear(self):
+        """
+        Drop every staged file.
+        """
+
+        with self._lock:
+            self.files.clear()
+            self.resources.clear()
+
+
+## ------------------
+
+_trees = {}
+_trees_lock = threading.Lock()
+
+
+def get_tree(root: str):
+    """
+    Get the staging tree for a folder. Tasks that render into the same folder share
+    the same tree.
+
+    Args:
+        root (str): Folder the tree is flushed to
+
+    Returns:
+        StagingTree: The staging tree
+    """
+
+    root = os.path.abspath(root)
+    with _trees_lock:
+        if root not in _trees:
+            _trees[root] = StagingTree(root)
+
+        return _trees[root]
+
+
+## ------------------
+
+
+def reset():
+    """
+    Drop every staging tree, e.g. at the start of a run.
+    """
+
+    with _trees_lock:
+        _trees.clear()
+
+
+## ------------------
+
+
+def export_yaml(trees: list, stream, base=None):
+    """
+    Write staged files as a multi-document YAML stream. Each file starts a new document,
+    preceded by a comment with its path.
+
+    Args:
+        trees (list): Staging trees to export
+        stream (TextIO): Stream to write to
+        base (str, optional): Make paths relative to this folder instead of each tree's root.
+    """
+
+    for tree in trees:
+        for path, data in tree.items(base):
+            content = data.decode("utf-8")
+            stream.write(f"---\n# Source: {path}\n{content}")
+            if not content.endswith("\n"):
+                stream.write("\n")
+
+
+## ------------------
+
+
+def export_tar(trees: list, stream, base=None):
+    """
+    Write staged files as an uncompressed tar stream. Entries have fixed owners and
+    timestamps, so the same tree always produces the same archive.
+
+    Args:
+        trees (list): Staging trees to export
+        stream (BinaryIO): Stream to write to
+        base (str, optional): Make paths relative to this folder instead of each tree's root.
+    """
+
+    import tarfile
+
+    with tarfile.open(fileobj=stream, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        for tree in trees:
+            for path, data in tree.items(base):
+                info = tarfile.TarInfo(path)
+                info.size = len(data)
+                info.mode = 0o644
+                info.mtime = 0
+                tar.addfile(info, io.BytesIO(data))
+
+
+## ------------------
+
+
+def export(trees: list, export_format: str, stream, base=None):
+    """
+    Export staged files in the given format.
+
+    Args:
+        trees (list): Staging trees to export
+        export_format (str): yaml or tar
+        stream (TextIO): Text stream to write to. Tar archives go to its underlying binary buffer.
+        base (str, optional): Make paths relative to this folder instead of each tree's root.
+
+    Raises:
+        Exception: Raised if the format is not valid.
+    """
+
+    if export_format == EXPORT_YAML:
+        export_yaml(trees, stream, base)
+    elif export_format == EXPORT_TAR:
+        stream.flush()
+        export_tar(trees, getattr(stream, "buffer", stream), base)
+    else:
+        raise Exception(
+            f"Invalid export format [{export_format}]. Valid values: {', '.join(EXPORT_FORMATS)}"
+        )
+
+    stream.flush()
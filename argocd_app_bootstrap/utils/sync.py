@@ -0,0 +1,226 @@
+import json, time, datetime
+
+from concurrent.futures import ThreadPoolExecutor
+
+from argocd_app_bootstrap.utils.common import LOG_ERROR, LOG_INFO, LOG_WARN, publish
+
+## ------------------
+
+# App states in the sync report
+STATE_PENDING = "Pending"
+STATE_SYNCING = "Syncing"
+STATE_READY = "Ready"
+STATE_FAILED = "Failed"
+STATE_TIMEOUT = "Timeout"
+
+SYNC_STATUS_SYNCED = "Synced"
+HEALTH_STATUS_HEALTHY = "Healthy"
+SUCCEEDED_OPERATION_PHASE = "Succeeded"
+FAILED_OPERATION_PHASES = ("Failed", "Error")
+
+# How far behind the client's clock the API server's may be when telling a requested sync
+# operation from an earlier one
+CLOCK_SKEW_SECONDS = 2
+
+## ------------------
+
+
+def get_app_status(app: dict):
+    """
+    Get the sync status, health status and operation phase of an ArgoCD Application.
+
+    Args:
+        app (dict): Application object, as returned by the backend's app_list
+
+    Returns:
+        tuple: (sync status, health status, operation phase)
+    """
+
+    status = app.get("status") or {}
+    sync_status = (status.get("sync") or {}).get("status")
+    health_status = (status.get("health") or {}).get("status")
+    phase = (status.get("operationState") or {}).get("phase")
+
+    return sync_status, health_status, phase
+
+
+def is_operation_current(app: dict, requested_at: datetime.datetime):
+    """
+    Tell whether the last operation of an ArgoCD Application is the sync that was requested,
+    rather than one left over from an earlier deployment: it started at or after the request
+    (give or take CLOCK_SKEW_SECONDS). The synced revision can't tell them apart, since
+    redeploying an unchanged revision is the usual case.
+
+    Args:
+        app (dict): Application object, as returned by the backend's app_list
+        requested_at (datetime): When the sync was requested (UTC)
+
+    Returns:
+        bool: True if the operation state reflects the requested sync
+    """
+
+    operation_state = (app.get("status") or {}).get("operationState") or {}
+    started_at = operation_state.get("startedAt")
+    if not started_at:
+        return False
+
+    # RFC 3339, to the second (e.g. 2024-01-01T12:00:00Z)
+    started_at = datetime.datetime.fromisoformat(started_at.replace("Z", "+00:00"))
+    earliest = requested_at.replace(microsecond=0) - datetime.timedelta(
+        seconds=CLOCK_SKEW_SECONDS
+    )
+    return started_at >= earliest
+
+
+## ------------------
+
+
+def sync_apps(backend, app_names: list, selector=None, jobs=1, timeout=600, interval=5):
+    """
+    Sync a set of ArgoCD apps and wait until they are all Synced and Healthy, or until the
+    deadline expires.
+
+    Apps are synced as soon as they show up in ArgoCD (child apps are created by the root app
+    sync), with up to `jobs` sync calls in flight. Their status is polled with a single list
+    call per interval, rather than one call per app. An app is only judged Ready or Failed
+    once its operation state reflects the requested sync (see is_operation_current), so that
+    apps that were already Synced and Healthy, or whose last sync failed, aren't judged on
+    a previous deployment.
+
+    Args:
+        backend (CLIBackend | RESTBackend): ArgoCD backend
+        app_names (list): Names of the apps to sync
+        selector (str, optional): Label selector matching the apps, to narrow down the list call.
+        jobs (int, optional): Max number of concurrent sync calls. Defaults to 1.
+        timeout (int, optional): Deadline, in seconds. Defaults to 600.
+        interval (int, optional): Seconds between status polls. Defaults to 5.
+
+    Returns:
+        dict: Sync report, with the overall status and per-app states and timings.
+    """
+
+    start = time.monotonic()
+    deadline = start + timeout
+    apps = {
+        name: {
+            "name": name,
+            "state": STATE_PENDING,
+            "sync_status": None,
+            "health_status": None,
+            "sync_requested_seconds": None,
+            "ready_seconds": None,
+            "error": None,
+        }
+        for name in app_names
+    }
+
+    # When each sync was requested, to tell its operation from earlier ones
+    requested_at = {}
+
+    def elapsed():
+        return round(time.monotonic() - start, 2)
+
+    def request_sync(name):
+        try:
+            requested_at[name] = datetime.datetime.now(datetime.timezone.utc)
+            backend.app_sync(name)
+            apps[name]["sync_requested_seconds"] = elapsed()
+        except Exception as e:
+            apps[name]["state"] = STATE_FAILED
+            apps[name]["error"] = str(e).strip()
+
+    polls = 0
+    with ThreadPoolExecutor(max_workers=max(int(jobs), 1)) as executor:
+        while True:
+            polls += 1
+            for app in backend.app_list(selector):
+                name = app["metadata"]["name"]
+                if (name not in apps) or (apps[name]["state"] == STATE_FAILED):
+                    continue
+
+                sync_status, health_status, phase = get_app_status(app)
+                report_app = apps[name]
+                report_app["sync_status"] = sync_status
+                report_app["health_status"] = health_status
+
+                if report_app["state"] == STATE_PENDING:
+                    report_app["state"] = STATE_SYNCING
+                    executor.submit(request_sync, name)
+                elif report_app["sync_requested_seconds"] is None:
+                    # Sync call still in flight
+                    continue
+                elif not is_operation_current(app, requested_at[name]):
+                    # The requested sync hasn't started yet
+                    continue
+                elif (
+                    (phase == SUCCEEDED_OPERATION_PHASE)
+                    and (sync_status == SYNC_STATUS_SYNCED)
+                    and (health_status == HEALTH_STATUS_HEALTHY)
+                ):
+                    if report_app["state"] != STATE_READY:
+                        report_app["state"] = STATE_READY
+                        report_app["ready_seconds"] = elapsed()
+                elif phase in FAILED_OPERATION_PHASES:
+                    report_app["state"] = STATE_FAILED
+                    report_app["error"] = f"Sync operation {phase}"
+
+            done = all(
+                app["state"] in (STATE_READY, STATE_FAILED) for app in apps.values()
+            )
+            if done or (time.monotonic() >= deadline):
+                break
+
+            time.sleep(interval)
+
+    for app in apps.values():
+        if app["state"] not in (STATE_READY, STATE_FAILED):
+            app["state"] = STATE_TIMEOUT
+
+    states = [app["state"] for app in apps.values()]
+    if all(state == STATE_READY for state in states):
+        status = STATE_READY
+    elif STATE_FAILED in states:
+        status = STATE_FAILED
+    else:
+        status = STATE_TIMEOUT
+
+    return {
+        "status": status,
+        "selector": selector,
+        "duration_seconds": elapsed(),
+        "polls": polls,
+        "apps": list(apps.values()),
+    }
+
+
+## ------------------
+
+
+def publish_sync_report(report: dict, report_path=None):
+    """
+    Publish a summary of a sync report, and optionally write the full report as JSON.
+
+    Args:
+        report (dict): Report returned by sync_apps
+        report_path (str, optional): File to write the JSON report to.
+    """
+
+    for app in report["apps"]:
+        msg = f"[{app['state']}] {app['name']} sync={app['sync_status']} health={app['health_status']} ready_after={app['ready_seconds']}s"
+        if app["state"] == STATE_READY:
+            publish(msg, LOG_INFO)
+        elif app["state"] == STATE_TIMEOUT:
+            publish(msg, LOG_WARN)
+        else:
+            publish(f"{msg}: {app['error']}", LOG_ERROR)
+
+    ready = len([app for app in report["apps"] if app["state"] == STATE_READY])
+    publish(
+        f"INFO: {ready}/{len(report['apps'])} apps Synced and Healthy after {report['duration_seconds']}s ({report['polls']} polls)",
+        LOG_INFO,
+    )
+
+    if report_path:
+        with open(report_path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        publish(f"INFO: Wrote sync report to [{report_path}]", LOG_INFO)
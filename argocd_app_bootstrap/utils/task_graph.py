@@ -0,0 +1,195 @@
+import os, time
+
+from argocd_app_bootstrap.definitions import APP_CONFIG
+from argocd_app_bootstrap.utils.common import LOG_INFO, publish
+
+## ------------------
+
+# Steps of entry-point tasks that don't need every step listed before them, by entry task
+_needs = {}
+
+## ------------------
+
+
+def declare(entry_task, needs: dict):
+    """
+    Declare which steps (pre and post tasks) of an entry-point task need which other
+    steps. A declared step runs as soon as the steps it needs are done (and, for a post
+    task, the entry task itself). A step that isn't declared needs every step listed
+    before it, as with invoke. Needs on steps that aren't part of the run are ignored.
+
+    Args:
+        entry_task (Task): The entry-point task (e.g. setup_app_of_apps)
+        needs (dict): Step (Task) -> list of the steps (Task) it needs
+    """
+
+    _needs[entry_task] = needs
+
+
+def get_needs(entry_task):
+    """
+    Get the steps declared for an entry-point task.
+
+    Args:
+        entry_task (Task): The entry-point task
+
+    Returns:
+        dict: Step -> list of the steps it needs. Empty if nothing was declared.
+    """
+
+    return _needs.get(entry_task, {})
+
+
+def get_max_workers():
+    """
+    Get how many steps can run at once: task-graph.workers in config.yml, or the
+    TASK_WORKERS environment variable. With 1, steps run one at a time, in the order
+    they are listed.
+
+    Returns:
+        int: Max number of steps running at once
+    """
+
+    workers = os.environ.get(
+        "TASK_WORKERS", APP_CONFIG.get("task-graph", {}).get("workers", 4)
+    )
+    return max(int(workers), 1)
+
+
+## ------------------
+
+
+def run_graph(steps: list, needs: dict, prepare, max_workers=1, on_done=None):
+    """
+    Run steps once the steps they need are done, up to max_workers at a time, on a thread
+    pool. Ready steps start in the order they are listed. Once a step fails, no other step
+    is started: the running ones are waited for, and the first failure is raised.
+
+    Args:
+        steps (list): Step ids, in the order they are listed
+        needs (dict): Step id -> the step ids it needs
+        prepare (callable): Called on the calling thread with the id of a step that is about to start. Returns the function that runs the step.
+        max_workers (int, optional): Max number of steps running at once. With 1, steps run on the calling thread. Defaults to 1.
+        on_done (callable, optional): Called on the calling thread with the id of each step that succeeded, before the steps that need it start
+
+    Raises:
+        Exception: Raised if the steps need each other in a cycle.
+
+    Returns:
+        dict: Step id -> (start, end) of each step that ran, from time.perf_counter
+    """
+
+    timings = {}
+    pending = list(steps)
+    done = set()
+    failure = None
+
+    def timed(step, run_step):
+        start = time.perf_counter()
+        try:
+            run_step()
+        finally:
+            timings[step] = (start, time.perf_counter())
+
+    def get_ready():
+        return [step for step in pending if all(need in done for need in needs[step])]
+
+    def succeeded(step):
+        done.add(step)
+        if on_done is not None:
+            on_done(step)
+
+    if max_workers <= 1:
+        while pending:
+            ready = get_ready()
+            if not ready:
+                raise Exception(f"Steps need each other in a cycle: {pending}")
+            pending.remove(ready[0])
+            timed(ready[0], prepare(ready[0]))
+            succeeded(ready[0])
+
+        return timings
+
+    # Imported here, since most commands (e.g. --help) never run a graph
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if failure is None:
+                for step in get_ready()[: max_workers - len(running)]:
+                    pending.remove(step)
+                    running[executor.submit(timed, step, prepare(step))] = step
+
+            if not running:
+                if failure is None:
+                    raise Exception(f"Steps need each other in a cycle: {pending}")
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                try:
+                    future.result()
+                    succeeded(step)
+                except BaseException as e:
+                    failure = failure or e
+
+    if failure is not None:
+        raise failure
+
+    return timings
+
+
+## ------------------
+
+
+def get_critical_path(timings: dict, needs: dict):
+    """
+    Get the chain of steps that set the length of a run: the step that finished last,
+    the step it needed that finished last, and so on back to the start.
+
+    Args:
+        timings (dict): Step id -> (start, end), as returned by run_graph
+        needs (dict): Step id -> the step ids it needs
+
+    Returns:
+        list: Step ids, first to last
+    """
+
+    if not timings:
+        return []
+
+    step = max(timings, key=lambda step: timings[step][1])
+    path = [step]
+    while True:
+        ran = [need for need in needs[step] if need in timings]
+        if not ran:
+            break
+        step = max(ran, key=lambda step: timings[step][1])
+        path.append(step)
+
+    return path[::-1]
+
+
+def publish_critical_path(timings: dict, needs: dict, names: dict):
+    """
+    Publish the critical path of a run, with the time each step on it took.
+
+    Args:
+        timings (dict): Step id -> (start, end), as returned by run_graph
+        needs (dict): Step id -> the step ids it needs
+        names (dict): Step id -> step name
+    """
+
+    path = get_critical_path(timings, needs)
+    if not path:
+        return
+
+    total = max(end for _, end in timings.values()) - min(
+        start for start, _ in timings.values()
+    )
+    steps = " > ".join(
+        [f"{names[step]} ({timings[step][1] - timings[step][0]:.2f}s)" for step in path]
+    )
+    publish(f"INFO: Critical path ({total:.2f}s): {steps}", LOG_INFO)
@@ -0,0 +1,110 @@
+import os, threading
+
+from argocd_app_bootstrap.definitions import (
+    DEPLOY_TEMPLATES_PATH,
+    TEMPLATES_CACHE_PATH,
+    TEMPLATES_PATH,
+)
+
+## ------------------
+
+# Process-wide registries. Templates ship with the package and never change while
+# we're running, so each environment and template only needs to be built once.
+# jinja2 itself is only imported when the first environment is built.
+_environments = {}
+_templates = {}
+_lock = threading.Lock()
+
+## ------------------
+
+
+def _bytecode_cache():
+    """
+    Build the on-disk Jinja bytecode cache. Compiled templates are re-used across runs.
+
+    Returns:
+        FileSystemBytecodeCache: The bytecode cache, or None if the cache dir can't be created.
+    """
+
+    from jinja2 import FileSystemBytecodeCache
+
+    try:
+        os.makedirs(TEMPLATES_CACHE_PATH, exist_ok=True)
+    except OSError:
+        return None
+
+    return FileSystemBytecodeCache(TEMPLATES_CACHE_PATH)
+
+
+## ------------------
+
+
+def get_environment(templates_path: str = TEMPLATES_PATH):
+    """
+    Get the shared Jinja environment for the given templates folder. The environment is
+    built on first use.
+
+    Args:
+        templates_path (str, optional): Templates folder. Defaults to TEMPLATES_PATH.
+
+    Returns:
+        Environment: Jinja environment
+    """
+
+    env = _environments.get(templates_path)
+    if env is None:
+        with _lock:
+            env = _environments.get(templates_path)
+            if env is None:
+                from jinja2 import Environment, FileSystemLoader
+
+                env = Environment(
+                    loader=FileSystemLoader(templates_path),
+                    trim_blocks=True,
+                    auto_reload=False,
+                    bytecode_cache=_bytecode_cache(),
+                )
+                _environments[templates_path] = env
+
+    return env
+
+
+## ------------------
+
+
+def get_template(name: str, templates_path: str = TEMPLATES_PATH):
+    """
+    Get a compiled template handle. Templates are loaded and compiled once per process.
+
+    Args:
+        name (str): Template file name (e.g. application.yml.j2)
+        templates_path (str, optional): Templates folder. Defaults to TEMPLATES_PATH.
+
+    Returns:
+        Template: Compiled Jinja template
+    """
+
+    key = (templates_path, name)
+    template = _templates.get(key)
+    if template is None:
+        template = get_environment(templates_path).get_template(name)
+        _templates[key] = template
+
+    return template
+
+
+## ------------------
+
+
+def get_deploy_template(name: str):
+    """
+    Get a compiled template handle from the deploy templates folder.
+
+    Args:
+        name (str): Template file name (e.g. Chart.yaml.j2)
+
+    Returns:
+        Template: Compiled Jinja template
+    """
+
+    return get_template(name, DEPLOY_TEMPLATES_PATH)
@@ -0,0 +1,94 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+App generation benchmark: files, bytes and render time of the child apps of a synthetic
+argo_proj.yml for every environment, as one Application file per app vs. ApplicationSets,
+and the time to check that the ApplicationSets (expanded locally) generate the same
+Applications.
+
+Usage: python benchmarks/bench_app_sets.py [num_apps]
+"""
+
+import json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from argocd_app_bootstrap.definitions import APP_CONFIG, yaml
+from argocd_app_bootstrap.tasks.argocd.setup.actions import render_app_of_apps
+from argocd_app_bootstrap.utils import app_sets, log, manifest_index, models
+
+from synthetic import make_argo_proj
+
+## ------------------
+
+
+def render(argo_proj, application_sets: bool):
+    """
+    Render the root and child apps of every environment, and measure the child apps.
+    """
+
+    start = time.perf_counter()
+    rendered = render_app_of_apps(
+        argo_proj, APP_CONFIG["environments"], application_sets=application_sets
+    )
+    seconds = time.perf_counter() - start
+
+    child_apps = [
+        (content, resource)
+        for _, content, resource in rendered
+        if resource["role"] != manifest_index.ROLE_ROOT_APP
+    ]
+    return rendered, {
+        "files": len(child_apps),
+        "bytes": sum(len(content.encode("utf-8")) for content, _ in child_apps),
+        "render_seconds": round(seconds, 3),
+    }
+
+
+## ------------------
+
+
+def main(num_apps=1000):
+    log.configure(level="ERROR")
+
+    argo_proj_yaml = make_argo_proj(num_apps)
+    # Some apps without the deploy plugin, so that there are two ApplicationSets per environment
+    for app in argo_proj_yaml["argocd"]["child_apps"]["app"][::10]:
+        app.pop("deploy_plugin")
+    argo_proj = models.load(argo_proj_yaml)
+
+    _, applications = render(argo_proj, False)
+    rendered, application_sets = render(argo_proj, True)
+
+    start = time.perf_counter()
+    num_checked = 0
+    for environment in APP_CONFIG["environments"]:
+        num_checked += app_sets.verify_app_sets(
+            argo_proj,
+            environment,
+            [
+                yaml.load(content)
+                for _, content, resource in rendered
+                if (resource["role"] == manifest_index.ROLE_APP_SET)
+                and (resource["environment"] == environment)
+            ],
+        )
+    application_sets["verify_seconds"] = round(time.perf_counter() - start, 3)
+    application_sets["verified_apps"] = num_checked
+
+    results = {
+        "benchmark": "app_sets",
+        "apps": num_apps,
+        "environments": len(APP_CONFIG["environments"]),
+        "applications": applications,
+        "applicationsets": application_sets,
+        "bytes_ratio": round(application_sets["bytes"] / applications["bytes"], 2),
+    }
+    print(json.dumps(results, indent=2))
+
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
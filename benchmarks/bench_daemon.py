@@ -0,0 +1,168 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Daemon benchmark: time per job when every job is a fresh CLI process ("cold") vs. a job
+submitted to a running daemon (argo-bootstrap daemon.serve) with warm worker processes.
+Both run against the same synthetic bundle, with local bare repos and fake CLIs (see
+bench_scale.py). The first run of each job type pushes the rendered files. The runs that
+are timed then find nothing to commit, so every timed run does the same work.
+
+Usage: python benchmarks/bench_daemon.py [--apps 20] [--runs 5]
+           [--job-type setup_app_of_apps|bootstrap_k8s_deployment]
+"""
+
+import argparse, http.client, json, os, shutil, signal, socket, statistics, subprocess, sys, tempfile, time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [BENCHMARKS_DIR, os.path.dirname(BENCHMARKS_DIR)]
+
+from argocd_app_bootstrap.definitions import DATA_PATH
+from argocd_app_bootstrap.utils.daemon import JOB_TASKS
+
+from bench_scale import (
+    DEFAULT_ENVIRONMENTS,
+    ROOT_DIR,
+    get_env,
+    prepare_workspace,
+    run_cli,
+)
+
+DAEMON_LAUNCHER = """
+import sys
+from argocd_app_bootstrap.main import program
+program.run(["argo-bootstrap", "daemon.serve", "--socket", sys.argv[1], "--workers", "1"])
+"""
+
+## ------------------
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str):
+        super().__init__("localhost")
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def request(socket_path: str, method: str, path: str, payload=None):
+    conn = UnixHTTPConnection(socket_path)
+    try:
+        body = None if payload is None else json.dumps(payload)
+        conn.request(method, path, body=body)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def run_daemon_job(socket_path: str, job_type: str):
+    """
+    Submit a job and wait for it to finish.
+
+    Returns:
+        tuple: (job details, wall time in seconds seen by the client)
+    """
+
+    start = time.perf_counter()
+    _, job = request(socket_path, "POST", "/jobs", {"type": job_type})
+    _, job = request(socket_path, "GET", f"/jobs/{job['id']}?wait=600")
+    return job, time.perf_counter() - start
+
+
+def wait_for_daemon(socket_path: str, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise Exception(f"The daemon exited with code {process.returncode}")
+        try:
+            return request(socket_path, "GET", "/health")[1]
+        except OSError:
+            time.sleep(0.1)
+
+    raise Exception("The daemon didn't start in time")
+
+
+## ------------------
+
+
+def summarize(seconds: list):
+    return {
+        "median_seconds": round(statistics.median(seconds), 3),
+        "min_seconds": round(min(seconds), 3),
+        "max_seconds": round(max(seconds), 3),
+    }
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Cold CLI runs vs. daemon jobs")
+    parser.add_argument("--apps", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--job-type", default="setup_app_of_apps", choices=list(JOB_TASKS)
+    )
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="bench_daemon_")
+    daemon = None
+    try:
+        paths = prepare_workspace(work_dir, args.apps)
+        env = get_env(paths, DEFAULT_ENVIRONMENTS[0])
+        settings = {"environments": DEFAULT_ENVIRONMENTS, "poll_interval": 0.2}
+        log_path = os.path.join(paths["logs"], "cli.log")
+
+        argv = [JOB_TASKS[args.job_type]]
+        cold = []
+        for i in range(args.runs + 1):
+            exit_code, seconds, _ = run_cli(argv, env, settings, log_path)
+            if exit_code != 0:
+                raise Exception(f"CLI run failed. See {log_path}")
+            if i > 0:
+                cold.append(seconds)
+
+        socket_path = os.path.join(work_dir, "daemon.sock")
+        with open(os.path.join(paths["logs"], "daemon.log"), "w") as daemon_log:
+            start = time.perf_counter()
+            daemon = subprocess.Popen(
+                [sys.executable, "-c", DAEMON_LAUNCHER, socket_path],
+                cwd=ROOT_DIR,
+                env=env,
+                stdout=daemon_log,
+                stderr=subprocess.STDOUT,
+            )
+            wait_for_daemon(socket_path, daemon)
+            startup_seconds = time.perf_counter() - start
+
+        warm = []
+        for i in range(args.runs + 1):
+            job, seconds = run_daemon_job(socket_path, args.job_type)
+            if job["status"] != "succeeded":
+                raise Exception(f"Daemon job failed: {job['error']}. See {job['log']}")
+            if i > 0:
+                warm.append(seconds)
+
+        results = {
+            "benchmark": "daemon",
+            "apps": args.apps,
+            "job_type": args.job_type,
+            "runs": args.runs,
+            "cold": summarize(cold),
+            "daemon": dict(summarize(warm), startup_seconds=round(startup_seconds, 3)),
+            "speedup": round(statistics.median(cold) / statistics.median(warm), 2),
+        }
+        print(json.dumps(results, indent=2))
+
+        return results
+
+    finally:
+        if daemon is not None:
+            daemon.send_signal(signal.SIGTERM)
+            daemon.wait(60)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        shutil.rmtree(DATA_PATH, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,99 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Model benchmark: memory held per child app by the parsed argo_proj.yml (ruamel
+CommentedMaps, which is what the tasks used to share) vs. the slotted model, and the cost
+of copying the invoke config that holds it, which happens for every scaffolded app.
+
+Usage: python benchmarks/bench_model.py [num_apps]
+"""
+
+import gc, json, os, sys, tempfile, time, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from invoke import Config
+
+from argocd_app_bootstrap.definitions import yaml
+from argocd_app_bootstrap.utils import common, log, models
+
+from synthetic import write_argo_proj
+
+## ------------------
+
+
+def measure(build):
+    """
+    Get the memory still held by what build returns.
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    held_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return result, held_bytes
+
+
+def time_clones(value, clones: int):
+    config = Config(overrides={"argo_proj": value})
+    start = time.perf_counter()
+    for _ in range(clones):
+        config.clone()
+
+    return time.perf_counter() - start
+
+
+## ------------------
+
+
+def main(num_apps=20000):
+    log.configure(level="ERROR")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        argo_proj_path = write_argo_proj(tmp_dir, num_apps)
+        with open(argo_proj_path, "r") as stream:
+            content = stream.read()
+
+    def parse():
+        argo_proj_yaml = yaml.load(content)
+        common.cleanup_argo_proj_yaml(argo_proj_yaml)
+        return argo_proj_yaml
+
+    argo_proj_yaml, yaml_bytes = measure(parse)
+
+    def build():
+        models.validate(argo_proj_yaml)
+        return models.load(argo_proj_yaml)
+
+    argo_proj, model_bytes = measure(build)
+    start = time.perf_counter()
+    build()
+    load_seconds = time.perf_counter() - start
+
+    clones = 10
+    results = {
+        "benchmark": "model",
+        "apps": num_apps,
+        "validate_and_load_seconds": round(load_seconds, 3),
+        "yaml_bytes_per_app": round(yaml_bytes / num_apps),
+        "model_bytes_per_app": round(model_bytes / num_apps),
+        "memory_ratio": round(yaml_bytes / model_bytes, 1),
+        "empty_config_clone_ms": round(time_clones(None, clones) / clones * 1000, 2),
+        "yaml_config_clone_ms": round(
+            time_clones(argo_proj_yaml, clones) / clones * 1000, 2
+        ),
+        "model_config_clone_ms": round(
+            time_clones(argo_proj, clones) / clones * 1000, 2
+        ),
+    }
+    print(json.dumps(results, indent=2))
+
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,102 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Logging microbenchmark: per-call cost of publish, as seen by the caller, for each logging
+setup. "legacy" is the way publish used to work: a new bound logger and a frame lookup
+through inspect on every call, through structlog's global configuration. Log lines go to
+/dev/null, so the numbers are the logging overhead only.
+
+Usage: python benchmarks/bench_publish.py [calls]
+"""
+
+import inspect, json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import structlog
+
+from argocd_app_bootstrap.utils import common, log
+from argocd_app_bootstrap.utils.common import LOG_ERROR, LOG_INFO, LOG_WARN, publish
+
+## ------------------
+
+
+def legacy_publish(msg: str, type: str):
+    log = structlog.get_logger().bind(
+        app="argocd_app_bootstrap", caller=inspect.currentframe().f_back.f_code.co_name
+    )
+
+    if type.upper() == LOG_INFO:
+        log.info(msg)
+
+    if type.upper() == LOG_ERROR:
+        log.error(f"AN ERROR HAS OCCURRED: {msg}")
+
+    if type.upper() == LOG_WARN:
+        log.warning(msg)
+
+
+## ------------------
+
+
+def render_loop(publish_func, calls: int):
+    start = time.perf_counter()
+    for i in range(calls):
+        publish_func(f"INFO: Rendered [svc-{i}-app-dev.yml]", LOG_INFO)
+
+    return time.perf_counter() - start
+
+
+## ------------------
+
+
+def main(calls=20000):
+    devnull = open(os.devnull, "w")
+    structlog.configure(logger_factory=structlog.PrintLoggerFactory(devnull))
+
+    # Name, publish function, logging settings
+    scenarios = [
+        ("legacy", legacy_publish, None),
+        ("console", publish, {"log_format": log.FORMAT_CONSOLE}),
+        ("json", publish, {"log_format": log.FORMAT_JSON}),
+        ("background", publish, {"log_format": log.FORMAT_CONSOLE, "background": True}),
+        ("filtered", publish, {"level": LOG_ERROR}),
+    ]
+
+    results = []
+    for name, publish_func, settings in scenarios:
+        if settings is not None:
+            log.configure(stream=devnull, **dict({"background": False}, **settings))
+
+        render_loop(publish_func, min(calls, 1000))
+        log.flush()
+
+        start = time.perf_counter()
+        seconds = render_loop(publish_func, calls)
+        log.flush()
+        total_seconds = time.perf_counter() - start
+
+        results.append(
+            {
+                "setup": name,
+                "caller_us_per_call": round(seconds / calls * 1e6, 2),
+                "total_us_per_call": round(total_seconds / calls * 1e6, 2),
+            }
+        )
+
+    legacy = results[0]["caller_us_per_call"]
+    for result in results:
+        result["speedup"] = round(legacy / result["caller_us_per_call"], 1)
+
+    print(
+        json.dumps(
+            {"benchmark": "publish", "calls": calls, "results": results}, indent=2
+        )
+    )
+
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
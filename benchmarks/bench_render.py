@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Render benchmark: time to render every child app Application for every environment of a
+synthetic argo_proj.yml and write it out, with a fresh Jinja environment per call (the old
+behaviour) vs. the shared, precompiled template registry and a staging tree flushed once.
+
+Usage: python benchmarks/bench_render.py [num_apps]
+"""
+
+import copy, json, os, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jinja2 import Environment, FileSystemLoader
+
+from argocd_app_bootstrap.definitions import APP_CONFIG, TEMPLATES_PATH, yaml
+from argocd_app_bootstrap.utils import common, log, staging
+
+from synthetic import write_argo_proj
+
+## ------------------
+
+
+def render_fresh_environment(app_details, tree, environment):
+    """
+    Render an Application the way the setup task used to: new environment every call, and
+    the file written straight away.
+    """
+
+    env = Environment(loader=FileSystemLoader(TEMPLATES_PATH), trim_blocks=True)
+    app_details["name"] = f"{app_details['name']}-app-{environment}"
+    rendered_data = env.get_template("application.yml.j2").stream(
+        app=app_details,
+        namespace=app_details["namespace"],
+        destination_cluster="in-cluster",
+        project_name=f"bench-project-{environment}",
+        deploy_plugin=app_details.get("deploy_plugin"),
+    )
+    rendered_data.dump(f"{tree.root}/{environment}/{app_details['name']}.yml")
+
+
+## ------------------
+
+
+def render_shared_environment(app_details, tree, environment):
+    """
+    Render an Application the way the setup task does: shared template registry, and the
+    file staged until the tree is flushed.
+    """
+
+    filename, content = common.render_app_template(
+        app_details,
+        app_details["namespace"],
+        "in-cluster",
+        "bench-project",
+        environment,
+        deploy_plugin=app_details.get("deploy_plugin"),
+    )
+    tree.add(f"{environment}/{filename}", content)
+
+
+## ------------------
+
+
+def run(render, apps, output_dir):
+    tree = staging.StagingTree(output_dir)
+
+    start = time.perf_counter()
+    for environment in APP_CONFIG["environments"]:
+        os.makedirs(os.path.join(output_dir, environment), exist_ok=True)
+        for app in apps:
+            render(copy.copy(app), tree, environment)
+    tree.flush()
+
+    return time.perf_counter() - start
+
+
+## ------------------
+
+
+def main(num_apps=5000):
+    # Logging every rendered file would dominate the timings
+    log.configure(level="ERROR")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        argo_proj_path = write_argo_proj(tmp_dir, num_apps)
+        with open(argo_proj_path, "r") as stream:
+            apps = [
+                dict(app) for app in yaml.load(stream)["argocd"]["child_apps"]["app"]
+            ]
+
+        before = run(render_fresh_environment, apps, os.path.join(tmp_dir, "before"))
+        after = run(render_shared_environment, apps, os.path.join(tmp_dir, "after"))
+
+    results = {
+        "benchmark": "render",
+        "apps": num_apps,
+        "environments": len(APP_CONFIG["environments"]),
+        "before_seconds": round(before, 3),
+        "after_seconds": round(after, 3),
+        "speedup": round(before / after, 1),
+    }
+    print(json.dumps(results, indent=2))
+
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Parallel render benchmark: time to render the app of apps (root app + every child app, for
+every environment) of a synthetic argo_proj.yml with 1..N worker processes. The output of
+every run is checked to be byte-identical to the serial run.
+
+Usage: python benchmarks/bench_render_parallel.py [num_apps] [max_jobs]
+"""
+
+import json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from argocd_app_bootstrap.definitions import APP_CONFIG
+from argocd_app_bootstrap.tasks.argocd.setup.actions import render_app_of_apps
+from argocd_app_bootstrap.utils import models
+
+from synthetic import make_argo_proj
+
+## ------------------
+
+
+def main(num_apps=5000, max_jobs=os.cpu_count()):
+    argo_proj = models.load(make_argo_proj(num_apps))
+    environments = APP_CONFIG["environments"]
+
+    runs = []
+    serial_output = None
+    jobs = 1
+    while True:
+        start = time.perf_counter()
+        output = render_app_of_apps(argo_proj, environments, jobs=jobs)
+        elapsed = time.perf_counter() - start
+
+        if serial_output is None:
+            serial_output = output
+        elif output != serial_output:
+            raise Exception(f"Output with {jobs} jobs differs from the serial output")
+
+        runs.append({"jobs": jobs, "seconds": round(elapsed, 3)})
+        if jobs >= max_jobs:
+            break
+        jobs = min(jobs * 2, max_jobs)
+
+    results = {
+        "benchmark": "render_parallel",
+        "apps": num_apps,
+        "environments": len(environments),
+        "files": len(serial_output),
+        "cpus": os.cpu_count(),
+        "runs": runs,
+        "speedup": round(runs[0]["seconds"] / min(run["seconds"] for run in runs), 1),
+    }
+    print(json.dumps(results, indent=2))
+
+    return results
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count(),
+    )
@@ -0,0 +1,480 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Scale benchmark: runs the whole lifecycle of a synthetic app bundle end-to-end, for
+bundles of increasing size. For each size, a fresh workspace gets local bare repos for
+the parent and every child app, and fake argocd/kubectl CLIs (see fake_cli.py) on PATH.
+Then each phase runs in its own CLI process:
+
+    setup       argo-setup.setup-app-of-apps
+    bootstrap   deploy-setup.bootstrap-k8s-deployment
+    deploy      argo-run.deploy-app-bundle
+    teardown    argo-run.remove-app-bundle, argo-run.remove-project, argo-run.remove-repos
+
+For each phase, the results record the wall time, the number of git/argocd/kubectl
+processes started, the peak RSS of the CLI process (and the processes it waited for), and
+the number of files pushed to the repos. Results are printed as JSON. Pass the results of
+an earlier run with --baseline to compare wall times against it: the exit status is 1 if
+a phase failed or got slower than the tolerance allows.
+
+Usage: python benchmarks/bench_scale.py [--apps 10,100,1000] [--environments 3] [--jobs 4]
+           [--phases setup,bootstrap,deploy,teardown] [--output results.json]
+           [--baseline old.json] [--tolerance 1.25] [--keep]
+"""
+
+import argparse, io, json, os, platform, shutil, subprocess, sys, tempfile, time
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+sys.path[:0] = [BENCHMARKS_DIR, ROOT_DIR]
+
+from argocd_app_bootstrap._version import __version__
+from argocd_app_bootstrap.definitions import yaml
+
+from synthetic import make_argo_proj
+
+DEFAULT_ENVIRONMENTS = ["dev", "qa", "prod"]
+
+# Looked up before the shims go on PATH
+REAL_GIT = shutil.which("git")
+
+# Commits made by the benchmark and by the tasks
+GIT_IDENTITY = {
+    "GIT_AUTHOR_NAME": "Benchmark",
+    "GIT_AUTHOR_EMAIL": "benchmark@example.com",
+    "GIT_COMMITTER_NAME": "Benchmark",
+    "GIT_COMMITTER_EMAIL": "benchmark@example.com",
+}
+
+# Phase name, CLI runs (task and arguments; {jobs} is replaced)
+PHASES = [
+    ("setup", [["argo-setup.setup-app-of-apps", "--jobs", "{jobs}"]]),
+    ("bootstrap", [["deploy-setup.bootstrap-k8s-deployment", "--jobs", "{jobs}"]]),
+    ("deploy", [["argo-run.deploy-app-bundle", "--jobs", "{jobs}"]]),
+    (
+        "teardown",
+        [
+            ["argo-run.remove-app-bundle"],
+            ["argo-run.remove-project"],
+            ["argo-run.remove-repos", "--jobs", "{jobs}"],
+        ],
+    ),
+]
+
+# Commands that are counted by the shims on PATH
+COUNTED_COMMANDS = ["git", "argocd", "kubectl"]
+
+# Runs the CLI in a fresh interpreter, with the environments and the sync poll interval
+# of the benchmark. Everything else comes from config.yml.
+LAUNCHER = """
+import json, sys
+settings = json.loads(sys.argv[1])
+from argocd_app_bootstrap.definitions import APP_CONFIG
+APP_CONFIG["environments"] = settings["environments"]
+APP_CONFIG["sync"] = dict(APP_CONFIG.get("sync", {}), **{"poll-interval-seconds": settings["poll_interval"]})
+from argocd_app_bootstrap.main import program
+program.run(["argo-bootstrap"] + sys.argv[2:])
+"""
+
+## ------------------
+
+
+def get_environments(count: int):
+    return DEFAULT_ENVIRONMENTS[:count] + [
+        f"env{i}" for i in range(len(DEFAULT_ENVIRONMENTS), count)
+    ]
+
+
+## ------------------
+
+
+def git(*args, cwd=None):
+    subprocess.run(
+        [REAL_GIT, *args],
+        cwd=cwd,
+        env=dict(os.environ, **GIT_IDENTITY),
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+
+def make_seed_repo(path: str, files: dict):
+    """
+    Create a bare repo with a single commit on main holding the given files.
+    """
+
+    git("init", "--quiet", "--bare", "--initial-branch=main", path)
+    with tempfile.TemporaryDirectory() as work_dir:
+        git("clone", "--quiet", path, work_dir)
+        for name, content in files.items():
+            with open(os.path.join(work_dir, name), "w") as stream:
+                stream.write(content)
+        git("add", ".", cwd=work_dir)
+        git("commit", "--quiet", "-m", "Initial commit", cwd=work_dir)
+        git("push", "--quiet", "origin", "HEAD:main", cwd=work_dir)
+
+
+def write_shims(bin_dir: str, calls_log: str):
+    """
+    Write the git, argocd and kubectl shims. Each one logs its name, then runs the real git
+    or the fake CLI.
+    """
+
+    os.makedirs(bin_dir)
+    targets = {
+        "git": f'"{REAL_GIT}"',
+        "argocd": f'"{sys.executable}" "{os.path.join(BENCHMARKS_DIR, "fake_cli.py")}" argocd',
+        "kubectl": f'"{sys.executable}" "{os.path.join(BENCHMARKS_DIR, "fake_cli.py")}" kubectl',
+    }
+    for name, target in targets.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as stream:
+            stream.write(
+                f'#!/bin/sh\necho {name} >> "{calls_log}"\nexec {target} "$@"\n'
+            )
+        os.chmod(path, 0o755)
+
+
+def prepare_workspace(work_dir: str, num_apps: int):
+    """
+    Create the bare repos and the shims for a bundle of num_apps child apps.
+
+    Returns:
+        dict: Workspace paths
+    """
+
+    remotes_dir = os.path.join(work_dir, "remotes")
+    argo_proj = make_argo_proj(num_apps, repo_prefix=remotes_dir)
+    stream = io.StringIO()
+    yaml.dump(argo_proj, stream)
+
+    parent_repo = argo_proj["argocd"]["parent_app"]["repo_url"]
+    make_seed_repo(
+        parent_repo,
+        {"README.md": "# Benchmark parent repo\n", "argo_proj.yml": stream.getvalue()},
+    )
+
+    # Child repos all start out the same, so they're copies of a single seed repo
+    seed_repo = os.path.join(work_dir, "seed.git")
+    make_seed_repo(seed_repo, {"README.md": "# Benchmark child repo\n"})
+    child_repos = [app["repo_url"] for app in argo_proj["argocd"]["child_apps"]["app"]]
+    for child_repo in child_repos:
+        shutil.copytree(seed_repo, child_repo, symlinks=True)
+
+    paths = {
+        "parent_repo": parent_repo,
+        "repos": [parent_repo] + child_repos,
+        "bin": os.path.join(work_dir, "bin"),
+        "calls_log": os.path.join(work_dir, "calls.log"),
+        "state": os.path.join(work_dir, "state"),
+        "cache": os.path.join(work_dir, "cache"),
+        "data": os.path.join(work_dir, "data"),
+        "logs": os.path.join(work_dir, "logs"),
+        "gitconfig": os.path.join(work_dir, "gitconfig"),
+    }
+    write_shims(paths["bin"], paths["calls_log"])
+    os.makedirs(paths["logs"])
+    open(paths["gitconfig"], "w").close()
+
+    return paths
+
+
+## ------------------
+
+
+def get_head(repo: str):
+    """
+    Get the commit at the tip of main in a bare repo, without starting a process.
+    """
+
+    try:
+        with open(os.path.join(repo, "refs", "heads", "main"), "r") as stream:
+            return stream.read().strip()
+    except FileNotFoundError:
+        pass
+
+    with open(os.path.join(repo, "packed-refs"), "r") as stream:
+        for line in stream:
+            if line.rstrip().endswith(" refs/heads/main"):
+                return line.split()[0]
+
+    return None
+
+
+def count_pushed_files(repo: str, before: str, after: str):
+    result = subprocess.run(
+        [REAL_GIT, "-C", repo, "diff", "--name-only", "--no-renames", before, after],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return len(result.stdout.splitlines())
+
+
+def count_files_written(heads_before: dict, heads_after: dict):
+    changed = [
+        (repo, head, heads_after[repo])
+        for repo, head in heads_before.items()
+        if heads_after[repo] != head
+    ]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        return sum(executor.map(lambda args: count_pushed_files(*args), changed))
+
+
+## ------------------
+
+
+def run_cli(argv: list, env: dict, settings: dict, log_path: str):
+    """
+    Run the CLI in its own process.
+
+    Returns:
+        tuple: (exit code, wall time in seconds, peak RSS in MB)
+    """
+
+    with open(log_path, "a") as log_file:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-c", LAUNCHER, json.dumps(settings)] + argv,
+            cwd=ROOT_DIR,
+            env=env,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+        )
+        _, status, rusage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    # ru_maxrss is in KB on Linux, and in bytes on macOS
+    peak_rss = rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+    return process.returncode, seconds, peak_rss
+
+
+def run_phase(name: str, runs: list, paths: dict, env: dict, settings: dict, jobs: int):
+    heads_before = {repo: get_head(repo) for repo in paths["repos"]}
+    open(paths["calls_log"], "w").close()
+
+    result = {"phase": name, "commands": [], "wall_seconds": 0.0, "peak_rss_mb": 0.0}
+    exit_code = 0
+    for run in runs:
+        argv = [arg.replace("{jobs}", str(jobs)) for arg in run]
+        exit_code, seconds, peak_rss = run_cli(
+            argv, env, settings, os.path.join(paths["logs"], f"{name}.log")
+        )
+        result["commands"].append(" ".join(argv))
+        result["wall_seconds"] += seconds
+        result["peak_rss_mb"] = max(result["peak_rss_mb"], peak_rss)
+        if exit_code != 0:
+            break
+
+    with open(paths["calls_log"], "r") as stream:
+        calls = Counter(line.strip() for line in stream)
+
+    heads_after = {repo: get_head(repo) for repo in paths["repos"]}
+    result.update(
+        {
+            "wall_seconds": round(result["wall_seconds"], 3),
+            "peak_rss_mb": round(result["peak_rss_mb"], 1),
+            "subprocesses": dict(
+                {command: calls[command] for command in COUNTED_COMMANDS},
+                total=sum(calls.values()),
+            ),
+            "files_written": count_files_written(heads_before, heads_after),
+            "ok": exit_code == 0,
+        }
+    )
+    if exit_code != 0:
+        result["exit_code"] = exit_code
+        result["log"] = os.path.join(paths["logs"], f"{name}.log")
+
+    return result
+
+
+## ------------------
+
+
+def get_env(paths: dict, target_environment: str):
+    """
+    Get the environment the CLI runs with: shims first on PATH, and the workspace's repos,
+    data dir, caches and credentials.
+    """
+
+    return dict(
+        os.environ,
+        PATH=f"{paths['bin']}{os.pathsep}{os.environ['PATH']}",
+        FAKE_CLI_STATE=paths["state"],
+        ARGOCD_BACKEND="cli",
+        ARGOCD_BOOTSTRAP_CACHE=paths["cache"],
+        # Keep the clones out of the package's data dir, as the daemon does for its workers
+        ARGOCD_BOOTSTRAP_DATA=paths["data"],
+        ARGOCD_USERNAME="admin",
+        ARGOCD_PASSWORD="password",
+        GIT_TOKEN="benchmark",
+        GIT_REPO_URL=paths["parent_repo"],
+        TARGET_ENVIRONMENT=target_environment,
+        # Keep the git config written by the tasks out of ~/.gitconfig
+        GIT_CONFIG_GLOBAL=paths["gitconfig"],
+        **GIT_IDENTITY,
+    )
+
+
+## ------------------
+
+
+def run_bundle(num_apps: int, args, work_dir: str):
+    """
+    Run every phase for a bundle of num_apps child apps.
+
+    Returns:
+        dict: Results for the bundle
+    """
+
+    start = time.perf_counter()
+    paths = prepare_workspace(work_dir, num_apps)
+    prepare_seconds = time.perf_counter() - start
+
+    environments = get_environments(args.environments)
+    settings = {"environments": environments, "poll_interval": args.poll_interval}
+    env = get_env(paths, environments[0])
+
+    phases = []
+    for name, runs in PHASES:
+        if name not in args.phases:
+            continue
+
+        phase = run_phase(name, runs, paths, env, settings, args.jobs)
+        phases.append(phase)
+        print(
+            f"{num_apps} apps, {name}: {phase['wall_seconds']}s{'' if phase['ok'] else ' FAILED'}",
+            file=sys.stderr,
+        )
+        if not phase["ok"]:
+            break
+
+    return {
+        "apps": num_apps,
+        "environments": len(environments),
+        "prepare_seconds": round(prepare_seconds, 3),
+        "phases": phases,
+    }
+
+
+## ------------------
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """
+    Compare wall times with an earlier run, for the bundle sizes and phases both have.
+
+    Returns:
+        list: Phases that got slower than the tolerance allows
+    """
+
+    baseline_phases = {
+        (bundle["apps"], bundle["environments"], phase["phase"]): phase
+        for bundle in baseline["results"]
+        for phase in bundle["phases"]
+        if phase["ok"]
+    }
+
+    regressions = []
+    for bundle in results["results"]:
+        for phase in bundle["phases"]:
+            key = (bundle["apps"], bundle["environments"], phase["phase"])
+            if key not in baseline_phases:
+                continue
+
+            ratio = phase["wall_seconds"] / max(
+                baseline_phases[key]["wall_seconds"], 0.001
+            )
+            phase["baseline_ratio"] = round(ratio, 2)
+            if ratio > tolerance:
+                regressions.append(f"{bundle['apps']} apps, {phase['phase']}")
+
+    return regressions
+
+
+## ------------------
+
+
+def parse_args(argv: list):
+    parser = argparse.ArgumentParser(
+        description="End-to-end scale benchmark against local repos and fake CLIs"
+    )
+    parser.add_argument(
+        "--apps",
+        default="10,100,1000",
+        help="Comma-separated bundle sizes (number of child apps)",
+    )
+    parser.add_argument("--environments", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument(
+        "--phases",
+        default=",".join(name for name, _ in PHASES),
+        help="Comma-separated phases to run, in lifecycle order",
+    )
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--output", help="Also write the results to this file")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    parser.add_argument("--workdir", help="Where to create the workspaces")
+    parser.add_argument("--keep", action="store_true", help="Keep the workspaces")
+
+    args = parser.parse_args(argv)
+    args.apps = [int(size) for size in args.apps.split(",")]
+    args.phases = args.phases.split(",")
+
+    return args
+
+
+def main(argv: list):
+    args = parse_args(argv)
+    results = {
+        "benchmark": "scale",
+        "version": __version__,
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "jobs": args.jobs,
+        "results": [],
+    }
+
+    for num_apps in args.apps:
+        work_dir = tempfile.mkdtemp(prefix=f"bench_scale_{num_apps}_", dir=args.workdir)
+        try:
+            results["results"].append(run_bundle(num_apps, args, work_dir))
+        finally:
+            if args.keep:
+                print(f"Workspace kept in {work_dir}", file=sys.stderr)
+            else:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    failed = [
+        f"{bundle['apps']} apps, {phase['phase']}"
+        for bundle in results["results"]
+        for phase in bundle["phases"]
+        if not phase["ok"]
+    ]
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r") as stream:
+            regressions = compare(results, json.load(stream), args.tolerance)
+        results["regressions"] = regressions
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as stream:
+            stream.write(output + "\n")
+
+    return 1 if (failed or regressions) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Startup benchmark: cold-start cost of the CLI for commands that shouldn't need much
+(--version, --help, a single task's --help). Each command runs in a fresh interpreter.
+The time spent importing invoke is reported separately and left out of the budget,
+so the budget only covers this package's own import and task-loading cost.
+
+Exits with status 1 if a command goes over its time budget, or imports a module it
+shouldn't (e.g. --version importing jinja2).
+
+Usage: python benchmarks/bench_startup.py [runs] [budget_scale]
+    budget_scale multiplies every time budget, for slow CI machines. Defaults to 1.
+"""
+
+import json, os, statistics, subprocess, sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Heavy dependencies that are only needed once a task actually does something
+HEAVY_MODULES = [
+    "jinja2",
+    "ruamel.yaml",
+    "structlog",
+    "http.client",
+    "multiprocessing",
+    "tarfile",
+]
+
+# Command line, max own startup time (ms), modules that must not be imported
+SCENARIOS = [
+    (["--version"], 15, HEAVY_MODULES + ["argocd_app_bootstrap.tasks.common.actions"]),
+    (["--help"], 60, HEAVY_MODULES),
+    (["argo-run.remove-project", "--help"], 60, HEAVY_MODULES),
+]
+
+# Runs in a fresh interpreter. Prints a JSON result on stderr, since stdout gets the CLI output.
+PROBE = """
+import contextlib, io, json, sys, time
+
+start = time.perf_counter()
+import invoke
+invoke_ms = (time.perf_counter() - start) * 1000
+
+start = time.perf_counter()
+from argocd_app_bootstrap.main import program
+with contextlib.redirect_stdout(io.StringIO()):
+    program.run(["argo-bootstrap"] + sys.argv[1:], exit=False)
+own_ms = (time.perf_counter() - start) * 1000
+
+print(json.dumps({"invoke_ms": invoke_ms, "own_ms": own_ms, "modules": sorted(sys.modules)}), file=sys.stderr)
+"""
+
+## ------------------
+
+
+def probe(argv: list):
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE] + argv,
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stderr.strip().splitlines()[-1])
+
+
+## ------------------
+
+
+def main(runs=5, budget_scale=1.0):
+    results = []
+    failed = False
+
+    for argv, budget_ms, forbidden in SCENARIOS:
+        probes = [probe(argv) for _ in range(runs)]
+        own_ms = statistics.median(p["own_ms"] for p in probes)
+        invoke_ms = statistics.median(p["invoke_ms"] for p in probes)
+        imported = [module for module in forbidden if module in probes[0]["modules"]]
+        over_budget = own_ms > budget_ms * budget_scale
+
+        results.append(
+            {
+                "command": " ".join(argv),
+                "own_ms": round(own_ms, 1),
+                "budget_ms": round(budget_ms * budget_scale, 1),
+                "invoke_ms": round(invoke_ms, 1),
+                "forbidden_imports": imported,
+                "ok": not (over_budget or imported),
+            }
+        )
+        failed = failed or over_budget or bool(imported)
+
+    print(
+        json.dumps({"benchmark": "startup", "runs": runs, "results": results}, indent=2)
+    )
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(
+        main(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 5,
+            float(sys.argv[2]) if len(sys.argv) > 2 else 1.0,
+        )
+    )
@@ -0,0 +1,236 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Fake argocd and kubectl CLIs for the benchmarks. They implement the handful of commands
+the tasks run, and keep their state as one small JSON file per object under
+$FAKE_CLI_STATE, so that concurrent calls don't need a lock and a call's cost doesn't
+grow with the number of apps (except app list, like the real thing).
+
+* kubectl apply -f FILE registers an AppProject or Application
+* argocd app sync on an app that was applied with kubectl creates the Applications
+  found under its source path (like a root app would), labelled with its name
+* argocd app sync records a Succeeded sync operation, started at the time of the call
+
+Usage: python benchmarks/fake_cli.py argocd|kubectl [args...]
+"""
+
+import hashlib, json, os, re, sys, time
+
+KIND_RE = re.compile(r"^kind:\s*(\S+)", re.MULTILINE)
+NAME_RE = re.compile(r"^  name:\s*(\S+)", re.MULTILINE)
+PATH_RE = re.compile(r"^    path:\s*(\S+)", re.MULTILINE)
+
+INSTANCE_LABEL = "app.kubernetes.io/instance"
+
+## ------------------
+
+
+def state_path(kind: str, name: str):
+    path = os.path.join(os.environ["FAKE_CLI_STATE"], kind)
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, hashlib.sha1(name.encode("utf-8")).hexdigest())
+
+
+def save(kind: str, name: str, obj: dict):
+    path = state_path(kind, name)
+    with open(f"{path}.{os.getpid()}", "w") as stream:
+        json.dump(obj, stream)
+    os.replace(f"{path}.{os.getpid()}", path)
+
+
+def load(kind: str, name: str):
+    try:
+        with open(state_path(kind, name), "r") as stream:
+            return json.load(stream)
+    except FileNotFoundError:
+        return None
+
+
+def remove(kind: str, name: str):
+    try:
+        os.remove(state_path(kind, name))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def load_all(kind: str):
+    path = os.path.join(os.environ["FAKE_CLI_STATE"], kind)
+    objects = []
+    for entry in os.scandir(path) if os.path.isdir(path) else []:
+        if "." not in entry.name:
+            with open(entry.path, "r") as stream:
+                objects.append(json.load(stream))
+
+    return objects
+
+
+## ------------------
+
+
+def parse_manifest(path: str):
+    with open(path, "r") as stream:
+        content = stream.read()
+
+    source_path = PATH_RE.search(content)
+    return {
+        "kind": KIND_RE.search(content).group(1),
+        "name": NAME_RE.search(content).group(1),
+        "source_path": source_path.group(1) if source_path else None,
+    }
+
+
+def find_repo_root(path: str):
+    directory = os.path.dirname(os.path.abspath(path))
+    while not os.path.isdir(os.path.join(directory, ".git")):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+    return directory
+
+
+def fail(message: str):
+    print(message, file=sys.stderr)
+    return 1
+
+
+## ------------------
+
+
+def kubectl(args: list):
+    if args[:2] != ["apply", "-f"]:
+        return fail(f"fake kubectl: unsupported command {args}")
+
+    manifest = parse_manifest(args[2])
+    if manifest["kind"] == "AppProject":
+        save("projects", manifest["name"], {"name": manifest["name"]})
+    elif manifest["kind"] == "Application":
+        save(
+            "apps",
+            manifest["name"],
+            {
+                "name": manifest["name"],
+                "labels": {},
+                "synced": False,
+                "repo_root": find_repo_root(args[2]),
+                "source_path": manifest["source_path"],
+            },
+        )
+    else:
+        return fail(f"fake kubectl: unsupported kind {manifest['kind']}")
+
+    print(f"{manifest['kind'].lower()}/{manifest['name']} configured")
+    return 0
+
+
+## ------------------
+
+
+def app_to_json(app: dict):
+    status = {
+        "sync": {"status": "Synced" if app["synced"] else "OutOfSync"},
+        "health": {"status": "Healthy" if app["synced"] else "Missing"},
+    }
+    if app.get("operation_state"):
+        status["sync"]["revision"] = app["operation_state"]["syncResult"]["revision"]
+        status["operationState"] = app["operation_state"]
+
+    return {
+        "metadata": {"name": app["name"], "labels": app["labels"]},
+        "status": status,
+    }
+
+
+def matches(app: dict, selector: str):
+    if selector is None:
+        return True
+
+    key, _, value = selector.partition("=")
+    return app["labels"].get(key) == value
+
+
+def sync_app(app: dict):
+    # Apps applied with kubectl act like root apps: syncing them creates their children
+    if app.get("repo_root") and app.get("source_path"):
+        children_path = os.path.join(app["repo_root"], app["source_path"])
+        for entry in sorted(os.scandir(children_path), key=lambda e: e.name):
+            if not entry.name.endswith(".yml"):
+                continue
+            manifest = parse_manifest(entry.path)
+            if (
+                manifest["kind"] == "Application"
+                and load("apps", manifest["name"]) is None
+            ):
+                save(
+                    "apps",
+                    manifest["name"],
+                    {
+                        "name": manifest["name"],
+                        "labels": {INSTANCE_LABEL: app["name"]},
+                        "synced": False,
+                    },
+                )
+
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    app["synced"] = True
+    app["operation_state"] = {
+        "phase": "Succeeded",
+        "startedAt": now,
+        "finishedAt": now,
+        "syncResult": {"revision": "HEAD"},
+    }
+    save("apps", app["name"], app)
+
+
+def argocd(args: list):
+    command = " ".join(args[:2])
+    selector = args[args.index("-l") + 1] if "-l" in args else None
+
+    if args[:1] == ["login"]:
+        print("'admin:login' logged in successfully")
+    elif command == "repo add":
+        save("repos", args[2], {"url": args[2]})
+    elif command == "repo rm":
+        if not remove("repos", args[2]):
+            return fail(f"repository {args[2]} not found")
+    elif command == "repo list":
+        for repo in sorted(load_all("repos"), key=lambda repo: repo["url"]):
+            print(repo["url"])
+    elif command == "app list":
+        apps = [app for app in load_all("apps") if matches(app, selector)]
+        print(json.dumps([app_to_json(app) for app in apps]))
+    elif command == "app sync":
+        if selector is not None:
+            for app in load_all("apps"):
+                if matches(app, selector):
+                    sync_app(app)
+        else:
+            app = load("apps", args[2])
+            if app is None:
+                return fail(f"application {args[2]} not found")
+            sync_app(app)
+    elif command == "app delete":
+        if load("apps", args[2]) is None:
+            return fail(f"application {args[2]} not found")
+        for app in load_all("apps"):
+            if app["labels"].get(INSTANCE_LABEL) == args[2]:
+                remove("apps", app["name"])
+        remove("apps", args[2])
+    elif command == "proj delete":
+        if not remove("projects", args[2]):
+            return fail(f"project {args[2]} not found")
+    else:
+        return fail(f"fake argocd: unsupported command {args}")
+
+    return 0
+
+
+## ------------------
+
+
+if __name__ == "__main__":
+    commands = {"argocd": argocd, "kubectl": kubectl}
+    sys.exit(commands[sys.argv[1]](sys.argv[2:]))
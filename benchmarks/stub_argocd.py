@@ -0,0 +1,198 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Stub ArgoCD API server implementing the handful of REST endpoints used by the REST backend.
+State is kept in memory. Handy for exercising the REST backend without a cluster.
+
+Usage: python benchmarks/stub_argocd.py [port]
+"""
+
+import json, sys, time, threading
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+TOKEN = "stub-token"
+
+## ------------------
+
+
+class StubArgoCD:
+    """
+    In-memory ArgoCD API server.
+
+    Args:
+        port (int, optional): Port to listen on. Defaults to 0 (pick a free port).
+        username (str, optional): Accepted username. Defaults to admin.
+        password (str, optional): Accepted password. Defaults to password.
+    """
+
+    def __init__(self, port=0, username="admin", password="password"):
+        self.username = username
+        self.password = password
+        self.repos = {}
+        self.apps = {}
+        self.projects = set()
+        self.requests = Counter()
+        self.connections = 0
+        self.lock = threading.Lock()
+
+        stub = self
+
+        class Handler(StubHandler):
+            server_state = stub
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_app(self, name: str, labels=None, project="default"):
+        """
+        Create an application, as kubectl apply would.
+        """
+
+        with self.lock:
+            self.apps[name] = {
+                "metadata": {"name": name, "labels": labels or {}},
+                "spec": {"project": project},
+                "status": {
+                    "sync": {"status": "OutOfSync"},
+                    "health": {"status": "Missing"},
+                },
+            }
+
+
+## ------------------
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server_state.lock:
+            self.server_state.connections += 1
+
+    def _send(self, status: int, payload=None):
+        body = json.dumps(payload if payload is not None else {}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _dispatch(self, method: str):
+        state = self.server_state
+        url = urlparse(self.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        body = self._body()
+
+        with state.lock:
+            state.requests[f"{method} /{'/'.join(parts[:3])}"] += 1
+
+        if parts[:3] == ["api", "v1", "session"] and method == "POST":
+            if (body.get("username"), body.get("password")) != (
+                state.username,
+                state.password,
+            ):
+                return self._send(401, {"message": "Invalid username or password"})
+            return self._send(200, {"token": TOKEN})
+
+        if self.headers.get("Authorization") != f"Bearer {TOKEN}":
+            return self._send(401, {"message": "no session information"})
+
+        with state.lock:
+            return self._route(method, parts[2:], parse_qs(url.query), body)
+
+    def _route(self, method, parts, query, body):
+        state = self.server_state
+        resource = parts[0] if parts else ""
+        name = parts[1] if len(parts) > 1 else None
+
+        if resource == "repositories":
+            if method == "GET":
+                return self._send(
+                    200, {"items": [{"repo": repo} for repo in state.repos]}
+                )
+            if method == "POST":
+                state.repos[body["repo"]] = body
+                return self._send(200, {"repo": body["repo"]})
+            if method == "DELETE":
+                if state.repos.pop(name, None) is None:
+                    return self._send(404, {"message": f"repo {name} not found"})
+                return self._send(200)
+
+        if resource == "applications":
+            if method == "GET" and name is None:
+                items = list(state.apps.values())
+                for selector in query.get("selector", []):
+                    key, _, value = selector.partition("=")
+                    items = [
+                        app
+                        for app in items
+                        if app["metadata"]["labels"].get(key) == value
+                    ]
+                return self._send(200, {"items": items})
+            if name not in state.apps:
+                return self._send(404, {"message": f"application {name} not found"})
+            if method == "GET":
+                return self._send(200, state.apps[name])
+            if method == "POST" and parts[2:] == ["sync"]:
+                now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                state.apps[name]["status"] = {
+                    "sync": {"status": "Synced", "revision": "HEAD"},
+                    "health": {"status": "Healthy"},
+                    "operationState": {
+                        "phase": "Succeeded",
+                        "startedAt": now,
+                        "finishedAt": now,
+                        "syncResult": {"revision": "HEAD"},
+                    },
+                }
+                return self._send(200, state.apps[name])
+            if method == "DELETE":
+                del state.apps[name]
+                return self._send(200)
+
+        if resource == "projects" and method == "DELETE":
+            state.projects.discard(name)
+            return self._send(200)
+
+        return self._send(404, {"message": f"unknown endpoint {self.path}"})
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+## ------------------
+
+if __name__ == "__main__":
+    stub = StubArgoCD(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8080)
+    print(f"Stub ArgoCD API server listening on 127.0.0.1:{stub.port}")
+    stub.server.serve_forever()
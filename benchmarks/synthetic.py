@@ -0,0 +1,78 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Helpers for generating synthetic app bundles for the benchmarks.
+"""
+
+import os
+
+from argocd_app_bootstrap.definitions import ARGO_PROJ_YAML, yaml
+
+## ------------------
+
+
+def make_argo_proj(
+    num_apps: int, repo_prefix="https://github.com/example", deploy_plugin=True
+):
+    """
+    Build an argo_proj.yml-shaped dict with the given number of child apps.
+
+    Args:
+        num_apps (int): Number of child apps
+        repo_prefix (str, optional): URL prefix used for the parent and child repos.
+        deploy_plugin (bool, optional): If true, use the kustomized-helm plugin for every app.
+
+    Returns:
+        dict: The argo_proj.yml contents
+    """
+
+    apps = []
+    for i in range(num_apps):
+        app = {
+            "name": f"svc_{i:05d}",
+            "repo_url": f"{repo_prefix}/svc-{i:05d}",
+            "namespace": f"svc-{i:05d}",
+            "manifest_path": "kustomized_helm/overlays/dev",
+        }
+        if deploy_plugin:
+            app["deploy_plugin"] = "kustomized-helm"
+        apps.append(app)
+
+    return {
+        "argocd": {
+            "project": {
+                "name": "bench-project",
+                "description": "Synthetic benchmark project",
+            },
+            "parent_app": {
+                "name": "bench",
+                "repo_url": f"{repo_prefix}/bench-parent",
+                "version": 1.0,
+            },
+            "child_apps": {"destination_cluster": "in-cluster", "app": apps},
+        }
+    }
+
+
+## ------------------
+
+
+def write_argo_proj(target_dir: str, num_apps: int, **kwargs):
+    """
+    Write a synthetic argo_proj.yml to the target folder.
+
+    Args:
+        target_dir (str): Folder to write argo_proj.yml to
+        num_apps (int): Number of child apps
+
+    Returns:
+        str: Path of the argo_proj.yml file
+    """
+
+    os.makedirs(target_dir, exist_ok=True)
+    path = os.path.join(target_dir, ARGO_PROJ_YAML)
+    with open(path, "w") as stream:
+        yaml.dump(make_argo_proj(num_apps, **kwargs), stream)
+
+    return path